@@ -10,14 +10,51 @@ import numpy as np
 import pandas as pd
 import os
 import re
+import sys
+import json
+from contextlib import contextmanager
+import shutil
+import hashlib
+import importlib.util
 from datetime import datetime
 import time
-import tkinter as tk
-from tkinter import filedialog
+# the modules shared by the TOV640 tools are in the TOV640 folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_profile import profiling_modes, start_profile, stage, write_profile
+import exception_reports
 pd.options.mode.chained_assignment = None
 
-# value of chain length to close consecutive rows
-chain_length = 0.002
+# default chain length (km), exceptions closer than it are merged into one
+default_chain_length = 0.002
+
+# columns of the .datac file (with spaces removed) used by the generator and their names in the pipeline
+datac_columns = {'Date': 'Date', 'LINE': 'Line', 'TRACK': 'Track', 'KM': 'KM', 'LOCATION': 'LOCATION',
+                 'WHGT1c': 'height1', 'WHGT2c': 'height2', 'WHGT3c': 'height3', 'WHGT4c': 'height4',
+                 'RWH1mm': 'wear1', 'RWH2mm': 'wear2', 'RWH3mm': 'wear3', 'RWH4mm': 'wear4',
+                 'STG1c': 'stagger1', 'STG2c': 'stagger2', 'STG3c': 'stagger3', 'STG4c': 'stagger4'}
+
+# dtypes of the .datac columns, the channels stay float64 so the report shows the values as recorded
+datac_dtypes = {name: 'float64' for name in datac_columns.values()}
+datac_dtypes.update({'Date': 'str', 'Line': 'str', 'Track': 'str'})
+
+# number of .datac rows parsed at a time, this bounds the text the parser holds, not the memory of the whole read
+datac_chunksize = 200000
+
+# folder storing the cleaned .datac recordings for later runs
+cache_directory = './cache'
+
+# engine writing the Exception Report, xlsxwriter streams the rows to the file if it is installed
+report_engine = 'xlsxwriter' if importlib.util.find_spec('xlsxwriter') else 'openpyxl'
+
+# formats of the copy of the exception tables that can be saved next to the Exception Report
+sidecar_formats = ['csv', 'parquet']
+
+# sheets of the metadata holding the exception boundaries, the first one found is read
+# (older metadata files named it Exception Boundarys)
+exception_boundary_sheets = ['Exception Boundary', 'Exception Boundarys']
+
+# exception history shared with the find repeated and trend tools, every saved report is appended to it
+history_path = exception_reports.history_path
 
 
 def file_input():
@@ -32,7 +69,7 @@ def file_input():
         line (str): The name of the line.
         section (str): The section of the line.
         track (str): The track of the line.
-        raw (DataFrame): The data from input .datac file.
+        raw_data_path (str): The path to the input .datac file.
     """
     print('================ TOV640 Exception Report Generator ================')
     print('Before you start, please go through the following instructions' + 
@@ -99,15 +136,102 @@ def file_input():
         print(f"{i}", end="\r", flush=True)
         time.sleep(1)
     # ---------- allow user to select csv files -------
+    # tkinter is only imported by the interactive program, so the generator can be imported where it is not installed
+    import tkinter as tk
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     raw_data_path = filedialog.askopenfilename()
     print("raw:", raw_data_path)
-    raw = pd.read_csv(raw_data_path, sep=';', engine='python').apply(lambda x: x.str.strip() if x.dtype == "object" else x)
     print('Selected: ' + os.path.basename(raw_data_path))
     # ---------- allow user to select csv files -------
 
-    return line, section, track, raw
+    return line, section, track, raw_data_path
+
+
+@contextmanager
+def exit_on_error(message=None):
+    """
+    Prints the error raised inside the block and exits after the user presses Enter,
+    so the console of the interactive program stays open to show it.
+
+    Args:
+        message (str): The message printed after the error. Defaults to None.
+    """
+    try:
+        yield
+    except FileNotFoundError as err:
+        print(err)
+        print('Please make sure the metadata.xlsx file is stored in the metadata folder, and the metadata folder is located at the same directory as this .exe program.')
+        input('Press Enter to exit')
+        exit()
+    except Exception:
+        print(traceback.format_exc())
+        if message is not None:
+            print(message)
+        input('Press Enter to exit')
+        exit()
+
+
+def iter_datac_chunks(raw_data_path, chunksize=datac_chunksize):
+    """
+    Reads the .datac file in chunks with the C parser and yields the typed chunks.
+
+    Only the columns in datac_columns are read. The header rows repeated inside the file
+    are parsed as missing values and dropped, so every channel is read straight into float64.
+    Only one chunk is held at a time, as long as the caller does not keep the chunks.
+
+    Args:
+        raw_data_path (str): The path to the .datac file.
+        chunksize (int): The number of rows parsed at a time.
+
+    Yields:
+        chunk (DataFrame): The typed rows of the chunk with the columns renamed as in datac_columns.
+    """
+    header = pd.read_csv(raw_data_path, sep=';', skipinitialspace=True, nrows=0).columns
+    names = {column: datac_columns[column.replace(' ', '')] for column in header
+             if column.replace(' ', '') in datac_columns}
+    missing = set(datac_columns.values()) - set(names.values())
+    if missing:
+        raise ValueError('Missing columns in ' + os.path.basename(raw_data_path) + ': ' + ', '.join(sorted(missing)))
+
+    reader = pd.read_csv(raw_data_path, sep=';', engine='c', skipinitialspace=True, usecols=list(names),
+                         dtype={column: datac_dtypes[name] for column, name in names.items()},
+                         na_values={column: [column, column.strip(), ''] for column in names},
+                         keep_default_na=False, chunksize=chunksize)
+    for chunk in reader:
+        chunk = chunk.rename(names, axis=1)
+        chunk = chunk[chunk['KM'].notna()]
+        for column in ['Date', 'Line', 'Track']:
+            chunk[column] = chunk[column].str.strip().astype('category')
+        yield chunk
+
+
+def read_datac(raw_data_path, chunksize=datac_chunksize):
+    """
+    Reads the whole .datac file chunk by chunk into one typed DataFrame.
+
+    This is not a constant memory read: every chunk is kept and then joined, so at the peak the chunks and the joined
+    table are both held, about twice the size of the typed data. The chunks only keep the parser from holding the
+    whole file as text.
+
+    Args:
+        raw_data_path (str): The path to the .datac file.
+        chunksize (int): The number of rows parsed at a time.
+
+    Returns:
+        raw (DataFrame): The typed data from input .datac file.
+    """
+    chunks = list(iter_datac_chunks(raw_data_path, chunksize))
+    if not chunks:
+        raise ValueError('No data found in ' + os.path.basename(raw_data_path))
+
+    # keeps the text columns categorical across the chunks
+    for column in ['Date', 'Line', 'Track']:
+        categories = pd.api.types.union_categoricals([chunk[column] for chunk in chunks]).categories
+        for chunk in chunks:
+            chunk[column] = chunk[column].cat.set_categories(categories)
+    return pd.concat(chunks, ignore_index=True)
 
 
 def output_date(raw):
@@ -146,15 +270,140 @@ def m_to_km(in_table, column1, column2):
     return in_table
 
 
-def load_metadata(line, section, track):
+def build_interval_index(starts, ends, priority=None):
     """
-    Loads metadata from the corresponding .xlsx file and returns four lookup tables of the line/ section.
+    Builds a lookup index of closed intervals [start, end] for binary search.
+
+    Splits the line into elementary segments at every interval boundary and resolves, once,
+    which interval owns each segment. When a location falls in more than one interval,
+    the interval with the lowest priority wins; ties go to the interval listed first.
+    Rows with a missing boundary or with start > end never match, like Series.between.
+
+    Args:
+        starts (array-like): The start of each interval.
+        ends (array-like): The end of each interval.
+        priority (array-like): Optional rank of each interval, lowest wins. Defaults to the row order.
+
+    Returns:
+        bounds (ndarray): The sorted left edges of the elementary segments.
+        owner (ndarray): The row position of the interval owning each segment, -1 if none.
+    """
+    starts = np.asarray(starts, dtype=float)
+    ends = np.asarray(ends, dtype=float)
+    if priority is None:
+        priority = np.arange(len(starts), dtype=float)
+    priority = np.asarray(priority, dtype=float)
+
+    rows = np.flatnonzero(~np.isnan(starts) & ~np.isnan(ends) & (starts <= ends))
+    if len(rows) == 0:
+        return np.array([]), np.array([], dtype=int)
+    # The right edge is closed, so a segment ends just after the last value an interval covers
+    bounds = np.unique(np.concatenate([starts[rows], np.nextafter(ends[rows], np.inf)]))
+
+    # Metadata tables only have a few hundred rows, so resolving every segment at once is cheap
+    inside = (starts[rows] <= bounds[:, None]) & (bounds[:, None] <= ends[rows])
+    best = np.where(inside, priority[rows], np.inf).argmin(axis=1)
+    owner = np.where(inside.any(axis=1), rows[best], -1)
+    return bounds, owner
+
+
+def lookup_interval(interval_index, values):
+    """
+    Finds the interval containing each value with a single binary search.
+
+    Args:
+        interval_index (tuple): The (bounds, owner) pair returned by build_interval_index.
+        values (array-like): The locations to be looked up.
+
+    Returns:
+        (ndarray): The row position of the containing interval for each value, -1 if none.
+    """
+    bounds, owner = interval_index
+    values = np.asarray(values, dtype=float)
+    if len(bounds) == 0:
+        return np.full(len(values), -1)
+    segment = np.searchsorted(bounds, values, side='right') - 1
+    return np.where(segment >= 0, owner[segment.clip(0)], -1)
+
+
+def read_metadata(metadata_path, line, section, track):
+    """
+    Reads the lookup tables of the line/ section from a metadata .xlsx file, opening the workbook once.
 
-    If the line is TML, reads the lookup table of the corresponding track in "./metadata/TML metadata.xlsx".
+    If the line is TML, reads the lookup table of the corresponding track.
+    If the line is EAL, identifies if the section is either LMC, RAC, or LOW and reads the corresponding lookup table.
     Converts the units of the values from M to KM since the data in the .datac is in KM.
 
-    If the line is EAL, identifies if the section is either LMC, RAC, or LOW.
-    Then, reads the corresponding lookup table in "./metadata/EAL metadata.xlsx".
+    The tables can be read once and passed to generate_exceptions for every recording of the line/ section.
+
+    Args:
+        metadata_path (str): The path to the metadata .xlsx file of the line.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+
+    Returns:
+        (dict): The lookup tables keyed by their name:
+            track type (DataFrame): The track type at different locations of the line.
+            overlap (DataFrame): The overlap and tension length of the line.
+            landmark (DataFrame): The landmark of the line.
+            threshold (DataFrame): The threshold of the line, as returned by compile_thresholds.
+            exception boundary (DataFrame): The Exception Boundary sheet, None if the workbook does not have it.
+    """
+    if line == 'TML':
+        sheetName = 'TML ' + track
+    elif section in ['LMC', 'RAC', 'LOW']:
+        if section == 'LOW':
+            sheetName = 'LOW S1'
+        else:
+            sheetName = section + ' ' + track
+    else:
+        sheetName = 'EAL ' + track
+
+    with pd.ExcelFile(metadata_path) as workbook:
+        metadata = workbook.parse(sheetName)
+        threshold = workbook.parse('threshold')
+        exception_boundary = parse_exception_boundary(workbook)
+
+    # splits the combined lookup table into three tables
+    track_type = metadata[['track type', 'Track Type startM', 'Track Type endM']]\
+        .dropna(how='all').rename({'Track Type startM': 'startKM', 'Track Type endM': 'endKM'}, axis=1)
+    overlap = metadata[['Overlap FromM', 'Overlap ToM', 'Overlap', 'Tension Length']]\
+        .dropna(how='all').rename({'Overlap FromM': 'FromKM', 'Overlap ToM': 'ToKM'}, axis=1)
+    landmark = metadata[['Landmark FromM', 'Landmark ToM', 'Landmark']]\
+        .dropna(how='all').rename({'Landmark FromM': 'FromKM', 'Landmark ToM': 'ToKM'}, axis=1)
+
+    # Converts from m to km to match the units with .datac
+    track_type = m_to_km(track_type, 'startKM', 'endKM')
+    overlap = m_to_km(overlap, 'FromKM', 'ToKM')
+    landmark = m_to_km(landmark, 'FromKM', 'ToKM')
+    overlap['Overlap'] = overlap['Overlap'].fillna('N')
+    return {'track type': track_type, 'overlap': overlap, 'landmark': landmark,
+            'threshold': compile_thresholds(threshold), 'exception boundary': exception_boundary}
+
+
+def parse_exception_boundary(workbook):
+    """
+    Parses the exception boundaries of an opened metadata workbook.
+
+    Args:
+        workbook (ExcelFile): The metadata .xlsx file.
+
+    Returns:
+        (DataFrame): The first of exception_boundary_sheets in the workbook, None if it has none of them.
+    """
+    for sheet_name in exception_boundary_sheets:
+        if sheet_name in workbook.sheet_names:
+            return workbook.parse(sheet_name)
+    return None
+
+
+def load_metadata(line, section, track):
+    """
+    Loads metadata from the corresponding .xlsx file and returns four lookup tables of the line/ section.
+
+    Assumes the metadata files are stored in the metadata folder,
+    "./metadata/TML metadata.xlsx" or "./metadata/EAL metadata.xlsx", see read_metadata.
 
     Args:
         line (str): The name of the line.
@@ -165,58 +414,366 @@ def load_metadata(line, section, track):
         track_type (DataFrame): The track type at different locations of the line.
         overlap (DataFrame): The overlap and tension length of the line.
         landmark (DataFrame): The landmark of the line.
-        threshold (DataFrame): The threshold of the line.
+        threshold (DataFrame): The threshold of the line, as returned by compile_thresholds.
+    """
+    metadata = read_metadata('./metadata/' + line + ' metadata.xlsx', line, section, track)
+    print('Loading...')
+    return metadata['track type'], metadata['overlap'], metadata['landmark'], metadata['threshold']
+
+
+def compile_thresholds(threshold):
+    """
+    Compiles the threshold sheet into a lookup table of the limits of every level.
+
+    Each "<exception type> L<n>" row of the sheet becomes the Ln_min and Ln_max columns
+    of its (exception type, Class, Track Type), e.g. ('Stagger', 'KSL', 'Curve').
+    Rows of other types (normal) are ignored and missing levels are NaN.
+
+    Args:
+        threshold (DataFrame): The threshold sheet of the metadata.
+
+    Returns:
+        (DataFrame): The L1_min, L1_max, L2_min, L2_max, L3_min and L3_max columns,
+            indexed by exception type, Class and Track Type.
+    """
+    levels = threshold['Exc Type'].str.strip().str.extract(r'^(?P<type>.+) (?P<level>L\d)$')
+    threshold = pd.concat([threshold[['Class', 'Track Type', 'min', 'max']], levels], axis=1).dropna(subset=['level'])
+    threshold['Class'] = threshold['Class'].str.strip()
+    threshold['Track Type'] = threshold['Track Type'].str.strip()
+
+    compiled = threshold.groupby(['type', 'Class', 'Track Type', 'level'])[['min', 'max']].first().unstack('level')
+    compiled.columns = [level + '_' + bound for bound, level in compiled.columns]
+    compiled.index.names = ['exception type', 'Class', 'Track Type']
+    return compiled.reindex(columns=['L1_min', 'L1_max', 'L2_min', 'L2_max', 'L3_min', 'L3_max'])
+
+
+def gather_thresholds(threshold, exception_type, table, section):
+    """
+    Gathers the L1/L2/L3 limits of every row of a table from the compiled threshold table.
+
+    A row takes the limits of its Section, or else of the section of the run (e.g. LMC),
+    or else of the whole line ('both'). The limits depend on the track type only if the
+    threshold sheet splits the exception type by track type (stagger).
+
+    Args:
+        threshold (DataFrame): The compiled threshold of the line, as returned by compile_thresholds.
+        exception_type (str): The exception type without level, e.g. 'Low Height'.
+        table (DataFrame): The table with the Section and track type columns.
+        section (str): The section of the line.
+
+    Returns:
+        (DataFrame): The limits of each row of the table, NaN where the level is not defined.
+    """
+    limits = threshold.loc[exception_type]
+    if (limits.index.get_level_values('Track Type') == 'both').all():
+        track_type = np.full(len(table), 'both', dtype=object)
+    else:
+        track_type = table['track type'].to_numpy(dtype=object)
+
+    position = limits.index.get_indexer(pd.MultiIndex.from_arrays([table['Section'].to_numpy(dtype=object), track_type]))
+    for fallback in [section, 'both']:
+        missing = position < 0
+        position[missing] = limits.index.get_indexer(
+            pd.MultiIndex.from_arrays([np.full(missing.sum(), fallback, dtype=object), track_type[missing]]))
+
+    # the extra row of NaN is gathered by the rows without any limits (position -1)
+    values = np.vstack([limits.to_numpy(dtype=float), np.full((1, limits.shape[1]), np.nan)])
+    return pd.DataFrame(values[position], columns=limits.columns, index=table.index)
+
+
+def assign_track_type(table, km_track_type):
+    """
+    Writes the track type column of a table grouped by Km.
+    Rows whose Km is not covered by any track type are dropped.
+
+    Args:
+        table (DataFrame): The table with a Km column.
+        km_track_type (Series): The track type of each Km, indexed by Km.
+
+    Returns:
+        table (DataFrame): The table with the added track type column.
+    """
+    table = table[table['Km'].isin(km_track_type.index)].reset_index(drop=True)
+    table['track type'] = table['Km'].map(km_track_type)
+    return table
+
+
+def clean_raw(raw, line, track, section, exception_boundary=None):
+    """
+    Cleans the data in the .datac file.
+
+    Calculates the location (Km) of each row, adds the 5300 offset to the heights
+    and assigns the corresponding section of the line to all data points.
+
+    Args:
+        raw (DataFrame): The typed data from input .datac file, as returned by read_datac.
+        line (str): The name of the line.
+        track (str): The track of the line.
+        section (str): The section of the line.
+        exception_boundary (DataFrame): The Exception Boundary sheet of the metadata, as returned by read_metadata.
+            Defaults to None (reads it from the metadata folder).
+
+    Returns:
+        raw (DataFrame): Cleaned data from input .datac file.
+    """
+    raw['Km'] = raw['KM'] + raw['LOCATION']*0.001
+    raw['height1'] = raw['height1'] + 5300
+    raw['height2'] = raw['height2'] + 5300
+    raw['height3'] = raw['height3'] + 5300
+    raw['height4'] = raw['height4'] + 5300
+    raw = raw[['Line', 'Track', 'Km', 'height1', 'height2', 'height3', 'height4', 'wear1',
+            'wear2', 'wear3', 'wear4', 'stagger1', 'stagger2', 'stagger3', 'stagger4']]
+    raw['Km'] = raw['Km'].round(decimals=5)
+    raw['Section'] = ''
+
+    # Finds and assigns the corresponding section to all data points
+    if exception_boundary is None:
+        with pd.ExcelFile('./metadata/' + line + ' metadata.xlsx') as workbook:
+            exception_boundary = parse_exception_boundary(workbook)
+        if exception_boundary is None:
+            raise ValueError('The metadata has no Exception Boundary sheet')
+    # converts a copy, the same sheet can be used for more than one recording
+    exception_boundary = exception_boundary.copy()
+    if track == 'UP':
+        exception_boundary = m_to_km(exception_boundary, 'Up Track From', 'Up Track To')
+        exception_boundary = exception_boundary[['Class', 'Up Track From', 'Up Track To']]\
+            .rename({'Up Track From': 'FromKM', 'Up Track To': 'ToKM'}, axis=1)
+    else:
+        exception_boundary = m_to_km(exception_boundary, 'Down Track From', 'Down Track To')
+        exception_boundary = exception_boundary[['Class', 'Down Track From', 'Down Track To']]\
+            .rename({'Down Track From': 'FromKM', 'Down Track To': 'ToKM'}, axis=1)
+    
+    if line == 'TML':
+        MOL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'MOL', 'FromKM'].values[0]
+        MOL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'MOL', 'ToKM'].values[0]
+        SCL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'FromKM'].values[0]
+        SCL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'ToKM'].values[0]
+        ETSE_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'ETSE', 'FromKM'].values[0]
+        ETSE_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'ETSE', 'ToKM'].values[0]
+        KSL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'KSL', 'FromKM'].values[0]
+        KSL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'KSL', 'ToKM'].values[0]
+        WRL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'WRL', 'FromKM'].values[0]
+        WRL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'WRL', 'ToKM'].values[0]
+
+        if track == 'UP':
+            MOL_row_location = raw[(raw['Km'] >= MOL_FromKM) & (raw['Km'] <= MOL_ToKM)].index
+            SCL_row_location = raw[(raw['Km'] >= SCL_FromKM) & (raw['Km'] <= SCL_ToKM)].index
+            ETSE_row_location = raw[(raw['Km'] >= ETSE_FromKM) & (raw['Km'] <= ETSE_ToKM)].index
+            KSL_row_location = raw[(raw['Km'] >= KSL_FromKM) & (raw['Km'] <= KSL_ToKM)].index
+            WRL_row_location = raw[(raw['Km'] >= WRL_FromKM) & (raw['Km'] <= WRL_ToKM)].index
+        else:
+            MOL_row_location = raw[(raw['Km'] <= MOL_FromKM) & (raw['Km'] >= MOL_ToKM)].index
+            SCL_row_location = raw[(raw['Km'] <= SCL_FromKM) & (raw['Km'] >= SCL_ToKM)].index
+            ETSE_row_location = raw[(raw['Km'] <= ETSE_FromKM) & (raw['Km'] >= ETSE_ToKM)].index
+            KSL_row_location = raw[(raw['Km'] <= KSL_FromKM) & (raw['Km'] >= KSL_ToKM)].index
+            WRL_row_location = raw[(raw['Km'] <= WRL_FromKM) & (raw['Km'] >= WRL_ToKM)].index
+
+        raw.loc[MOL_row_location, 'Section'] = 'MOL'
+        raw.loc[SCL_row_location, 'Section'] = 'SCL'
+        raw.loc[ETSE_row_location, 'Section'] = 'ETSE'
+        raw.loc[KSL_row_location, 'Section'] = 'KSL'
+        raw.loc[WRL_row_location, 'Section'] = 'WRL'
+    elif (section not in ['LMC', 'RAC', 'LOW']):
+        SCL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'FromKM'].values[0]
+        SCL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'ToKM'].values[0]
+        EAL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'EAL', 'FromKM'].values[0]
+        EAL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'EAL', 'ToKM'].values[0]
+        if track == 'UP':
+            SCL_row_location = raw[(raw['Km'] >= SCL_FromKM) & (raw['Km'] <= SCL_ToKM)].index
+            EAL_row_location = raw[(raw['Km'] >= EAL_FromKM) & (raw['Km'] <= EAL_ToKM)].index
+        else:
+            SCL_row_location = raw[(raw['Km'] <= SCL_FromKM) & (raw['Km'] >= SCL_ToKM)].index
+            EAL_row_location = raw[(raw['Km'] <= EAL_FromKM) & (raw['Km'] >= EAL_ToKM)].index
+
+        raw.loc[SCL_row_location, 'Section'] = 'SCL'
+        raw.loc[EAL_row_location, 'Section'] = 'EAL'
+
+    return raw
+
+
+def file_hash(path):
+    """
+    Hashes the content of a file block by block.
+
+    Args:
+        path (str): The path to the file.
+
+    Returns:
+        (str): The hexadecimal blake2b digest of the file.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def recording_cache_path(raw_data_path, line, section, track):
+    """
+    Finds the cache folder of a .datac recording.
+
+    The content hash of the recording is stored with its path, size and mtime,
+    so an unchanged file is only hashed once. The folder also depends on the line, section, track
+    and the metadata file, since the sections of the cleaned data come from the metadata.
+
+    Args:
+        raw_data_path (str): The path to the .datac file.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+
+    Returns:
+        (str): The path to the cache folder of the recording.
+    """
+    stat = os.stat(raw_data_path)
+    key = {'path': os.path.abspath(raw_data_path), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    key_path = os.path.join(cache_directory, 'paths', hashlib.blake2b(key['path'].encode(), digest_size=16).hexdigest() + '.json')
+
+    stored_key = None
+    if os.path.exists(key_path):
+        with open(key_path) as f:
+            stored_key = json.load(f)
+    if stored_key is not None and all(stored_key[k] == key[k] for k in key):
+        key['hash'] = stored_key['hash']
+    else:
+        key['hash'] = file_hash(raw_data_path)
+        os.makedirs(os.path.dirname(key_path), exist_ok=True)
+        with open(key_path, 'w') as f:
+            json.dump(key, f)
+
+    metadata_stat = os.stat('./metadata/' + line + ' metadata.xlsx')
+    name = '_'.join([key['hash'], line, section, track, str(metadata_stat.st_size), str(metadata_stat.st_mtime_ns)])
+    return os.path.join(cache_directory, hashlib.blake2b(name.encode(), digest_size=16).hexdigest())
+
+
+def save_cached_recording(path, raw, date):
+    """
+    Stores the cleaned data as one .npy file per column, text columns as category codes.
+
+    Args:
+        path (str): The path to the cache folder.
+        raw (DataFrame): Cleaned data from input .datac file.
+        date (str): The date of the data was collected.
+
+    Returns:
+        None
     """
-    # Reads the corresponding metadata according to the line and the section
-    # Assumes the metadata files are stored in the metadata folder
-    # ./metadata/TML metadata.xlsx or ./metadata/EAL metadata.xlsx
+    temp_path = path + '.' + str(os.getpid()) + '.tmp'
+    os.makedirs(temp_path, exist_ok=True)
+    columns = {}
+    for column in raw.columns:
+        values = raw[column]
+        if values.dtype.kind in 'fiub':
+            np.save(os.path.join(temp_path, column + '.npy'), values.to_numpy())
+            columns[column] = None
+        else:
+            values = values.astype(str).astype('category')
+            np.save(os.path.join(temp_path, column + '.npy'), values.cat.codes.to_numpy())
+            columns[column] = values.cat.categories.to_list()
+    with open(os.path.join(temp_path, 'meta.json'), 'w') as f:
+        json.dump({'date': date, 'columns': columns}, f)
+
+    # another run may have stored the same recording in the meantime
     try:
-        if line == 'TML':
-            sheetName = 'TML ' + track
-        elif section in ['LMC', 'RAC', 'LOW']:
-            if section == 'LOW':
-                sheetName = 'LOW S1'
-            else:
-                sheetName = section + ' ' + track
+        os.rename(temp_path, path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+
+
+def load_cached_recording(path):
+    """
+    Loads the cleaned data of a cache folder, memory-mapping the numeric columns.
+    Text columns are decoded back to strings.
+
+    Args:
+        path (str): The path to the cache folder.
+
+    Returns:
+        raw (DataFrame): Cleaned data from input .datac file.
+        date (str): The date of the data was collected.
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    data = {}
+    for column, categories in meta['columns'].items():
+        values = np.load(os.path.join(path, column + '.npy'), mmap_mode='r')
+        if categories is None:
+            data[column] = values
         else:
-            sheetName = 'EAL ' + track
-
-        metadata = pd.read_excel('./metadata/' + line + ' metadata.xlsx', sheet_name=sheetName)
-         # splits the combined lookup table into three tables
-        track_type = metadata[['track type', 'Track Type startM', 'Track Type endM']]\
-            .dropna(how='all').rename({'Track Type startM': 'startKM', 'Track Type endM': 'endKM'}, axis=1)
-        overlap = metadata[['Overlap FromM', 'Overlap ToM', 'Overlap', 'Tension Length']]\
-            .dropna(how='all').rename({'Overlap FromM': 'FromKM', 'Overlap ToM': 'ToKM'}, axis=1)
-        landmark = metadata[['Landmark FromM', 'Landmark ToM', 'Landmark']]\
-            .dropna(how='all').rename({'Landmark FromM': 'FromKM', 'Landmark ToM': 'ToKM'}, axis=1)
-
-        # Converts from m to km to match the units with .datac
-        track_type = m_to_km(track_type, 'startKM', 'endKM')
-        overlap = m_to_km(overlap, 'FromKM', 'ToKM')
-        landmark = m_to_km(landmark, 'FromKM', 'ToKM')
-        threshold = pd.read_excel('./metadata/' + line + ' metadata.xlsx', sheet_name='threshold')
-        overlap['Overlap'] = overlap['Overlap'].fillna('N')
-        print('Loading...')
-        return track_type, overlap, landmark, threshold
-    except FileNotFoundError as err:
-        print(err)
-        print('Please make sure the metadata.xlsx file is stored in the metadata folder, and the metadata folder is located at the same directory as this .exe program.')
-        input('Press Enter to exit')
-        exit()
-    except Exception as err:
-        print(traceback.format_exc())
-        input('Press Enter to exit')
-        exit()
+            data[column] = np.array(categories, dtype=object)[values]
+    return pd.DataFrame(data, copy=False), meta['date']
+
+
+def load_recording(raw_data_path, line, section, track, use_cache=True):
+    """
+    Reads and cleans the .datac file, or loads it from the cache if it was read before.
+
+    Args:
+        raw_data_path (str): The path to the .datac file.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        use_cache (bool): Whether to read and store the cleaned data in cache_directory.
+
+    Returns:
+        raw (DataFrame): Cleaned data from input .datac file.
+        date (str): The date of the data was collected.
+    """
+    if use_cache:
+        path = recording_cache_path(raw_data_path, line, section, track)
+        if os.path.exists(os.path.join(path, 'meta.json')):
+            return load_cached_recording(path)
+
+    raw = read_datac(raw_data_path)
+    date = output_date(raw)
+    raw = clean_raw(raw, line, track, section)
+    if use_cache:
+        save_cached_recording(path, raw, date)
+    return raw, date
+
+
+def aggregate_by_km(raw, channels):
+    """
+    Takes the min and max of every channel at each Km in a single pass.
+
+    The rows are sorted by Km once and every run of equal Km is reduced with np.fmin/np.fmax.reduceat,
+    which skip NaN like groupby does. Rows without a Km are dropped.
 
+    Args:
+        raw (DataFrame): Cleaned data from input .datac file, as returned by clean_raw.
+        channels (list[str]): The channels to aggregate.
+
+    Returns:
+        km_min (DataFrame): The Km, the min of each channel and the Section at each Km, sorted by Km.
+        km_max (DataFrame): The Km, the max of each channel and the Section at each Km, sorted by Km.
+    """
+    km = raw['Km'].to_numpy(dtype=float)
+    order = np.argsort(km, kind='stable')
+    order = order[~np.isnan(km[order])]
+    sorted_km = km[order]
+    starts = np.flatnonzero(np.diff(sorted_km, prepend=np.nan) != 0)
+
+    values = raw[channels].to_numpy(dtype=float)[order]
+    # the Section is set by Km ranges, so every row of a Km has the same Section
+    section = raw['Section'].to_numpy()[order[starts]]
+
+    km_min = pd.DataFrame(np.fmin.reduceat(values, starts, axis=0), columns=channels)
+    km_max = pd.DataFrame(np.fmax.reduceat(values, starts, axis=0), columns=channels)
+    for table in [km_min, km_max]:
+        table.insert(0, 'Km', sorted_km[starts])
+        table['Section'] = section
+    return km_min, km_max
 
-def data_process(raw, track_type, line, track, section):
+
+def data_process(raw, track_type):
     """
     Processes the data in the .datac file.
 
     For each location of each requirement, groups and takes the max/ min value of the data out of the 4 channels.
+    All the channels are aggregated by Km once, see aggregate_by_km.
 
     Args:
-        raw (DataFrame): The data from input .datac file.
+        raw (DataFrame): Cleaned data from input .datac file, as returned by clean_raw.
         track_type (Dataframe): The track type at different locations of the line.
 
     Returns:
@@ -227,235 +784,132 @@ def data_process(raw, track_type, line, track, section):
         stagger_left (DataFrame): The left stagger values.
         stagger_right (DataFrame): The right stagger values.
     """
-    try:
-        raw.columns = raw.columns.str.replace(' ', '')
-        raw.drop(raw[raw.KM == 'KM'].index, inplace=True)
-        raw = raw.rename({'STG1c': 'stagger1',
-                        'STG2c': 'stagger2',
-                        'STG3c': 'stagger3',
-                        'STG4c': 'stagger4',
-                        'RWH1mm': 'wear1',
-                        'RWH2mm': 'wear2',
-                        'RWH3mm': 'wear3',
-                        'RWH4mm': 'wear4',
-                        'WHGT1c': 'height1',
-                        'WHGT2c': 'height2',
-                        'WHGT3c': 'height3',
-                        'WHGT4c': 'height4',
-                        'LINE': 'Line',
-                        'TRACK': 'Track'}, axis=1)
-
-        raw[['KM', 'LOCATION', 'height1', 'height2', 'height3', 'height4', 'wear1',
-            'wear2', 'wear3', 'wear4', 'stagger1', 'stagger2', 'stagger3', 'stagger4']] \
-                = raw[['KM', 'LOCATION', 'height1', 'height2', 'height3', 'height4', 'wear1', 'wear2',
-                    'wear3', 'wear4', 'stagger1', 'stagger2', 'stagger3', 'stagger4']].apply(pd.to_numeric)
-
-        raw['Km'] = raw['KM'] + raw['LOCATION']*0.001
-        raw['height1'] = raw['height1'] + 5300
-        raw['height2'] = raw['height2'] + 5300
-        raw['height3'] = raw['height3'] + 5300
-        raw['height4'] = raw['height4'] + 5300
-        raw = raw[['Line', 'Track', 'Km', 'height1', 'height2', 'height3', 'height4', 'wear1',
-                'wear2', 'wear3', 'wear4', 'stagger1', 'stagger2', 'stagger3', 'stagger4']]
-        raw['Km'] = raw['Km'].round(decimals=5)
-        raw['Section'] = ''
-
-        # Finds and assigns the corresponding section to all data points
-        exception_boundary = pd.read_excel('./metadata/' + line + ' metadata.xlsx', sheet_name='Exception Boundarys')
-        if track == 'UP':
-            exception_boundary = m_to_km(exception_boundary, 'Up Track From', 'Up Track To')
-            exception_boundary = exception_boundary[['Class', 'Up Track From', 'Up Track To']]\
-                .rename({'Up Track From': 'FromKM', 'Up Track To': 'ToKM'}, axis=1)
-        else:
-            exception_boundary = m_to_km(exception_boundary, 'Down Track From', 'Down Track To')
-            exception_boundary = exception_boundary[['Class', 'Down Track From', 'Down Track To']]\
-                .rename({'Down Track From': 'FromKM', 'Down Track To': 'ToKM'}, axis=1)
-        
-        if line == 'TML':
-            MOL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'MOL', 'FromKM'].values[0]
-            MOL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'MOL', 'ToKM'].values[0]
-            SCL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'FromKM'].values[0]
-            SCL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'ToKM'].values[0]
-            ETSE_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'ETSE', 'FromKM'].values[0]
-            ETSE_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'ETSE', 'ToKM'].values[0]
-            KSL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'KSL', 'FromKM'].values[0]
-            KSL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'KSL', 'ToKM'].values[0]
-            WRL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'WRL', 'FromKM'].values[0]
-            WRL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'WRL', 'ToKM'].values[0]
-
-            if track == 'UP':
-                MOL_row_location = raw[(raw['Km'] >= MOL_FromKM) & (raw['Km'] <= MOL_ToKM)].index
-                SCL_row_location = raw[(raw['Km'] >= SCL_FromKM) & (raw['Km'] <= SCL_ToKM)].index
-                ETSE_row_location = raw[(raw['Km'] >= ETSE_FromKM) & (raw['Km'] <= ETSE_ToKM)].index
-                KSL_row_location = raw[(raw['Km'] >= KSL_FromKM) & (raw['Km'] <= KSL_ToKM)].index
-                WRL_row_location = raw[(raw['Km'] >= WRL_FromKM) & (raw['Km'] <= WRL_ToKM)].index
-            else:
-                MOL_row_location = raw[(raw['Km'] <= MOL_FromKM) & (raw['Km'] >= MOL_ToKM)].index
-                SCL_row_location = raw[(raw['Km'] <= SCL_FromKM) & (raw['Km'] >= SCL_ToKM)].index
-                ETSE_row_location = raw[(raw['Km'] <= ETSE_FromKM) & (raw['Km'] >= ETSE_ToKM)].index
-                KSL_row_location = raw[(raw['Km'] <= KSL_FromKM) & (raw['Km'] >= KSL_ToKM)].index
-                WRL_row_location = raw[(raw['Km'] <= WRL_FromKM) & (raw['Km'] >= WRL_ToKM)].index
-
-            raw.loc[MOL_row_location, 'Section'] = 'MOL'
-            raw.loc[SCL_row_location, 'Section'] = 'SCL'
-            raw.loc[ETSE_row_location, 'Section'] = 'ETSE'
-            raw.loc[KSL_row_location, 'Section'] = 'KSL'
-            raw.loc[WRL_row_location, 'Section'] = 'WRL'
-        elif (section not in ['LMC', 'RAC', 'LOW']):
-            SCL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'FromKM'].values[0]
-            SCL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'SCL', 'ToKM'].values[0]
-            EAL_FromKM = exception_boundary.loc[exception_boundary['Class'] == 'EAL', 'FromKM'].values[0]
-            EAL_ToKM = exception_boundary.loc[exception_boundary['Class'] == 'EAL', 'ToKM'].values[0]
-            if track == 'UP':
-                SCL_row_location = raw[(raw['Km'] >= SCL_FromKM) & (raw['Km'] <= SCL_ToKM)].index
-                EAL_row_location = raw[(raw['Km'] >= EAL_FromKM) & (raw['Km'] <= EAL_ToKM)].index
-            else:
-                SCL_row_location = raw[(raw['Km'] <= SCL_FromKM) & (raw['Km'] >= SCL_ToKM)].index
-                EAL_row_location = raw[(raw['Km'] <= EAL_FromKM) & (raw['Km'] >= EAL_ToKM)].index
-
-            raw.loc[SCL_row_location, 'Section'] = 'SCL'
-            raw.loc[EAL_row_location, 'Section'] = 'EAL'
-
-        # ---------- removes unreasonable CW height data ----------
-        WH_min = raw.groupby('Km')[['height1', 'height2', 'height3', 'height4']].min().reset_index()
-        WH_min.loc[(WH_min['height1'] < 3500) | (WH_min['height2'] < 3500) |
-                (WH_min['height3'] < 3500) | (WH_min['height4'] < 3500), 'error'] = WH_min['Km']
-        WH_error = WH_min['error'].dropna().to_list()
-        WH = raw[['Km', 'height1', 'height2', 'height3', 'height4', 'Section']]
-        WH_cleaned = WH[~WH.Km.isin(WH_error)]
-        # ---------- removes unreasonable CW height data ----------
-
-        # ---------- preprocess the data before generating exception ----------
-        stagger_left = raw.groupby('Km')[['stagger1', 'stagger2', 'stagger3', 'stagger4', 'Section']]\
-            .max()\
-            .reset_index()
-        stagger_right = raw.groupby('Km')[['stagger1', 'stagger2', 'stagger3', 'stagger4', 'Section']]\
-            .min()\
-            .reset_index()
-        wear_min = raw.groupby('Km')[['wear1', 'wear2', 'wear3', 'wear4', 'Section']]\
-            .min()\
-            .reset_index()
-        WH_cleaned_max = WH_cleaned.groupby('Km')[['height1', 'height2', 'height3', 'height4', 'Section']]\
-            .max()\
-            .reset_index()
-        WH_cleaned_min = WH_cleaned.groupby('Km')[['height1', 'height2', 'height3', 'height4', 'Section']]\
-            .min()\
-            .reset_index()
-        # ---------- preprocess the data before generating exception ----------
-
-        # ---------- identify track type (tangent/curve) ----------
-        stagger_left = stagger_left \
-            .assign(key=1) \
-            .merge(track_type.assign(key=1), on='key') \
-            .query('`Km`.between(`startKM`, `endKM`)', engine='python') \
-            .drop(columns=['startKM', 'endKM', 'key']) \
-            .reset_index(drop=True)
-        
-        stagger_right = stagger_right \
-            .assign(key=1) \
-            .merge(track_type.assign(key=1), on='key') \
-            .query('`Km`.between(`startKM`, `endKM`)', engine='python') \
-            .drop(columns=['startKM', 'endKM', 'key']) \
-            .reset_index(drop=True)
-
-        wear_min = wear_min \
-            .assign(key=1) \
-            .merge(track_type.assign(key=1), on='key') \
-            .query('`Km`.between(`startKM`, `endKM`)', engine='python') \
-            .drop(columns=['startKM', 'endKM', 'key']) \
-            .reset_index(drop=True)
-
-        WH_cleaned_max = WH_cleaned_max \
-            .assign(key=1) \
-            .merge(track_type.assign(key=1), on='key') \
-            .query('`Km`.between(`startKM`, `endKM`)', engine='python') \
-            .drop(columns=['startKM', 'endKM', 'key']) \
-            .reset_index(drop=True)
-
-        WH_cleaned_min = WH_cleaned_min \
-            .assign(key=1) \
-            .merge(track_type.assign(key=1), on='key') \
-            .query('`Km`.between(`startKM`, `endKM`)', engine='python') \
-            .drop(columns=['startKM', 'endKM', 'key']) \
-            .reset_index(drop=True)
-        # ---------- identify track type (tangent/curve) ----------
-
-        # ---------- find extreme value amongst 4 channels ----------
-        WH_cleaned_min['maxValue'] = WH_cleaned_min[['height1', 'height2', 'height3', 'height4']].min(axis=1)
-        WH_cleaned_max['maxValue'] = WH_cleaned_max[['height1', 'height2', 'height3', 'height4']].max(axis=1)
-
-        wear_min['maxValue'] = wear_min[['wear1', 'wear2', 'wear3', 'wear4']].min(axis=1)
-
-        stagger_left['maxValue'] = stagger_left[['stagger1', 'stagger2', 'stagger3', 'stagger4']].max(axis=1)
-        stagger_right['maxValue'] = stagger_right[['stagger1', 'stagger2', 'stagger3', 'stagger4']].min(axis=1)
-        # ---------- find extreme value amongst 4 channels ----------
-
-        return raw, WH_cleaned_max, WH_cleaned_min, wear_min, stagger_left, stagger_right
-    except Exception:
-        print(traceback.format_exc())
-        print('This error occured when processing the .datac file.')
-        input('Press Enter to exit')
-        exit()
-
-
-def min_aggregate_group(g):
+    heights = ['height1', 'height2', 'height3', 'height4']
+    wears = ['wear1', 'wear2', 'wear3', 'wear4']
+    staggers = ['stagger1', 'stagger2', 'stagger3', 'stagger4']
+    km_min, km_max = aggregate_by_km(raw, heights + wears + staggers)
+
+    # ---------- removes unreasonable CW height data ----------
+    WH_error = (km_min[heights].to_numpy() < 3500).any(axis=1)
+    # ---------- removes unreasonable CW height data ----------
+
+    # ---------- preprocess the data before generating exception ----------
+    stagger_left = km_max[['Km'] + staggers + ['Section']]
+    stagger_right = km_min[['Km'] + staggers + ['Section']]
+    wear_min = km_min[['Km'] + wears + ['Section']]
+    WH_cleaned_max = km_max.loc[~WH_error, ['Km'] + heights + ['Section']].reset_index(drop=True)
+    WH_cleaned_min = km_min.loc[~WH_error, ['Km'] + heights + ['Section']].reset_index(drop=True)
+    # ---------- preprocess the data before generating exception ----------
+
+    # ---------- identify track type (tangent/curve) ----------
+    # Looks up the track type of every Km once and reuses it for all the derived tables
+    track_type_index = build_interval_index(track_type['startKM'], track_type['endKM'])
+    position = lookup_interval(track_type_index, stagger_left['Km'])
+    km_track_type = pd.Series(track_type['track type'].to_numpy()[position[position >= 0]],
+                              index=stagger_left['Km'][position >= 0])
+
+    stagger_left = assign_track_type(stagger_left, km_track_type)
+    stagger_right = assign_track_type(stagger_right, km_track_type)
+    wear_min = assign_track_type(wear_min, km_track_type)
+    WH_cleaned_max = assign_track_type(WH_cleaned_max, km_track_type)
+    WH_cleaned_min = assign_track_type(WH_cleaned_min, km_track_type)
+    # ---------- identify track type (tangent/curve) ----------
+
+    # ---------- find extreme value amongst 4 channels ----------
+    WH_cleaned_min['maxValue'] = np.fmin.reduce(WH_cleaned_min[heights].to_numpy(), axis=1)
+    WH_cleaned_max['maxValue'] = np.fmax.reduce(WH_cleaned_max[heights].to_numpy(), axis=1)
+
+    wear_min['maxValue'] = np.fmin.reduce(wear_min[wears].to_numpy(), axis=1)
+
+    stagger_left['maxValue'] = np.fmax.reduce(stagger_left[staggers].to_numpy(), axis=1)
+    stagger_right['maxValue'] = np.fmin.reduce(stagger_right[staggers].to_numpy(), axis=1)
+    # ---------- find extreme value amongst 4 channels ----------
+
+    return raw, WH_cleaned_max, WH_cleaned_min, wear_min, stagger_left, stagger_right
+
+
+def find_exception_runs(table, exceeded, exception_type, extreme, split_by=None):
     """
-    A helper function for applying chain length.
+    Finds the runs of consecutive rows exceeding a limit and summarises each run in one pass.
 
-    Takes the row with the smallest maxValue and uses it in the new created row.
+    A run starts at every exceeding row whose previous row does not exceed the limit,
+    or whose split_by value differs. The first row of a run reaching its extreme maxValue
+    gives the maxLocation, track type and Section of the run.
 
     Args:
-        g (DataFrame): The DataFrame that contains all the rows for a specific group to be chained.
+        table (DataFrame): The table grouped by Km and sorted by Km, as returned by data_process.
+        exceeded (Series): Whether each row of the table exceeds the limit.
+        exception_type (str): The exception type of the runs.
+        extreme (str): 'min' or 'max', the extreme of the maxValue of each run.
+        split_by (str): The column whose changes also end a run, e.g. 'track type'. Defaults to None.
 
-        Returns:
-        (pandas.Series): The row with the min aggregrated values.
+    Returns:
+        (DataFrame): The exception type, startKm, endKm, length, maxValue, maxLocation,
+            track type and Section of each run, sorted by startKm.
     """
-    startM = g['startKm'].min()
-    endM = g['endKm'].max()
-    maxValue = g['maxValue'].min()
-    max_row = g.loc[g['maxValue'].idxmin()]
-    length = endM - startM
-      
-    return pd.Series({
-        'startKm': startM,
-        'endKm': endM,
-        'length': length,
-        'exception type': max_row['exception type'],
-        'maxValue': maxValue,
-        'maxLocation': max_row['maxLocation'],
-        'track type': max_row['track type'],
-        'Section': max_row['Section']
-        })
-
-
-def max_aggregate_group(g):
+    exceeded = np.asarray(exceeded, dtype=bool)
+    new_run = exceeded & ~np.r_[False, exceeded[:-1]]
+    if split_by is not None:
+        key = table[split_by].to_numpy()
+        new_run |= exceeded & np.r_[True, key[1:] != key[:-1]]
+
+    rows = np.flatnonzero(exceeded)
+    starts = np.flatnonzero(new_run[rows])
+    ends = np.r_[starts[1:], len(rows)][:len(starts)] - 1
+    run_id = np.cumsum(new_run[rows]) - 1
+
+    values = table['maxValue'].to_numpy(dtype=float)[rows]
+    reduce = np.minimum if extreme == 'min' else np.maximum
+    run_extreme = reduce.reduceat(values, starts)
+
+    # the first row of each run reaching its extreme
+    hit = np.flatnonzero(values == run_extreme[run_id])
+    first_hit = rows[hit[np.r_[True, run_id[hit][1:] != run_id[hit][:-1]][:len(hit)]]]
+
+    km = table['Km'].to_numpy(dtype=float)
+    km_roundup = np.round(km, 3)
+    runs = pd.DataFrame({'exception type': exception_type,
+                         'startKm': km_roundup[rows[starts]],
+                         'endKm': km_roundup[rows[ends]],
+                         'maxValue': run_extreme,
+                         'maxLocation': km[first_hit],
+                         'track type': table['track type'].to_numpy()[first_hit],
+                         'Section': table['Section'].to_numpy()[first_hit]})
+    runs['length'] = runs['endKm'] - runs['startKm']
+    return (runs[['exception type', 'startKm', 'endKm', 'length', 'maxValue', 'maxLocation', 'track type', 'Section']]
+            .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])
+            .reset_index(drop=True))
+
+
+def apply_chain_length(exception_table, extreme, chain_length=default_chain_length):
     """
-    A helper function for applying chain length.
+    Merges the exceptions closer than the chain length into one.
 
-    Takes the row with the largest maxValue and uses it in the new created row.
+    An exception joins the previous one if it starts less than chain_length after the previous one ends.
+    The merged exception spans the whole chain and takes the maxValue, exception type, maxLocation,
+    track type and Section of the first exception reaching the extreme maxValue of the chain.
 
     Args:
-        g (DataFrame): The DataFrame that contains all the rows for a specific group to be chained.
+        exception_table (DataFrame): The exceptions sorted by startKm, as returned by find_exception_runs.
+        extreme (str): 'min' or 'max', the extreme of the maxValue of each chain.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
 
     Returns:
-        pandas Series: The row with the max aggregrated values.
-    """
-    startM = g['startKm'].min()
-    endM = g['endKm'].max()
-    maxValue = g['maxValue'].max()
-    max_row = g.loc[g['maxValue'].idxmax()]
-    length = endM - startM
-   
-    return pd.Series({
-        'startKm': startM,
-        'endKm': endM,
-        'length': length,
-        'exception type': max_row['exception type'],
-        'maxValue': maxValue,
-        'maxLocation': max_row['maxLocation'],
-        'track type': max_row['track type'],
-        'Section': max_row['Section']
-    })
+        (DataFrame): The merged exceptions.
+    """
+    exception_table = exception_table.reset_index(drop=True)
+    start = exception_table['startKm'].to_numpy(dtype=float)
+    end = exception_table['endKm'].to_numpy(dtype=float)
+    group = np.cumsum(start - np.r_[0, end[:-1]] >= chain_length)
+
+    grouped = exception_table.groupby(group)
+    extreme_row = grouped['maxValue'].idxmin() if extreme == 'min' else grouped['maxValue'].idxmax()
+    chains = exception_table.take(extreme_row.to_numpy())[['exception type', 'maxValue', 'maxLocation',
+                                                           'track type', 'Section']].reset_index(drop=True)
+    chains.insert(0, 'startKm', grouped['startKm'].min().to_numpy())
+    chains.insert(1, 'endKm', grouped['endKm'].max().to_numpy())
+    chains.insert(2, 'length', chains['endKm'] - chains['startKm'])
+    return chains
 
 
 def km_to_m(exception_table):
@@ -492,162 +946,41 @@ def sort_table(exception_table):
     return exception_table
 
 
-def find_low_height_exception(WH_cleaned_min, threshold, date, line, section, track):
+def find_low_height_exception(WH_cleaned_min, threshold, date, line, section, track,
+                              chain_length=default_chain_length):
     """
     Finds all the exception of low height and outputs a table of it.
 
-    Gets low height threshold values from metadata first,
+    Gathers the low height threshold values of each data point from the compiled threshold table,
     then distinguishes the corresponding threshold value to be used on the each data point.
     Compares the maxValue of each point and assigns the corresponding level of danger to it.
 
     Args:
         WH_cleaned_min (DataFrame): The minimum low height exception values out of the four channels.
-        threshold (DataFrame): The threshold of the line.
+        threshold (DataFrame): The compiled threshold of the line.
         date (str): The date of the data collected.
         line (str): The name of the line.
         section (str): The section of the line.
         track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
 
     Returns:
         low_height_exception (DataFrame): The details of the found low height exception.
     """
-    # Loads the corresponding low height exception boundary values
-    if line == 'TML':
-        WRL_low_height_L1_max = threshold.loc[(threshold['Class'] == 'WRL') &
-                                              (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # WRL_low_height_L2_min = threshold.loc[(threshold['Class'] == 'WRL') &
-        #                                       (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-        WRL_low_height_L2_max = threshold.loc[(threshold['Class'] == 'WRL') &
-                                              (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        KSL_low_height_L1_max = threshold.loc[(threshold['Class'] == 'KSL') &
-                                              (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # KSL_low_height_L2_min = threshold.loc[(threshold['Class'] == 'KSL') &
-        #                                       (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-        KSL_low_height_L2_max = threshold.loc[(threshold['Class'] == 'KSL') &
-                                              (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        ETSE_low_height_L1_max = threshold.loc[(threshold['Class'] == 'ETSE') &
-                                               (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # ETSE_low_height_L2_min = threshold.loc[(threshold['Class'] == 'ETSE') &
-        #                                        (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-        ETSE_low_height_L2_max = threshold.loc[(threshold['Class'] == 'ETSE') &
-                                               (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        MOL_low_height_L1_max = threshold.loc[(threshold['Class'] == 'MOL') &
-                                              (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # MOL_low_height_L2_min = threshold.loc[(threshold['Class'] == 'MOL') &
-        #                                       (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-        MOL_low_height_L2_max = threshold.loc[(threshold['Class'] == 'MOL') &
-                                              (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        SCL_low_height_L1_max = threshold.loc[(threshold['Class'] == 'SCL') &
-                                              (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # SCL_low_height_L2_min = threshold.loc[(threshold['Class'] == 'SCL') &
-        #                                       (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-        SCL_low_height_L2_max = threshold.loc[(threshold['Class'] == 'SCL') &
-                                              (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-    else:
-        SCL_low_height_L1_max = threshold.loc[(threshold['Class'] == 'SCL') &
-                                              (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-        # SCL_low_height_L2_min = np.nan
-        SCL_low_height_L2_max = threshold.loc[(threshold['Class'] == 'SCL') &
-                                              (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        if section in ['LMC']:
-            class_low_height_L1_max = threshold.loc[(threshold['Class'] == 'LMC') &
-                                                    (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-            # class_low_height_L2_min = threshold.loc[(threshold['Class'] == 'LMC') &
-            #                                         (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-            class_low_height_L2_max = threshold.loc[(threshold['Class'] == 'LMC') &
-                                                    (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-        else:
-            class_low_height_L1_max = threshold.loc[(threshold['Class'] == 'both') &
-                                                    (threshold['Exc Type'] == 'Low Height L1')]['max'].values.item()
-            # class_low_height_L2_min = threshold.loc[(threshold['Class'] == 'both') &
-            #                                         (threshold['Exc Type'] == 'Low Height L2')]['min'].values.item()
-            class_low_height_L2_max = threshold.loc[(threshold['Class'] == 'both') &
-                                                    (threshold['Exc Type'] == 'Low Height L2')]['max'].values.item()
-
     # ---------- low height exception ----------
-    WH_cleaned_min['Km_roundup'] = WH_cleaned_min['Km'].round(3)
-
     # Assigns all exceptions to L2 for now
-    WH_cleaned_min['L2_max'] = ''
-
-    if (line == 'TML'):
-        WRL_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'WRL'].index
-        WH_cleaned_min.loc[WRL_L2_max_row_location, 'L2_max'] = WRL_low_height_L2_max
-        KSL_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'KSL'].index
-        WH_cleaned_min.loc[KSL_L2_max_row_location, 'L2_max'] = KSL_low_height_L2_max
-        ETSE_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'ETSE'].index
-        WH_cleaned_min.loc[ETSE_L2_max_row_location, 'L2_max'] = ETSE_low_height_L2_max
-        MOL_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'MOL'].index
-        WH_cleaned_min.loc[MOL_L2_max_row_location, 'L2_max'] = MOL_low_height_L2_max
-        SCL_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'SCL'].index
-        WH_cleaned_min.loc[SCL_L2_max_row_location, 'L2_max'] = SCL_low_height_L2_max
-    else:
-        if (section in ['LMC', 'RAC', 'LOW']):
-            WH_cleaned_min['L2_max'] = class_low_height_L2_max
-        else:
-            WH_cleaned_min['L2_max'] = class_low_height_L2_max
-            SCL_L2_max_row_location = WH_cleaned_min[WH_cleaned_min['Section'] == 'SCL'].index
-            WH_cleaned_min.loc[SCL_L2_max_row_location, 'L2_max'] = SCL_low_height_L2_max
-
-    WH_cleaned_min['L2'] = (WH_cleaned_min.maxValue <= WH_cleaned_min.L2_max)
-    WH_cleaned_min['L2_id'] = (WH_cleaned_min.L2 != WH_cleaned_min.L2.shift()).cumsum()
-    WH_cleaned_min['L2_count'] = WH_cleaned_min.groupby(['L2', 'L2_id']).cumcount(ascending=False) + 1
-    WH_cleaned_min.loc[~WH_cleaned_min['L2'], 'L2_count'] = 0
+    limits = gather_thresholds(threshold, 'Low Height', WH_cleaned_min, section)
+    WH_cleaned_min['L2'] = (WH_cleaned_min.maxValue <= limits['L2_max'])
 
     if WH_cleaned_min['L2'].any():
-        low_height_exception_full = WH_cleaned_min[(WH_cleaned_min['L2_count'] != 0)]
-
-        low_height_exception_full.loc[low_height_exception_full['L2'], 'exception type'] = 'Low Height'
-
-        low_height_exception = (low_height_exception_full
-                                .groupby(['exception type', 'L2_id'])
-                                .agg({'Km': ['min', 'max'], 'maxValue': ['min', 'max'], 'Km_roundup': ['min', 'max']}))
-        low_height_exception.columns = low_height_exception.columns.map('_'.join)
-        low_height_exception = (low_height_exception
-                                .assign(key=1)
-                                    .merge(low_height_exception_full.assign(key=1), on='key')
-                                        .query('`maxValue_min` == `maxValue` & `Km_roundup`.between(`Km_roundup_min`, `Km_roundup_max`)', engine='python')
-                                            .drop(columns=['maxValue_max', 'key', 'maxValue', 'L2_id', 'L2_count',
-                                                           'height1', 'height2', 'height3', 'height4', 'L2'])
-                                                            .rename({'Km': 'maxLocation', 'Km_roundup_min': 'startKm',
-                                                                     'Km_roundup_max': 'endKm', 'maxValue_min': 'maxValue'}, axis=1)
-                                                                        .reset_index()
-                                                                            .drop('index', axis=1))
-        low_height_exception['length'] = low_height_exception['endKm'] - low_height_exception['startKm']
-        low_height_exception = (low_height_exception[['exception type', 'startKm', 'endKm', 'length',
-                                                      'maxValue', 'maxLocation', 'track type', 'Section']]
-                                                        .sort_values('startKm')
-                                                            .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])
-                                                                .reset_index()
-                                                                    .drop('index', axis=1))
+        low_height_exception = find_exception_runs(WH_cleaned_min, WH_cleaned_min['L2'], 'Low Height', 'min')
 
         # apply chain length
-        low_height_exception['group'] = (low_height_exception['startKm'] - low_height_exception['endKm'].shift().fillna(0) >= chain_length).cumsum()
-        low_height_exception = low_height_exception.groupby('group').apply(min_aggregate_group).reset_index(drop=True)
+        low_height_exception = apply_chain_length(low_height_exception, 'min', chain_length)
         # ------ defining alarm level depending on maxValue only ------
         # Assigns L1 exception
-        WH_cleaned_min['L1_max'] = ''
-
-        if (line == 'TML'):
-            WRL_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'WRL'].index
-            low_height_exception.loc[WRL_L1_max_row_location, 'L1_max'] = WRL_low_height_L1_max
-            KSL_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'KSL'].index
-            low_height_exception.loc[KSL_L1_max_row_location, 'L1_max'] = KSL_low_height_L1_max
-            ETSE_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'ETSE'].index
-            low_height_exception.loc[ETSE_L1_max_row_location, 'L1_max'] = ETSE_low_height_L1_max
-            MOL_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'MOL'].index
-            low_height_exception.loc[MOL_L1_max_row_location, 'L1_max'] = MOL_low_height_L1_max
-            SCL_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'SCL'].index
-            low_height_exception.loc[SCL_L1_max_row_location, 'L1_max'] = SCL_low_height_L1_max
-        else:
-            if (section in ['LOW', 'RAC', 'LMC']):
-                low_height_exception['L1_max'] = class_low_height_L1_max
-            else:
-                low_height_exception['L1_max'] = class_low_height_L1_max
-                SCL_L1_max_row_location = low_height_exception[low_height_exception['Section'] == 'SCL'].index
-                low_height_exception.loc[SCL_L1_max_row_location, 'L1_max'] = SCL_low_height_L1_max
-
-        low_height_exception.loc[(low_height_exception.maxValue <= low_height_exception.L1_max), 'level'] = 'L1'
+        limits = gather_thresholds(threshold, 'Low Height', low_height_exception, section)
+        low_height_exception.loc[(low_height_exception.maxValue <= limits['L1_max']), 'level'] = 'L1'
 
         low_height_exception['level'] = low_height_exception['level'].replace('na', np.nan)
         low_height_exception['level'] = low_height_exception['level'].fillna('L2')
@@ -666,69 +999,40 @@ def find_low_height_exception(WH_cleaned_min, threshold, date, line, section, tr
     return low_height_exception
 
 
-def find_high_height_exception(WH_cleaned_max, threshold, date, line, section, track):
+def find_high_height_exception(WH_cleaned_max, threshold, date, line, section, track,
+                               chain_length=default_chain_length):
     """
     Finds all the exception of high height and outputs a table of it.
 
-    Gets high height threshold values from metadata first,
+    Gathers the high height threshold values of each data point from the compiled threshold table,
     then distinguishes the corresponding threshold value to be used on the each data point.
     Compares the maxValue of each point and assigns the corresponding level of danger to it.
 
     Args:
         WH_cleaned_min (DataFrame): The maximum high height exception values out of the four channels.
-        threshold (DataFrame): The threshold of the line.
+        threshold (DataFrame): The compiled threshold of the line.
         date (str): The date of the data collected.
         line (str): The name of the line.
         section (str): The section of the line.
         track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
 
     Returns:
         high_height_exception (DataFrame): The DataFrame with details of the found high height exception.
     """
     # ---------- high height exception ----------
-    high_height_L1_min = threshold.loc[threshold['Exc Type'] == 'High Height L1']['min'].values.item()
-    high_height_L2_min = threshold.loc[threshold['Exc Type'] == 'High Height L2']['min'].values.item()
-    # high_height_L2_max = threshold.loc[threshold['Exc Type'] == 'High Height L2']['max'].values.item()
-
-    WH_cleaned_max['Km_roundup'] = WH_cleaned_max['Km'].round(3)
-    WH_cleaned_max['L2'] = (WH_cleaned_max.maxValue >= high_height_L2_min)
-    WH_cleaned_max['L2_id'] = (WH_cleaned_max.L2 != WH_cleaned_max.L2.shift()).cumsum()
-    WH_cleaned_max['L2_count'] = WH_cleaned_max.groupby(['L2', 'L2_id']).cumcount(ascending=False) + 1
-    WH_cleaned_max.loc[~WH_cleaned_max['L2'], 'L2_count'] = 0
+    limits = gather_thresholds(threshold, 'High Height', WH_cleaned_max, section)
+    WH_cleaned_max['L2'] = (WH_cleaned_max.maxValue >= limits['L2_min'])
 
     if WH_cleaned_max['L2'].any():
-        high_height_exception_full = WH_cleaned_max[(WH_cleaned_max['L2_count'] != 0)]
-        high_height_exception_full.loc[high_height_exception_full['L2'], 'exception type'] = 'High Height'
-
-        high_height_exception = high_height_exception_full\
-            .groupby(['exception type', 'L2_id'])\
-            .agg({'Km': ['min', 'max'], 'maxValue': ['min', 'max'], 'Km_roundup': ['min', 'max']})
-        high_height_exception.columns = high_height_exception.columns.map('_'.join)
-        high_height_exception = high_height_exception\
-            .assign(key=1)\
-                .merge(high_height_exception_full.assign(key=1), on='key')\
-                    .query('`maxValue_max` == `maxValue` & `Km_roundup`.between(`Km_roundup_min`, `Km_roundup_max`)', engine='python')\
-                        .drop(columns=['maxValue_min', 'key', 'maxValue', 'L2_id', 'L2_count', 'height1',
-                                       'height2', 'height3', 'height4', 'L2'])\
-                                        .rename({'Km': 'maxLocation', 'Km_roundup_min': 'startKm', 'Km_roundup_max': 'endKm',
-                                                 'maxValue_max': 'maxValue'}, axis=1)\
-                                                    .reset_index()\
-                                                        .drop('index', axis=1)
-
-        high_height_exception['length'] = high_height_exception['endKm'] - high_height_exception['startKm']
-        high_height_exception = (high_height_exception[['exception type', 'startKm', 'endKm', 'length',
-                                                        'maxValue', 'maxLocation', 'track type', 'Section']]
-                                                            .sort_values('startKm')
-                                                                .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])
-                                                                    .reset_index()
-                                                                        .drop('index', axis=1))
+        high_height_exception = find_exception_runs(WH_cleaned_max, WH_cleaned_max['L2'], 'High Height', 'max')
 
         # apply chain length
-        high_height_exception['group'] = (high_height_exception['startKm'] - high_height_exception['endKm'].shift().fillna(0) >= chain_length).cumsum()
-        high_height_exception = high_height_exception.groupby('group').apply(max_aggregate_group).reset_index(drop=True)
+        high_height_exception = apply_chain_length(high_height_exception, 'max', chain_length)
 
         # ------ defining alarm level depending on maxValue only ------
-        high_height_exception.loc[(high_height_exception['maxValue'] >= high_height_L1_min), 'level'] = 'L1'
+        limits = gather_thresholds(threshold, 'High Height', high_height_exception, section)
+        high_height_exception.loc[(high_height_exception['maxValue'] >= limits['L1_min']), 'level'] = 'L1'
 
         high_height_exception['level'] = high_height_exception['level'].replace('na', np.nan)
         high_height_exception['level'] = high_height_exception['level'].fillna('L2')
@@ -747,101 +1051,40 @@ def find_high_height_exception(WH_cleaned_max, threshold, date, line, section, t
     return high_height_exception
 
 
-def find_wire_wear_exception(wear_min, threshold, date, line, section, track):
+def find_wire_wear_exception(wear_min, threshold, date, line, section, track,
+                             chain_length=default_chain_length):
     """
     Finds all the exception of wire wear and output a table of it.
 
-    Gets wire wear threshold values from metadata first,
+    Gathers the wire wear threshold values of each data point from the compiled threshold table,
     then distinguishes the corresponding threshold value to be used on the each data point.
     Compares the maxValue of each point and assigns the corresponding level of danger to it.
 
     Args:
         wear_min (DataFrame): The minimum wire wear exception values out of the four channels.
-        threshold (DataFrame): The threshold of the line.
+        threshold (DataFrame): The compiled threshold of the line.
         date (str): The date of the data collected.
         line (str): The name of the line.
         section (str): The section of the line.
         track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
 
     Returns:
         wear_exception (DataFrame): The details of the found wire wear exception.
     """
-    # Loads line related threshold from metadata
-    wear_L1_max = threshold.loc[(threshold['Exc Type'] == 'Wire Wear L1') &
-                                (threshold['Class'] == 'both')]['max'].values[0]
-    # wear_L2_min = threshold.loc[threshold['Exc Type'] == 'Wire Wear L2']['min'].values.item()
-    wear_L2_max = threshold.loc[(threshold['Exc Type'] == 'Wire Wear L2') &
-                                (threshold['Class'] == 'both')]['max'].values[0]
-
-    SCL_wear_L1_max = threshold.loc[(threshold['Exc Type'] == 'Wire Wear L1') &
-                                (threshold['Class'] == 'SCL')]['max'].values[0]
-    SCL_wear_L2_max = threshold.loc[(threshold['Exc Type'] == 'Wire Wear L2') &
-                                (threshold['Class'] == 'SCL')]['max'].values[0]
-
     # Assigns all exceptions to L2 for now
-    wear_min['L2_max'] = ''
-    if (line == 'EAL'):
-        if (section in ['LMC', 'RAC', 'LOW']):
-            wear_min['L2_max'] = wear_L2_max
-        else:
-            wear_min['L2_max'] = wear_L2_max
-            SCL_L2_max_row_location = wear_min[wear_min['Section'] == 'SCL'].index
-            wear_min.loc[SCL_L2_max_row_location, 'L2_max'] = SCL_wear_L2_max
-    else:   # TML
-        wear_min['L2_max'] = wear_L2_max
-        SCL_L2_max_row_location = wear_min[wear_min['Section'] == 'SCL'].index
-        wear_min.loc[SCL_L2_max_row_location, 'L2_max'] = SCL_wear_L2_max
-
-    wear_min['Km_roundup'] = wear_min['Km'].round(3)
-    wear_min['L2'] = (wear_min.maxValue <= wear_min.L2_max)
-    wear_min['L2_id'] = (wear_min.L2 != wear_min.L2.shift()).cumsum()
-    wear_min['L2_count'] = wear_min.groupby(['L2', 'L2_id']).cumcount(ascending=False) + 1
-    wear_min.loc[~wear_min['L2'], 'L2_count'] = 0
+    limits = gather_thresholds(threshold, 'Wire Wear', wear_min, section)
+    wear_min['L2'] = (wear_min.maxValue <= limits['L2_max'])
     if wear_min['L2'].any():
-        wear_exception_full = wear_min[(wear_min['L2_count'] != 0)]
-        wear_exception_full.loc[wear_exception_full['L2'], 'exception type'] = 'Wire Wear'
-        wear_exception = wear_exception_full\
-            .groupby(['exception type', 'L2_id'])\
-            .agg({'Km': ['min', 'max'], 'maxValue': ['min', 'max'], 'Km_roundup': ['min', 'max']})
-        wear_exception.columns = wear_exception.columns.map('_'.join)
-        wear_exception = (wear_exception\
-                          .assign(key=1)\
-                            .merge(wear_exception_full.assign(key=1), on='key')\
-                                .query('`maxValue_min` == `maxValue` & `Km_roundup`.between(`Km_roundup_min`, `Km_roundup_max`)', engine='python')\
-                                    .drop(columns=['maxValue_max', 'key', 'maxValue', 'L2_id', 'L2_count',
-                                                   'wear1', 'wear2', 'wear3', 'wear4', 'L2'])\
-                                                    .rename({'Km': 'maxLocation', 'Km_roundup_min': 'startKm', 'Km_roundup_max': 'endKm',
-                                                             'maxValue_min': 'maxValue'}, axis=1)\
-                                                                .reset_index()\
-                                                                    .drop('index', axis=1))
-        wear_exception['length'] = wear_exception['endKm'] - wear_exception['startKm']
-        wear_exception = (wear_exception[['exception type', 'startKm', 'endKm', 'length',
-                                          'maxValue', 'maxLocation', 'track type', 'Section']]\
-                                            .sort_values('startKm')\
-                                                .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])\
-                                                    .reset_index()\
-                                                        .drop('index', axis=1))
-        
+        wear_exception = find_exception_runs(wear_min, wear_min['L2'], 'Wire Wear', 'min')
+
         # apply chain length
-        wear_exception['group'] = (wear_exception['startKm'] - wear_exception['endKm'].shift().fillna(0) >= chain_length).cumsum()
-        wear_exception = wear_exception.groupby('group').apply(min_aggregate_group).reset_index(drop=True)
+        wear_exception = apply_chain_length(wear_exception, 'min', chain_length)
 
         # ------ defining alarm level depending on maxValue only ------
         # Assigns L1 exception
-        wear_exception['L1_max'] = ''
-        if (line == 'EAL'):
-            if (section in ['LMC', 'RAC', 'LOW']):
-                wear_exception['L1_max'] = wear_L1_max
-            else:
-                wear_exception['L1_max'] = wear_L1_max
-                SCL_L1_max_row_location = wear_exception[wear_exception['Section'] == 'SCL'].index
-                wear_exception.loc[SCL_L1_max_row_location, 'L1_max'] = SCL_wear_L1_max
-        else:   # TML
-            wear_exception['L1_max'] = wear_L1_max
-            SCL_L1_max_row_location = wear_exception[wear_exception['Section'] == 'SCL'].index
-            wear_exception.loc[SCL_L1_max_row_location, 'L1_max'] = SCL_wear_L1_max
-
-        wear_exception.loc[(wear_exception['maxValue'] <= wear_exception['L1_max']), 'level'] = 'L1'
+        limits = gather_thresholds(threshold, 'Wire Wear', wear_exception, section)
+        wear_exception.loc[(wear_exception['maxValue'] <= limits['L1_max']), 'level'] = 'L1'
         wear_exception['level'] = wear_exception['level'].replace('na', np.nan)
         wear_exception['level'] = wear_exception['level'].fillna('L2')
         wear_exception = wear_exception[['exception type', 'level', 'startKm', 'endKm', 'length',
@@ -858,295 +1101,48 @@ def find_wire_wear_exception(wear_min, threshold, date, line, section, track):
     return wear_exception
 
 
-def find_stagger_exception(stagger_left, stagger_right, threshold, date, line, section, track):
+def find_stagger_exception(stagger_left, stagger_right, threshold, date, line, section, track,
+                           chain_length=default_chain_length):
     """
     Finds all the exception of both left and right stagger
     and outputs two tables for left and right stagger respectively.
 
-    Gets stagger threshold values from metadata first,
+    Gathers the stagger threshold values of each data point from the compiled threshold table,
     then distinguishes the corresponding threshold value to be used on the each data point.
     Compares the maxValue of each point and assigns the corresponding level of danger to it.
 
     Args:
         stagger_left (DataFrame): The maximum left stagger exception values out of the four channels.
         stagger_right (DataFrame): The minimum (negative) right stagger exception valus out of the four channels.
-        threshold (DataFrame): The threshold of the line.
+        threshold (DataFrame): The compiled threshold of the line.
         date (str): The date of the data collected.
         line (str): The name of the line.
         section (str): The section of the line.
         track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
 
     Returns:
         stagger_left_exception (DataFrame): The details of the found left stagger exception.
         stagger_right_exception (DataFrame): The details of the found right stagger exception.
     """
-    # Loads line related threshold from metadata
-    if line == 'TML':
-        KSL_tangent_stagger_L1_min = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        KSL_tangent_stagger_L2_min = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L2')]['min'].values.item()
-        KSL_tangent_stagger_L2_max = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L2')]['max'].values.item()
-        KSL_tangent_stagger_L3_min = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-
-        # KSL_tangent_stagger_L3_max = threshold.loc[(threshold['Class'] == 'KSL') &
-        #                                             (threshold['Track Type'] == 'Tangent') &
-        #                                             (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-
-        KSL_curve_stagger_L1_min = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                 (threshold['Track Type'] == 'Curve') &
-                                                 (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        KSL_curve_stagger_L3_min = threshold.loc[(threshold['Class'] == 'KSL') &
-                                                 (threshold['Track Type'] == 'Curve') &
-                                                 (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-        # KSL_curve_stagger_L3_max = threshold.loc[(threshold['Class'] == 'KSL') &
-        #                                             (threshold['Track Type'] == 'Curve') &
-        #                                             (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-        SCL_tangent_stagger_L1_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        SCL_tangent_stagger_L3_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-        # SCL_tangent_stagger_L3_max = threshold.loc[(threshold['Class'] == 'SCL') &
-        #                                             (threshold['Track Type'] == 'Tangent') &
-        #                                             (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-            
-        SCL_curve_stagger_L1_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                 (threshold['Track Type'] == 'Curve') &
-                                                 (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        SCL_curve_stagger_L3_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                 (threshold['Track Type'] == 'Curve') &
-                                                 (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-        # SCL_curve_stagger_L3_max = threshold.loc[(threshold['Class'] == 'SCL') &
-        #                                             (threshold['Track Type'] == 'Curve') &
-        #                                             (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-    else:
-        SCL_tangent_stagger_L1_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        SCL_tangent_stagger_L3_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Tangent') &
-                                                   (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-        # SCL_tangent_stagger_L3_max = np.nan
-        SCL_curve_stagger_L1_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Curve') &
-                                                   (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-        SCL_curve_stagger_L3_min = threshold.loc[(threshold['Class'] == 'SCL') &
-                                                   (threshold['Track Type'] == 'Curve') &
-                                                   (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-        # SCL_curve_stagger_L3_max = np.nan
-
-    tangent_stagger_L1_min = threshold.loc[(threshold['Class'] == 'both') &
-                                           (threshold['Track Type'] == 'Tangent') &
-                                           (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-    tangent_stagger_L2_min = threshold.loc[(threshold['Class'] == 'both') &
-                                           (threshold['Track Type'] == 'Tangent') &
-                                           (threshold['Exc Type'] == 'Stagger L2')]['min'].values.item()
-    tangent_stagger_L2_max = threshold.loc[(threshold['Class'] == 'both') &
-                                           (threshold['Track Type'] == 'Tangent') &
-                                           (threshold['Exc Type'] == 'Stagger L2')]['max'].values.item()
-    tangent_stagger_L3_min = threshold.loc[(threshold['Class'] == 'both') &
-                                           (threshold['Track Type'] == 'Tangent') &
-                                           (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-    
-    # tangent_stagger_L3_max = threshold.loc[(threshold['Class'] == 'both') &
-    #                                        (threshold['Track Type'] == 'Tangent') &
-    #                                        (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-
-    curve_stagger_L1_min = threshold.loc[(threshold['Class'] == 'both') &
-                                         (threshold['Track Type'] == 'Curve') &
-                                         (threshold['Exc Type'] == 'Stagger L1')]['min'].values.item()
-    curve_stagger_L2_min = threshold.loc[(threshold['Class'] == 'both') &
-                                         (threshold['Track Type'] == 'Curve') &
-                                         (threshold['Exc Type'] == 'Stagger L2')]['min'].values.item()
-    curve_stagger_L2_max = threshold.loc[(threshold['Class'] == 'both') &
-                                         (threshold['Track Type'] == 'Curve') &
-                                         (threshold['Exc Type'] == 'Stagger L2')]['max'].values.item()
-    curve_stagger_L3_min = threshold.loc[(threshold['Class'] == 'both') &
-                                         (threshold['Track Type'] == 'Curve') &
-                                         (threshold['Exc Type'] == 'Stagger L3')]['min'].values.item()
-    # curve_stagger_L3_max = threshold.loc[(threshold['Class'] == 'both') &
-    #                                      (threshold['Track Type'] == 'Curve') &
-    #                                      (threshold['Exc Type'] == 'Stagger L3')]['max'].values.item()
-
     # ---------- Left stagger exception ----------
-    stagger_left['Km_roundup'] = stagger_left['Km'].round(3)
-
     # Labels all found exceptions L3 for now
-    stagger_left['curve_L3_min'] = float('inf')
-    stagger_left['tangent_L3_min'] = float('inf')
-    if (line == 'TML'):
-        other_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve')].index
-        stagger_left.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-        KSL_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve') &
-                                                     (stagger_left['Section'] == 'KSL')].index
-        stagger_left.loc[KSL_curve_L3_min_row_location, 'curve_L3_min'] = KSL_curve_stagger_L3_min
-        SCL_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve') &
-                                                     (stagger_left['Section'] == 'SCL')].index
-        stagger_left.loc[SCL_curve_L3_min_row_location, 'curve_L3_min'] = SCL_curve_stagger_L3_min
-
-        other_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent')].index
-        stagger_left.loc[other_tangent_L3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-        KSL_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent') &
-                                                       (stagger_left['Section'] == 'KSL')].index
-        stagger_left.loc[KSL_tangent_L3_min_row_location, 'tangent_L3_min'] = KSL_tangent_stagger_L3_min
-        SCL_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent') &
-                                                       (stagger_left['Section'] == 'SCL')].index
-        stagger_left.loc[SCL_tangent_L3_min_row_location, 'tangent_L3_min'] = SCL_tangent_stagger_L3_min
-    else:
-        if (section in ['LOW', 'RAC', 'LMC']):
-            other_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve')].index
-            stagger_left.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-            other_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent')].index
-            stagger_left.loc[other_tangent_L3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-        else:
-            other_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve')].index
-            stagger_left.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-            SCL_curve_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Curve') &
-                                                         (stagger_left['Section'] == 'SCL')].index
-            stagger_left.loc[SCL_curve_L3_min_row_location, 'curve_L3_min'] = SCL_curve_stagger_L3_min
-
-            other_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent')].index
-            stagger_left.loc[other_tangent_L3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-            SCL_tangent_L3_min_row_location = stagger_left[(stagger_left['track type'] == 'Tangent') &
-                                                           (stagger_left['Section'] == 'SCL')].index
-            stagger_left.loc[SCL_tangent_L3_min_row_location, 'tangent_L3_min'] = SCL_tangent_stagger_L3_min
-
-    stagger_left['curve_L3'] = (stagger_left.maxValue >= stagger_left.curve_L3_min)
-    stagger_left['tangent_L3'] = (stagger_left.maxValue >= stagger_left.tangent_L3_min)
-    stagger_left['curve_L3_id'] = (stagger_left.curve_L3 != stagger_left.curve_L3.shift()).cumsum()
-    stagger_left['tangent_L3_id'] = (stagger_left.tangent_L3 != stagger_left.tangent_L3.shift()).cumsum()
-    stagger_left['curve_L3_count'] = stagger_left.groupby(['curve_L3', 'curve_L3_id']).cumcount(ascending=False) + 1
-    stagger_left['tangent_L3_count'] = stagger_left.groupby(['tangent_L3', 'tangent_L3_id']).cumcount(ascending=False) + 1
-    stagger_left.loc[~stagger_left['curve_L3'], 'curve_L3_count'] = 0
-    stagger_left.loc[~stagger_left['tangent_L3'], 'tangent_L3_count'] = 0
-    if stagger_left['curve_L3'].any() or stagger_left['tangent_L3'].any():
-
-        stagger_left_exception_full = stagger_left[(stagger_left['curve_L3_count'] != 0) |
-                                                   (stagger_left['tangent_L3_count'] != 0)]
-
-        stagger_left_exception_full.loc[stagger_left_exception_full['curve_L3'], 'exception type'] = 'Stagger'
-        stagger_left_exception_full.loc[stagger_left_exception_full['tangent_L3'], 'exception type'] = 'Stagger'
-
-        stagger_left_exception = (stagger_left_exception_full\
-                                  .groupby(['exception type', 'curve_L3_id', 'tangent_L3_id'])\
-                                    .agg({'Km': ['min', 'max'], 'maxValue': ['min', 'max'], 'Km_roundup': ['min', 'max']}))
-        stagger_left_exception.columns = stagger_left_exception.columns.map('_'.join)
-        stagger_left_exception = (stagger_left_exception\
-                                  .assign(key=1)\
-                                    .merge(stagger_left_exception_full.assign(key=1), on='key')\
-                                        .query('`maxValue_max` == `maxValue` & `Km_roundup`.between(`Km_roundup_min`, `Km_roundup_max`)', engine='python')\
-                                            .drop(columns=['maxValue_min', 'key', 'maxValue', 'stagger1', 'stagger2', 'stagger3', 'stagger4',
-                                                           'curve_L3', 'tangent_L3', 'curve_L3_id', 'tangent_L3_id', 'curve_L3_count', 'tangent_L3_count'])\
-                                                            .rename({'Km': 'maxLocation', 'Km_roundup_min': 'startKm',
-                                                                     'Km_roundup_max': 'endKm', 'maxValue_max': 'maxValue'}, axis=1)\
-                                                                        .reset_index()\
-                                                                            .drop('index', axis=1))
-
-        stagger_left_exception['length'] = stagger_left_exception['endKm'] - stagger_left_exception['startKm']
-        stagger_left_exception = stagger_left_exception[['exception type', 'startKm', 'endKm', 'length', 'maxValue',
-                                                         'maxLocation', 'track type', 'Section']]\
-                                                            .sort_values('startKm') \
-                                                                .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])\
-                                                                    .reset_index()\
-                                                                        .drop('index', axis=1)
+    limits = gather_thresholds(threshold, 'Stagger', stagger_left, section)
+    stagger_left['L3'] = (stagger_left.maxValue >= limits['L3_min'])
+    if stagger_left['L3'].any():
+        # A run also ends where the track type changes, since the stagger limits change with it
+        stagger_left_exception = find_exception_runs(stagger_left, stagger_left['L3'], 'Stagger', 'max', split_by='track type')
 
         # apply chain length
-        stagger_left_exception['group'] = (stagger_left_exception['startKm'] - stagger_left_exception['endKm'].shift().fillna(0) >= chain_length).cumsum()
-        stagger_left_exception = stagger_left_exception.groupby('group').apply(max_aggregate_group).reset_index(drop=True)
+        stagger_left_exception = apply_chain_length(stagger_left_exception, 'max', chain_length)
 
         # ------ defining alarm level depending on maxValue only ------
+        limits = gather_thresholds(threshold, 'Stagger', stagger_left_exception, section)
         # Finds L2 left stagger exception
-        stagger_left_exception['curve_L2_min'] = 0
-        stagger_left_exception['curve_L2_max'] = 0
-        stagger_left_exception['tangent_L2_min'] = 0
-        stagger_left_exception['tangent_L2_max'] = 0
-        if (line == 'TML'):
-            other_curve_L2_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve') &
-                                                                 (~stagger_left_exception['Section'].isin(['KSL', 'SCL']))].index
-            stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-            stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-            other_tangent_L2_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent') &
-                                                                   (~stagger_left_exception['Section'].isin(['KSL', 'SCL']))].index
-            stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-            stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-        
-            KSL_tangent_L2_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent') &
-                                                                 (stagger_left_exception['Section'] == 'KSL')].index
-            stagger_left_exception.loc[KSL_tangent_L2_row_location, 'tangent_L2_min'] = KSL_tangent_stagger_L2_min
-            stagger_left_exception.loc[KSL_tangent_L2_row_location, 'tangent_L2_max'] = KSL_tangent_stagger_L2_max
-        else:
-            if (section in ['LOW', 'RAC', 'LMC']):
-                other_curve_L2_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve')].index
-                stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-                stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-                other_tangent_L2_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent')].index
-                stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-                stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-            else:
-                other_curve_L2_row_location = stagger_left_exception[(stagger_left_exception['Section'] != 'SCL') &
-                                                                     (stagger_left_exception['track type'] == 'Curve')].index
-                stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-                stagger_left_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-                other_tangent_L2_row_location = stagger_left_exception[(stagger_left_exception['Section'] != 'SCL') &
-                                                                       (stagger_left_exception['track type'] == 'Tangent')].index
-                stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-                stagger_left_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-        
-        stagger_left_exception.loc[((stagger_left_exception.curve_L2_min <= stagger_left_exception.maxValue) &
-                                    (stagger_left_exception.maxValue < stagger_left_exception.curve_L2_max)), 'level'] = 'L2'
-        stagger_left_exception.loc[((stagger_left_exception.tangent_L2_min <= stagger_left_exception.maxValue) &
-                                    (stagger_left_exception.maxValue < stagger_left_exception.tangent_L2_max)), 'level'] = 'L2'
+        stagger_left_exception.loc[((limits['L2_min'] <= stagger_left_exception.maxValue) &
+                                    (stagger_left_exception.maxValue < limits['L2_max'])), 'level'] = 'L2'
         # Finds L1 left stagger exception
-        stagger_left_exception['curve_L1'] = float('inf')
-        stagger_left_exception['tangent_L1'] = float('inf')
-
-        if (line == 'TML'):
-            other_curve_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve')].index
-            stagger_left_exception.loc[other_curve_L1_row_location, 'curve_L1'] = curve_stagger_L1_min
-            KSL_curve_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve') &
-                                                               (stagger_left_exception['Section'] == 'KSL')].index
-            stagger_left_exception.loc[KSL_curve_L1_row_location, 'curve_L1'] = KSL_curve_stagger_L1_min
-            SCL_curve_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve') &
-                                                               (stagger_left_exception['Section'] == 'SCL')].index
-            stagger_left_exception.loc[SCL_curve_L1_row_location, 'curve_L1'] = SCL_curve_stagger_L1_min
-
-            other_tangent_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent')].index
-            stagger_left_exception.loc[other_tangent_L1_row_location, 'tangent_L1'] = tangent_stagger_L1_min
-            KSL_tangent_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent') &
-                                                                 (stagger_left_exception['Section'] == 'KSL')].index
-            stagger_left_exception.loc[KSL_tangent_L1_row_location, 'tangent_L1'] = KSL_tangent_stagger_L1_min
-            SCL_tangent_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent') &
-                                                                 (stagger_left_exception['Section'] == 'SCL')].index
-            stagger_left_exception.loc[SCL_tangent_L1_row_location, 'tangent_L1'] = SCL_tangent_stagger_L1_min
-        else:
-            other_curve_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve')].index
-            stagger_left_exception.loc[other_curve_L1_row_location, 'curve_L1'] = curve_stagger_L1_min
-            other_tangent_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent')].index
-            stagger_left_exception.loc[other_tangent_L1_row_location, 'tangent_L1'] = tangent_stagger_L1_min
-
-            if (section not in ['LOW', 'RAC', 'LMC']):
-                SCL_curve_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Curve') &
-                                                                   (stagger_left_exception['Section'] == 'SCL')].index
-                stagger_left_exception.loc[SCL_curve_L1_row_location, 'curve_L1'] = SCL_curve_stagger_L1_min
-
-                
-                SCL_tangent_L1_row_location = stagger_left_exception[(stagger_left_exception['track type'] == 'Tangent') &
-                                                                     (stagger_left_exception['Section'] == 'SCL')].index
-                stagger_left_exception.loc[SCL_tangent_L1_row_location, 'tangent_L1'] = SCL_tangent_stagger_L1_min
-
-        stagger_left_exception.loc[(stagger_left_exception['maxValue'] >= stagger_left_exception['curve_L1']), 'level'] = 'L1' 
-        stagger_left_exception.loc[(stagger_left_exception['maxValue'] >= stagger_left_exception['tangent_L1']), 'level'] = 'L1'
+        stagger_left_exception.loc[(stagger_left_exception['maxValue'] >= limits['L1_min']), 'level'] = 'L1'
 
         stagger_left_exception['level'] = stagger_left_exception['level'].replace('na', np.nan)
         stagger_left_exception['level'] = stagger_left_exception['level'].fillna('L3')
@@ -1163,177 +1159,23 @@ def find_stagger_exception(stagger_left, stagger_right, threshold, date, line, s
         # ---------- Left stagger exception ----------
 
     # ---------- Right stagger exception ----------
-    stagger_right['Km_roundup'] = stagger_right['Km'].round(3)
-
     # Labels all found exceptions L3 for now
-    stagger_right['curve_L3_min'] = float('inf')
-    stagger_right['tangent_L3_min'] = float('inf')
-    
-    if (line == 'TML'):
-        other_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve')].index
-        stagger_right.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-        KSL_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve') &
-                                                      (stagger_right['Section'] == 'KSL')].index
-        stagger_right.loc[KSL_curve_L3_min_row_location, 'curve_L3_min'] = KSL_curve_stagger_L3_min
-        SCL_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve') &
-                                                      (stagger_right['Section'] == 'SCL')].index
-        stagger_right.loc[SCL_curve_L3_min_row_location, 'curve_L3_min'] = SCL_curve_stagger_L3_min
-
-        other_tangentL3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent')].index
-        stagger_right.loc[other_tangentL3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-        KSL_tangent_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent') &
-                                                        (stagger_right['Section'] == 'KSL')].index
-        stagger_right.loc[KSL_tangent_L3_min_row_location, 'tangent_L3_min'] = KSL_tangent_stagger_L3_min
-        SCL_tangent_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent') &
-                                                        (stagger_right['Section'] == 'SCL')].index
-        stagger_right.loc[SCL_tangent_L3_min_row_location, 'tangent_L3_min'] = SCL_tangent_stagger_L3_min
-    else:
-        if (section in ['LOW', 'RAC', 'LMC']):
-            other_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve')].index
-            stagger_right.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-            other_tangentL3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent')].index
-            stagger_right.loc[other_tangentL3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-        else:
-            other_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve')].index
-            stagger_right.loc[other_curve_L3_min_row_location, 'curve_L3_min'] = curve_stagger_L3_min
-            SCL_curve_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Curve') &
-                                                          (stagger_right['Section'] == 'SCL')].index
-            stagger_right.loc[SCL_curve_L3_min_row_location, 'curve_L3_min'] = SCL_curve_stagger_L3_min
-
-            other_tangentL3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent')].index
-            stagger_right.loc[other_tangentL3_min_row_location, 'tangent_L3_min'] = tangent_stagger_L3_min
-            SCL_tangent_L3_min_row_location = stagger_right[(stagger_right['track type'] == 'Tangent') &
-                                                            (stagger_right['Section'] == 'SCL')].index
-            stagger_right.loc[SCL_tangent_L3_min_row_location, 'tangent_L3_min'] = SCL_tangent_stagger_L3_min
-
-        
-    stagger_right['curve_L3'] = (stagger_right.maxValue <= -stagger_right.curve_L3_min)
-    stagger_right['tangent_L3'] = (stagger_right.maxValue <= -stagger_right.tangent_L3_min)
-    stagger_right['curve_L3_id'] = (stagger_right.curve_L3 != stagger_right.curve_L3.shift()).cumsum()
-    stagger_right['tangent_L3_id'] = (stagger_right.tangent_L3 != stagger_right.tangent_L3.shift()).cumsum()
-    stagger_right['curve_L3_count'] = stagger_right.groupby(['curve_L3', 'curve_L3_id']).cumcount(ascending=False) + 1
-    stagger_right['tangent_L3_count'] = stagger_right.groupby(['tangent_L3', 'tangent_L3_id']).cumcount(ascending=False) + 1
-    stagger_right.loc[~stagger_right['curve_L3'], 'curve_L3_count'] = 0
-    stagger_right.loc[~stagger_right['tangent_L3'], 'tangent_L3_count'] = 0
-    if stagger_right['curve_L3'].any() or stagger_right['tangent_L3'].any():
-
-        stagger_right_exception_full = stagger_right[(stagger_right['curve_L3_count'] != 0) |
-                                                     (stagger_right['tangent_L3_count'] != 0)]
-
-        stagger_right_exception_full.loc[stagger_right_exception_full['curve_L3'], 'exception type'] = 'Stagger'
-        stagger_right_exception_full.loc[stagger_right_exception_full['tangent_L3'], 'exception type'] = 'Stagger'
-
-        stagger_right_exception = stagger_right_exception_full\
-            .groupby(['exception type', 'curve_L3_id', 'tangent_L3_id'])\
-            .agg({'Km': ['min', 'max'], 'maxValue': ['min', 'max'], 'Km_roundup': ['min', 'max']})
-        stagger_right_exception.columns = stagger_right_exception.columns.map('_'.join)
-        stagger_right_exception = (stagger_right_exception.assign(key=1)\
-                                   .merge(stagger_right_exception_full.assign(key=1), on='key')\
-                                    .query('`maxValue_min` == `maxValue` & `Km_roundup`.between(`Km_roundup_min`, `Km_roundup_max`)', engine='python')\
-                                        .drop(columns=['maxValue_max', 'key', 'maxValue', 'stagger1', 'stagger2', 'stagger3', 'stagger4',
-                                                       'curve_L3', 'tangent_L3', 'curve_L3_id', 'tangent_L3_id', 'curve_L3_count', 'tangent_L3_count'])\
-                                                        .rename({'Km': 'maxLocation', 'Km_roundup_min': 'startKm',
-                                                                 'Km_roundup_max': 'endKm','maxValue_min': 'maxValue'}, axis=1)\
-                                                                    .reset_index()\
-                                                                        .drop('index', axis=1))
-        stagger_right_exception['length'] = stagger_right_exception['endKm'] - stagger_right_exception['startKm']
-        stagger_right_exception = stagger_right_exception[['exception type', 'startKm', 'endKm', 'length',
-                                                           'maxValue', 'maxLocation', 'track type', 'Section']]\
-                                                            .sort_values('startKm')\
-                                                                .drop_duplicates(subset=['exception type', 'startKm', 'endKm'])\
-                                                                    .reset_index()\
-                                                                        .drop('index', axis=1)
+    limits = gather_thresholds(threshold, 'Stagger', stagger_right, section)
+    stagger_right['L3'] = (stagger_right.maxValue <= -limits['L3_min'])
+    if stagger_right['L3'].any():
+        # A run also ends where the track type changes, since the stagger limits change with it
+        stagger_right_exception = find_exception_runs(stagger_right, stagger_right['L3'], 'Stagger', 'min', split_by='track type')
 
         # Applies chain length
-        stagger_right_exception['group'] = (stagger_right_exception['startKm'] - stagger_right_exception['endKm'].shift().fillna(0) >= chain_length).cumsum()
-        stagger_right_exception = (stagger_right_exception.groupby('group').apply(min_aggregate_group).reset_index(drop=True))
+        stagger_right_exception = apply_chain_length(stagger_right_exception, 'min', chain_length)
 
         # ------ defining alarm level depends on maxValue only ------
-        # Finds L1 left stagger exception
-        stagger_right_exception['curve_L2_min'] = 0
-        stagger_right_exception['curve_L2_max'] = 0
-        stagger_right_exception['tangent_L2_min'] = 0
-        stagger_right_exception['tangent_L2_max'] = 0
-
-        if (line == 'TML'):
-            other_curve_L2_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve') &
-                                                                  (~stagger_right_exception['Section'].isin(['KSL', 'SCL']))].index
-            stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-            stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-            other_tangent_L2_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent') &
-                                                                    (~stagger_right_exception['Section'].isin(['KSL', 'SCL']))].index
-            stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-            stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-
-            KSL_tangent_L2_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent') &
-                                                                  (stagger_right_exception['Section'] == 'KSL')].index
-            stagger_right_exception.loc[KSL_tangent_L2_row_location, 'tangent_L2_min'] = KSL_tangent_stagger_L2_min
-            stagger_right_exception.loc[KSL_tangent_L2_row_location, 'tangent_L2_max'] = KSL_tangent_stagger_L2_max
-        else:
-            if (section in ['LOW', 'RAC', 'LMC']):
-                other_curve_L2_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve')].index
-                stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-                stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-                other_tangent_L2_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent')].index
-                stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-                stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-            else:
-                other_curve_L2_row_location = stagger_right_exception[(stagger_right_exception['Section'] != 'SCL') &
-                                                                      (stagger_right_exception['track type'] == 'Curve')].index
-                stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_min'] = curve_stagger_L2_min
-                stagger_right_exception.loc[other_curve_L2_row_location, 'curve_L2_max'] = curve_stagger_L2_max
-
-                other_tangent_L2_row_location = stagger_right_exception[(stagger_right_exception['Section'] != 'SCL') &
-                                                                        (stagger_right_exception['track type'] == 'Tangent')].index
-                stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_min'] = tangent_stagger_L2_min
-                stagger_right_exception.loc[other_tangent_L2_row_location, 'tangent_L2_max'] = tangent_stagger_L2_max
-
-        stagger_right_exception.loc[((-stagger_right_exception.curve_L2_min >= stagger_right_exception.maxValue) & 
-                                     (stagger_right_exception.maxValue > -stagger_right_exception.curve_L2_max)), 'level'] = 'L2'
-        stagger_right_exception.loc[((-stagger_right_exception.tangent_L2_min >= stagger_right_exception.maxValue) &
-                                     (stagger_right_exception.maxValue > -stagger_right_exception.tangent_L2_max)), 'level'] = 'L2'
-
-        # Finds L1 left stagger exception
-        stagger_right_exception['curve_L1'] = float('inf')
-        stagger_right_exception['tangent_L1'] = float('inf')
-
-        if (line == 'TML'):
-            other_curve_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve')].index
-            stagger_right_exception.loc[other_curve_L1_row_location, 'curve_L1'] = curve_stagger_L1_min
-            KSL_curve_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve') &
-                                                                (stagger_right_exception['Section'] == 'KSL')].index
-            stagger_right_exception.loc[KSL_curve_L1_row_location, 'curve_L1'] = KSL_curve_stagger_L1_min
-            SCL_curve_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve') &
-                                                                (stagger_right_exception['Section'] == 'SCL')].index
-            stagger_right_exception.loc[SCL_curve_L1_row_location, 'curve_L1'] = SCL_curve_stagger_L1_min
-
-            other_tangent_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent')].index
-            stagger_right_exception.loc[other_tangent_L1_row_location, 'tangent_L1'] = tangent_stagger_L1_min
-            KSL_tangent_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent') &
-                                                                (stagger_right_exception['Section'] == 'KSL')].index
-            stagger_right_exception.loc[KSL_tangent_L1_row_location, 'tangent_L1'] = KSL_tangent_stagger_L1_min
-            SCL_tangent_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent') &
-                                                                (stagger_right_exception['Section'] == 'SCL')].index
-            stagger_right_exception.loc[SCL_tangent_L1_row_location, 'tangent_L1'] = SCL_tangent_stagger_L1_min
-        else:
-            other_curve_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve')].index
-            stagger_right_exception.loc[other_curve_L1_row_location, 'curve_L1'] = curve_stagger_L1_min
-            other_tangent_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent')].index
-            stagger_right_exception.loc[other_tangent_L1_row_location, 'tangent_L1'] = tangent_stagger_L1_min
-
-            if (section not in ['LOW', 'RAC', 'LMC']):
-                SCL_curve_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Curve') &
-                                                                    (stagger_right_exception['Section'] == 'SCL')].index
-                stagger_right_exception.loc[SCL_curve_L1_row_location, 'curve_L1'] = SCL_curve_stagger_L1_min
-                SCL_tangent_L1_row_location = stagger_right_exception[(stagger_right_exception['track type'] == 'Tangent') &
-                                                                      (stagger_right_exception['Section'] == 'SCL')].index
-                stagger_right_exception.loc[SCL_tangent_L1_row_location, 'tangent_L1'] = SCL_tangent_stagger_L1_min
-
-
-        stagger_right_exception.loc[(stagger_right_exception['maxValue'] <= -stagger_right_exception['curve_L1']), 'level'] = 'L1'
-        stagger_right_exception.loc[(stagger_right_exception['maxValue'] <= -stagger_right_exception['tangent_L1']), 'level'] = 'L1'
+        limits = gather_thresholds(threshold, 'Stagger', stagger_right_exception, section)
+        # Finds L2 right stagger exception
+        stagger_right_exception.loc[((-limits['L2_min'] >= stagger_right_exception.maxValue) &
+                                     (stagger_right_exception.maxValue > -limits['L2_max'])), 'level'] = 'L2'
+        # Finds L1 right stagger exception
+        stagger_right_exception.loc[(stagger_right_exception['maxValue'] <= -limits['L1_min']), 'level'] = 'L1'
 
         stagger_right_exception['level'] = stagger_right_exception['level'].replace('na', np.nan)
         stagger_right_exception['level'] = stagger_right_exception['level'].fillna('L3')
@@ -1351,42 +1193,95 @@ def find_stagger_exception(stagger_left, stagger_right, threshold, date, line, s
     return stagger_left_exception, stagger_right_exception
 
 
-def indicate_overlap_landmark(overlap, landmark, exception_table):
+def build_overlap_landmark_index(overlap, landmark):
     """
-    Writes the overlap and landmark columns in the input exception table.
-    For each exception id, assigns the corresponding overlap and landmark values.
+    Builds the lookup index of the overlap and landmark tables once for the whole run.
+
+    Overlap rows are not expected to overlap each other; if they do, the row listed first wins.
+    Landmarks can be nested (e.g. a platform inside a longer station area), so a location
+    inside more than one landmark is labelled with the shortest one, and ties go to the landmark listed first.
 
     Args:
         overlap (DataFrame): The overlap and tension length of the line.
         landmark (DataFrame): The landmark of the line.
-        exception_table (DataFrame): The exception table to be edited.
 
     Returns:
-        (DataFrame): The exception table with added overlap and landmark columns.
+        (dict): The interval indexes and the label columns of the overlap and landmark tables.
+    """
+    # The label of position -1 (no match) is appended at the end of each column
+    return {
+        'overlap_index': build_interval_index(overlap['FromKM'], overlap['ToKM']),
+        'landmark_index': build_interval_index(landmark['FromKM'], landmark['ToKM'],
+                                               priority=landmark['ToKM'] - landmark['FromKM']),
+        'Overlap': np.append(overlap['Overlap'].to_numpy(dtype=object), np.nan),
+        'Tension Length': np.append(overlap['Tension Length'].to_numpy(dtype=object), np.nan),
+        'Landmark': np.append(landmark['Landmark'].to_numpy(dtype=object), 'typical')
+    }
+
+
+def label_locations(overlap_landmark_index, locations):
+    """
+    Labels each location with its overlap, tension length and landmark in one vectorized pass.
+
+    Args:
+        overlap_landmark_index (dict): The index returned by build_overlap_landmark_index.
+        locations (array-like): The locations (in KM) to be labelled.
+
+    Returns:
+        (DataFrame): The Overlap, Tension Length and Landmark of each location.
     """
-    overlap_id = exception_table\
-        .assign(key=1).merge(overlap.assign(key=1), on='key')\
-        .query('`maxLocation`.between(`FromKM`, `ToKM`)', engine='python')\
-        .reset_index(drop=True)[['id', 'Overlap', 'Tension Length']]
+    overlap_position = lookup_interval(overlap_landmark_index['overlap_index'], locations)
+    landmark_position = lookup_interval(overlap_landmark_index['landmark_index'], locations)
+    return pd.DataFrame({
+        'Overlap': overlap_landmark_index['Overlap'][overlap_position],
+        'Tension Length': overlap_landmark_index['Tension Length'][overlap_position],
+        'Landmark': overlap_landmark_index['Landmark'][landmark_position]
+    })
 
-    exception_table = pd.merge(exception_table, overlap_id, on='id', how='outer')
 
-    landmark_id = (exception_table\
-                   .assign(key=1)\
-                    .merge(landmark.assign(key=1), on='key')\
-                        .query('`maxLocation`.between(`FromKM`, `ToKM`)', engine='python')\
-                            .reset_index(drop=True)[['id', 'Landmark']])
+def indicate_overlap_landmark(overlap_landmark_index, exception_table):
+    """
+    Writes the overlap and landmark columns in the input exception table.
+    For each exception id, assigns the corresponding overlap and landmark values of its maxLocation.
+
+    Args:
+        overlap_landmark_index (dict): The index returned by build_overlap_landmark_index.
+        exception_table (DataFrame): The exception table to be edited.
 
-    exception_table = pd.merge(exception_table, landmark_id, on='id', how='outer')
-    exception_table['Landmark'] = exception_table['Landmark'].fillna(value='typical')
+    Returns:
+        (DataFrame): The exception table with added overlap and landmark columns.
+    """
+    exception_table = exception_table.reset_index(drop=True)
+    labels = label_locations(overlap_landmark_index, exception_table['maxLocation'].astype(float))
+    exception_table[['Overlap', 'Tension Length', 'Landmark']] = labels
     return exception_table[['id', 'exception type', 'level', 'startKm', 'endKm', 'length', 'maxValue',
-                            'maxLocation', 'track type', 'Overlap', 'Tension Length', 'Landmark']].drop_duplicates(subset=['id'], keep='first').reset_index(drop=True)
+                            'maxLocation', 'track type', 'Overlap', 'Tension Length', 'Landmark']]
 
 
-def main():
-    line, section, track, raw = file_input()
-    date = output_date(raw)
-    track_type, overlap, landmark, threshold = load_metadata(line, section, track)
+def generate_tables(raw, date, line, section, track, chain_length=default_chain_length, profile=None, metadata=None):
+    """
+    Generates the five exception tables of the report from the cleaned data.
+
+    Args:
+        raw (DataFrame): Cleaned data from input .datac file, as returned by load_recording.
+        date (str): The date of the data collected.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
+        profile (dict): The run profile to record the stages in, as returned by start_profile. Defaults to None.
+        metadata (dict): The lookup tables of the line/ section, as returned by read_metadata.
+            Defaults to None (loads them from the metadata folder).
+
+    Returns:
+        (dict): The exception tables keyed by their sheet name in the Exception Report.
+    """
+    if metadata is None:
+        with stage(profile, 'load_metadata'):
+            track_type, overlap, landmark, threshold = load_metadata(line, section, track)
+    else:
+        track_type, overlap, landmark, threshold = \
+            metadata['track type'], metadata['overlap'], metadata['landmark'], metadata['threshold']
 
     # ----------- for debugging ----------
     # section = 'LMC'
@@ -1400,53 +1295,241 @@ def main():
     # ----------- for debugging ----------
 
     # Loads processed data into corresponding DataFrames
-    raw, WH_cleaned_max, WH_cleaned_min, wear_min, stagger_left, stagger_right = \
-        data_process(raw, track_type, line, track, section)
+    with stage(profile, 'data_process'):
+        raw, WH_cleaned_max, WH_cleaned_min, wear_min, stagger_left, stagger_right = \
+            data_process(raw, track_type)
 
     # Loads exception tables
-    low_height_exception = find_low_height_exception(WH_cleaned_min, threshold, date, line, section, track)
-    high_height_exception = find_high_height_exception(WH_cleaned_max, threshold, date, line, section, track)
-    wear_exception = find_wire_wear_exception(wear_min, threshold, date, line, section, track)
-    stagger_left_exception, stagger_right_exception = find_stagger_exception(stagger_left, stagger_right, threshold, date, line, section, track)
-
-    # ---------- indicate exceptions within overlap  and Landmark section ----------
-    high_height_exception = indicate_overlap_landmark(overlap, landmark, high_height_exception)
-    low_height_exception = indicate_overlap_landmark(overlap, landmark, low_height_exception)
-    stagger_left_exception = indicate_overlap_landmark(overlap, landmark, stagger_left_exception)
-    stagger_right_exception = indicate_overlap_landmark(overlap, landmark, stagger_right_exception)
-    wear_exception = indicate_overlap_landmark(overlap, landmark, wear_exception)
-    # ---------- indicate exceptions within overlap section ----------
-
-    # ---------- Change Km to M ----------
-    wear_exception = km_to_m(wear_exception)
-    low_height_exception = km_to_m(low_height_exception)
-    high_height_exception = km_to_m(high_height_exception)
-    stagger_left_exception = km_to_m(stagger_left_exception)
-    stagger_right_exception = km_to_m(stagger_right_exception)
-    # ---------- Change Km to M ----------
-
-    # ---------- sort the table by id ----------
-    wear_exception = sort_table(wear_exception)
-    low_height_exception = sort_table(low_height_exception)
-    high_height_exception = sort_table(high_height_exception)
-    stagger_left_exception = sort_table(stagger_left_exception)
-    stagger_right_exception = sort_table(stagger_right_exception)
-    # ---------- sort the table by id ----------
+    with stage(profile, 'find_low_height_exception'):
+        low_height_exception = find_low_height_exception(WH_cleaned_min, threshold, date, line, section, track, chain_length)
+    with stage(profile, 'find_high_height_exception'):
+        high_height_exception = find_high_height_exception(WH_cleaned_max, threshold, date, line, section, track, chain_length)
+    with stage(profile, 'find_wire_wear_exception'):
+        wear_exception = find_wire_wear_exception(wear_min, threshold, date, line, section, track, chain_length)
+    with stage(profile, 'find_stagger_exception'):
+        stagger_left_exception, stagger_right_exception = find_stagger_exception(stagger_left, stagger_right, threshold, date, line, section, track,
+                                                                                 chain_length)
+
+    tables = {'wear exception': wear_exception,
+              'low height exception': low_height_exception,
+              'high height exception': high_height_exception,
+              'stagger left exception': stagger_left_exception,
+              'stagger right exception': stagger_right_exception}
+
+    # indicates exceptions within overlap and Landmark section, changes Km to M and sorts the table by id
+    with stage(profile, 'indicate_overlap_landmark'):
+        overlap_landmark_index = build_overlap_landmark_index(overlap, landmark)
+        for sheet_name, exception_table in tables.items():
+            exception_table = indicate_overlap_landmark(overlap_landmark_index, exception_table)
+            tables[sheet_name] = sort_table(km_to_m(exception_table))
+    return tables
+
+
+def generate_exceptions(raw, metadata, line, section, track, chain_length=default_chain_length):
+    """
+    Generates the five exception tables of a recording without any prompt, file dialog or report file.
+
+    Errors are raised instead of exiting, so the generator can be called from another program,
+    e.g. a service or a worker pool, reading the metadata once for all the recordings of a line/ section:
+
+        metadata = read_metadata('./metadata/EAL metadata.xlsx', 'EAL', 'UNI-TAP', 'UP')
+        tables = generate_exceptions('EAL_UP_UNI-TAP.datac', metadata, 'EAL', 'UNI-TAP', 'UP')
+
+    Args:
+        raw (str or DataFrame): The path to the .datac file, or its typed data as returned by read_datac.
+        metadata (str or dict): The path to the metadata .xlsx file of the line,
+            or its lookup tables as returned by read_metadata.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
+
+    Returns:
+        (dict): The exception tables keyed by their sheet name in the Exception Report.
+    """
+    if isinstance(metadata, str):
+        metadata = read_metadata(metadata, line, section, track)
+    if metadata['exception boundary'] is None:
+        raise ValueError('The metadata has no Exception Boundary sheet')
+    if isinstance(raw, str):
+        raw = read_datac(raw)
+    else:
+        # clean_raw changes the heights in place
+        raw = raw.copy()
+    date = output_date(raw)
+    raw = clean_raw(raw, line, track, section, metadata['exception boundary'])
+    return generate_tables(raw, date, line, section, track, chain_length, metadata=metadata)
+
+
+def report_name(date, line, section, track):
+    """
+    Returns the file name of the Exception Report.
+
+    Args:
+        date (str): The date of the data collected.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+
+    Returns:
+        (str): The file name of the Exception Report.
+    """
+    return date + '_' + line + '_' + track + '_' + section.replace('-', '_') + '_' + 'Exception Report.xlsx'
+
+
+def write_xlsx_rows(tables, report_path):
+    """
+    Writes the exception tables row by row with the constant memory mode of xlsxwriter.
+
+    The cells are written in the same layout as DataFrame.to_excel, which cannot be used here
+    since it writes the cells column by column.
+
+    Args:
+        tables (dict): The exception tables keyed by their sheet name, as returned by generate_tables.
+        report_path (str): The path to the Exception Report.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(report_path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    for sheet_name, exception_table in tables.items():
+        worksheet = workbook.add_worksheet(sheet_name)
+        worksheet.write_row(0, 0, [str(column) for column in exception_table.columns], header_format)
+        columns = [exception_table[column].tolist() for column in exception_table.columns]
+        for row_number, row in enumerate(zip(*columns), start=1):
+            worksheet.write_row(row_number, 0, [None if pd.isna(value) else value for value in row])
+    workbook.close()
+
+
+def sidecar_path(report_path, sidecar):
+    """
+    Returns the path to the copy of the exception tables saved next to the Exception Report.
+
+    Args:
+        report_path (str): The path to the Exception Report.
+        sidecar (str): The format of the copy, 'csv' or 'parquet'.
+
+    Returns:
+        (str): The path to the copy.
+    """
+    return os.path.splitext(report_path)[0] + '.' + sidecar
+
+
+def write_sidecar(tables, report_path, sidecar):
+    """
+    Saves all the exception tables in one .csv or .parquet file next to the Exception Report,
+    with the sheet name of each row in the sheet column.
+
+    The find repeated and trend tools read this file instead of the .xlsx file when it is
+    at least as new as the Exception Report.
+
+    Args:
+        tables (dict): The exception tables keyed by their sheet name, as returned by generate_tables.
+        report_path (str): The path to the Exception Report.
+        sidecar (str): The format of the file, 'csv' or 'parquet'.
+
+    Returns:
+        path (str): The path to the saved file.
+    """
+    combined = exception_reports.combine_tables(tables)
+    path = sidecar_path(report_path, sidecar)
+    if sidecar == 'csv':
+        combined.to_csv(path, index=False)
+    elif sidecar == 'parquet':
+        # Parquet stores one type per column, text columns may also hold numbers read from the metadata
+        text_columns = combined.select_dtypes(include='object').columns
+        combined[text_columns] = combined[text_columns].astype('string')
+        combined.to_parquet(path, index=False)
+    else:
+        raise ValueError('Unknown sidecar format ' + str(sidecar) + ', use one of ' + ', '.join(sidecar_formats))
+    return path
+
+
+def write_report(tables, directory, date, line, section, track, sidecar=None, history=history_path):
+    """
+    Writes the exception tables into an Exception Report in the directory.
+
+    Args:
+        tables (dict): The exception tables keyed by their sheet name, as returned by generate_tables.
+        directory (str): The directory to save the Exception Report in.
+        date (str): The date of the data collected.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        sidecar (str): Also saves the tables as 'csv' or 'parquet' next to the report if given. Defaults to None.
+        history (str): The path to the exception history to append the report to, None to skip it.
+            Defaults to history_path.
+
+    Returns:
+        report_path (str): The path to the saved Exception Report.
+    """
+    report_path = directory + '/' + report_name(date, line, section, track)
+    if report_engine == 'xlsxwriter':
+        write_xlsx_rows(tables, report_path)
+    else:
+        with pd.ExcelWriter(report_path, engine=report_engine) as writer:
+            for sheet_name, exception_table in tables.items():
+                exception_table.to_excel(writer, sheet_name=sheet_name, index=False)
+    if sidecar is not None:
+        write_sidecar(tables, report_path, sidecar)
+    if history is not None:
+        exception_reports.append_history(tables, report_path, date, line, section, track, history)
+    return report_path
+
+
+def generate_report(raw_data_path, line, section, track, directory, use_cache=True, chain_length=default_chain_length,
+                    sidecar=None, history=history_path, profiling=None):
+    """
+    Runs the whole generator on a .datac file without any prompt and saves the Exception Report.
+
+    Args:
+        raw_data_path (str): The path to the input .datac file.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        directory (str): The directory to save the Exception Report in.
+        use_cache (bool): Whether to read and store the cleaned data in cache_directory.
+        chain_length (float): The chain length in km. Defaults to default_chain_length.
+        sidecar (str): Also saves the tables as 'csv' or 'parquet' next to the report if given. Defaults to None.
+        history (str): The path to the exception history to append the report to, None to skip it.
+            Defaults to history_path.
+        profiling (str): Saves the profile of the run next to the report if 'stages' or 'cprofile',
+            see profiling_modes. Defaults to None.
+
+    Returns:
+        (str): The path to the saved Exception Report.
+    """
+    profile = start_profile(profiling, datac=raw_data_path)
+    with stage(profile, 'load_recording'):
+        raw, date = load_recording(raw_data_path, line, section, track, use_cache)
+    tables = generate_tables(raw, date, line, section, track, chain_length, profile)
+    with stage(profile, 'write_report'):
+        report_path = write_report(tables, directory, date, line, section, track, sidecar, history)
+    write_profile(profile, report_path, rows=len(raw))
+    return report_path
+
+
+def main():
+    # set the TOV640_PROFILE environment variable to 'stages' or 'cprofile' to profile the run
+    profile = start_profile(os.environ.get('TOV640_PROFILE') or None, datac=None)
+    with stage(profile, 'file_input'):
+        line, section, track, raw_data_path = file_input()
+    if profile is not None:
+        profile['details']['datac'] = raw_data_path
+    with exit_on_error('This error occured when processing the .datac file.'):
+        with stage(profile, 'load_recording'):
+            raw, date = load_recording(raw_data_path, line, section, track)
+        tables = generate_tables(raw, date, line, section, track, profile=profile)
 
     # ---------- output results ----------
     print('Saving as Excel at', datetime.now())
     print('Done!')
     input('Press Enter to select save location')
+    from tkinter import filedialog
     directory = filedialog.askdirectory()
-
-    with pd.ExcelWriter(directory + '/' + date + '_' + line + '_' + track + '_' + 
-                        section.replace('-', '_') + '_' + 'Exception Report.xlsx') as writer:
-        wear_exception.to_excel(writer, sheet_name='wear exception', index=False)
-        low_height_exception.to_excel(writer, sheet_name='low height exception', index=False)
-        high_height_exception.to_excel(writer, sheet_name='high height exception', index=False)
-        stagger_left_exception.to_excel(writer, sheet_name='stagger left exception', index=False)
-        stagger_right_exception.to_excel(writer, sheet_name='stagger right exception', index=False)
-    
+    with stage(profile, 'write_report'):
+        report_path = write_report(tables, directory, date, line, section, track)
+    write_profile(profile, report_path, rows=len(raw))
     print('Saved at ' + directory)
     # ---------- output results ----------
 
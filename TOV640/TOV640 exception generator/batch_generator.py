@@ -0,0 +1,157 @@
+"""
+File: batch_generator.py
+Author: Lam Wai Taing, Timothy
+Date: 2026/10/17
+Description: A Python script to generate the TOV640 exception reports of a whole directory of .datac files
+without any prompt, processing the files in parallel.
+"""
+
+import os
+import re
+import sys
+import glob
+import argparse
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+import TOV640_exception_generator as generator
+
+
+def infer_run_details(raw_data_path):
+    """
+    Infers the line, section and track of a .datac file from its file name.
+
+    The file name is split at underscores, spaces and dots, e.g. EAL_UP_UNI-TAP_20240613.datac,
+    TML_DN_TUM_HUH.datac or EAL_LOW_S1.datac.
+
+    Args:
+        raw_data_path (str): The path to the .datac file.
+
+    Returns:
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+    """
+    tokens = re.split(r'[_\s.]+', os.path.splitext(os.path.basename(raw_data_path))[0].upper())
+    line = next((t for t in tokens if t in ['EAL', 'TML']), None)
+    track = next((t for t in tokens if t in ['UP', 'DN']), None)
+    section = next((t for t in tokens if t in ['LMC', 'RAC', 'LOW'] or re.match('^[A-Z]{3}-[A-Z]{3}$', t)), None)
+    if section is None:
+        # section range written with an underscore, e.g. TUM_HUH
+        codes = [t for t in tokens if re.match('^[A-Z]{3}$', t) and t not in ['EAL', 'TML']]
+        if len(codes) == 2:
+            section = codes[0] + '-' + codes[1]
+    if section == 'LOW':
+        track = 'S1'
+
+    if line is None or section is None or track is None:
+        raise ValueError('Cannot infer the line, section and track from ' + os.path.basename(raw_data_path) +
+                         ', please list the file in a manifest')
+    if line == 'TML' and section in ['LMC', 'RAC', 'LOW']:
+        raise ValueError('Section ' + section + ' does not belong to TML in ' + os.path.basename(raw_data_path))
+    return line, section, track
+
+
+def read_manifest(manifest_path):
+    """
+    Reads the manifest listing the line, section and track of each .datac file.
+
+    The manifest is a .csv file with the columns file, line, section and track.
+    Relative file paths are relative to the folder of the manifest.
+
+    Args:
+        manifest_path (str): The path to the manifest.
+
+    Returns:
+        (dict): The (line, section, track) of each .datac file keyed by its absolute path.
+    """
+    manifest = pd.read_csv(manifest_path, dtype=str).apply(lambda x: x.str.strip())
+    missing = {'file', 'line', 'section', 'track'} - set(manifest.columns)
+    if missing:
+        raise ValueError('Missing columns in ' + manifest_path + ': ' + ', '.join(sorted(missing)))
+
+    folder = os.path.dirname(os.path.abspath(manifest_path))
+    return {os.path.abspath(os.path.join(folder, row['file'])): (row['line'], row['section'], row['track'])
+            for _, row in manifest.iterrows()}
+
+
+def find_datac_files(inputs):
+    """
+    Lists the .datac files of the input directories, glob patterns and files.
+
+    Args:
+        inputs (list[str]): The directories, glob patterns or paths of .datac files.
+
+    Returns:
+        (list[str]): The sorted absolute paths of the .datac files.
+    """
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, '*.datac')) + glob.glob(os.path.join(item, '*.DATAC'))
+        else:
+            matches = glob.glob(item)
+        paths.update(os.path.abspath(path) for path in matches if os.path.isfile(path))
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates the TOV640 Exception Report of every .datac file '
+                                                 'in parallel. Run it in the folder containing the metadata folder.')
+    parser.add_argument('inputs', nargs='*', help='directories, glob patterns or .datac files')
+    parser.add_argument('--manifest', help='.csv file with the columns file, line, section and track')
+    parser.add_argument('--output', help='directory to save the reports in (default: next to each .datac file)')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per CPU)')
+    parser.add_argument('--no-cache', action='store_true', help='do not read or store the cleaned .datac data')
+    parser.add_argument('--chain-length', type=float, default=generator.default_chain_length * 1000,
+                        help='merge exceptions less than this many meters apart (default: %(default)g)')
+    parser.add_argument('--sidecar', choices=generator.sidecar_formats,
+                        help='also save the exception tables in this format next to each report, '
+                             'the find repeated and trend tools read it instead of the .xlsx file')
+    parser.add_argument('--no-history', action='store_true', help='do not append the reports to the exception history')
+    parser.add_argument('--profile', choices=generator.profiling_modes,
+                        help='save the time of each stage and the peak memory of the process after it next to each report '
+                             'as <report>_profile.json, cprofile also saves the cProfile output as <report>.prof')
+    args = parser.parse_args()
+
+    manifest = read_manifest(args.manifest) if args.manifest else {}
+    paths = find_datac_files(args.inputs) if args.inputs else sorted(manifest)
+    if not paths:
+        parser.error('no .datac file found')
+    if args.sidecar == 'parquet' and not (importlib.util.find_spec('pyarrow') or importlib.util.find_spec('fastparquet')):
+        parser.error('--sidecar parquet needs pyarrow or fastparquet to be installed')
+
+    # Works out the details of every file before starting, so a bad file name stops the batch early
+    jobs = []
+    for path in paths:
+        line, section, track = manifest[path] if path in manifest else infer_run_details(path)
+        directory = args.output if args.output else os.path.dirname(path)
+        jobs.append((path, line, section, track, directory))
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+
+    print('Generating ' + str(len(jobs)) + ' Exception Reports...')
+    failed = []
+    # a profiled recording gets a new worker process, so the process peak memory of its profile is not carried
+    # over from the recordings before it (needs Python 3.11)
+    fresh_workers = {'max_tasks_per_child': 1} if args.profile and sys.version_info >= (3, 11) else {}
+    with ProcessPoolExecutor(max_workers=args.workers, **fresh_workers) as executor:
+        futures = {executor.submit(generator.generate_report, path, line, section, track, directory, not args.no_cache,
+                                   args.chain_length / 1000, args.sidecar,
+                                   None if args.no_history else generator.history_path, args.profile): path
+                   for path, line, section, track, directory in jobs}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                print('Saved: ' + future.result())
+            except (Exception, SystemExit) as err:
+                failed.append(path)
+                print('ERROR: ' + repr(err) + ' in ' + os.path.basename(path))
+
+    print('Done! ' + str(len(jobs) - len(failed)) + ' of ' + str(len(jobs)) + ' Exception Reports generated')
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,92 +12,291 @@ from datetime import datetime
 import tkinter as tk
 from tkinter import filedialog
 import os
+import sys
 import openpyxl
 import numpy as np
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+# the modules shared by the TOV640 tools are in the TOV640 folder
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from run_profile import start_profile, stage, write_profile
+import exception_reports
 
-def clean_case(case):
+# sheets of the Exception Report
+report_sheets = ['wear exception', 'low height exception', 'high height exception',
+                 'stagger left exception', 'stagger right exception']
+
+# columns of the exception tables used to find the repeated exceptions
+report_columns = ['id', 'exception type', 'level', 'startM', 'endM', 'length', 'maxValue', 'maxLocation',
+                  'track type', 'Overlap', 'Tension Length', 'Landmark']
+
+# chainage alignment: the largest shift (m) searched between two runs, the bin size (m) of the exception
+# profiles cross-correlated to find it, and the tolerance (m) of the matching once the runs are aligned
+max_shift = 20
+shift_resolution = 0.5
+shift_tolerance = 1
+
+# metadata holding the templates of the report, and the copy of the templates kept in the cache folder
+template_source = './metadata/EAL metadata.xlsx'
+template_path = './cache/find repeated template.xlsx'
+
+
+def read_exception_report(path):
     """
-    A helper function to clean up the dataframe. Renames the columns and assigns the Previous columns to the dataframe.
+    Reads the five exception tables of an Exception Report, only the columns in report_columns
+    (see exception_reports.read_exception_report).
 
     Args:
-        case (DataFrame): The input DataFrame to be cleaned up.
+        path (str): The path to the Exception Report, or its key in the exception history.
 
-    Retruns:
-        (DataFrame): The cleaned DataFrame.
+    Returns:
+        (dict): The exception tables keyed by their sheet name.
     """
-    case_fix = case.drop(columns=['exception type_x', 'level_x', 'startM_x', 'endM_x',
-                                    'length_x', 'maxValue_x', 'maxLocation_x', 'track type_x',
-                                    'key', 'startM_shift_x', 'endM_shift_x',
-                                  'maxLocation_shift_x', 'startM_shift_y', 'endM_shift_y', 'maxLocation_shift_y', 'Overlap_x',
-                                  'Tension Length_x', 'Landmark_x'])\
-        .rename({'id_y': 'id', 'exception type_y': 'exception type', 'level_y': 'level', 'startM_y': 'startM',
-                 'endM_y': 'endM', 'length_y': 'length', 'maxValue_y': 'maxValue', 'maxLocation_y': 'maxLocation',
-                 'track type_y': 'track type', 'Overlap_y': 'Overlap', 'Tension Length_y': 'Tension Length',
-                 'Landmark_y': 'Landmark'}, axis=1)
-    if 'previous' in case_fix.columns:
-        case_fix['previous'] = case_fix['previous'].astype(str) + ',' + case_fix['id_x'].astype(str)
-        # case_fix['Previous 2'] = case_fix['id_x'].astype(str)
-    else:
-        case_fix['previous'] = case_fix['id_x'].astype(str)
-        # case_fix['Previous 1'] = case_fix['id_x'].astype(str)
-        # case_fix['Previous 2'] = ''
+    return exception_reports.read_exception_report(path, report_sheets, report_columns)
+
+
+def read_exception_reports(paths):
+    """
+    Reads several Exception Reports at once, one per worker process.
+
+    Args:
+        paths (list[str]): The paths to the Exception Reports.
 
-    case_fix = case_fix.reset_index().drop(columns=['index', 'id_x'])
-    return case_fix[['id', 'exception type', 'level', 'startM', 'endM', 'length', 'maxValue',
-                     'maxLocation', 'track type', 'Overlap', 'Tension Length', 'Landmark', 'previous']]
+    Returns:
+        (list[dict]): The exception tables of each report keyed by their sheet name, in the order of paths.
+    """
+    with ProcessPoolExecutor(max_workers=min(len(paths), os.cpu_count() or 1)) as executor:
+        return list(executor.map(read_exception_report, paths))
 
 
-def find_repeated(df1, df2, df1_shift, df2_shift):
+def expand_ranges(lower, upper):
     """
-    Finds any repeated exception in the same category between two DataFrames from the exception reports.
+    Lists every position of the ranges [lower, upper) one after another.
 
     Args:
-        df1 (DataFrame): The first DataFrame.
-        df2 (DataFrame): The second DataFrame.
-        df1_shift ():
-        df2_shift (): 
+        lower (ndarray): The first position of each range.
+        upper (ndarray): The position after the last position of each range.
 
     Returns:
-        (DataFrame): The DataFrame which contains the repeated exception.
-    """
-    if df1.empty or df2.empty:
-        return pd.DataFrame(columns=['id', 'exception type', 'level', 'startM', 'endM', 'length',
-                                     'maxValue', 'maxLocation', 'track type', 'Overlap', 'Tension Length', 'Landmark', 'Previous 1', 'Previous 2'])
-    else:
-        for all in ['startM', 'endM', 'maxLocation']:
-            df1[all + '_shift'] = df1[all] + df1_shift
-            df2[all + '_shift'] = df2[all] + df2_shift
-        merged = df1.assign(key=1).merge(df2.assign(key=1), on='key')
-
-        # ---------- case1 = 1st exception behind, 2nd at front ----------
-        case1 = merged.query('(`startM_x`.between(`startM_y`, `endM_y`)) & '
-                           '(`endM_x` > `endM_y`) &'
-                           '(`maxLocation_x`.between(`startM_x`, `endM_y`)) &'
-                           '(`maxLocation_y`.between(`startM_x`, `endM_y`))', engine='python')
-
-        # ---------- case2 = 1st exception at front, 2nd behind ----------
-        case2 = merged.query('(`startM_y`.between(`startM_x`, `endM_x`)) & '
-                           '(`endM_x` < `endM_y`) &'
-                           '(`maxLocation_x`.between(`startM_y`, `endM_x`)) &'
-                           '(`maxLocation_y`.between(`startM_y`, `endM_x`))', engine='python')
-
-        # ---------- case3 = 2nd exception covering whole 1st  ----------
-        case3 = merged.query('(`startM_x` >= `startM_y`) & '
-                           '(`endM_x` <= `endM_y`) & '
-                           '(`maxLocation_x`.between(`startM_x`, `endM_x`)) &'
-                           '(`maxLocation_y`.between(`startM_x`, `endM_x`))', engine='python')
-
-        # ---------- case4 = 1st exception covering whole 2nd  ----------
-        case4 = merged.query('(`startM_x` <= `startM_y`) & '
-                           '(`endM_x` >= `endM_y`) & '
-                           '(`maxLocation_x`.between(`startM_y`, `endM_y`)) &'
-                           '(`maxLocation_y`.between(`startM_y`, `endM_y`))', engine='python')
-
-        return pd.concat([clean_case(case1), clean_case(case2), clean_case(case3), clean_case(case4)])\
-            .drop_duplicates(keep='first')\
-            .reset_index().drop('index', axis=1)
+        owner (ndarray): The range of each position.
+        position (ndarray): The positions.
+    """
+    counts = np.maximum(upper - lower, 0)
+    owner = np.repeat(np.arange(len(lower)), counts)
+    position = np.repeat(lower, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, position
+
+
+def match_overlaps(start1, end1, max1, start2, end2, max2, tolerance=0):
+    """
+    Finds the pairs of exceptions of two reports that overlap with both maxLocations inside the overlapping part.
+
+    Only the exceptions of the second report whose maxLocation lies within an exception of the first report
+    (widened by the tolerance) can match it, so the second report is sorted by maxLocation and the candidates
+    of each exception are found with a binary search instead of pairing every two exceptions.
+
+    The case of a pair is the first of:
+        1: the 1st exception behind, 2nd at front
+        2: the 1st exception at front, 2nd behind
+        3: the 2nd exception covering the whole 1st
+        4: the 1st exception covering the whole 2nd
+        5: the exceptions only match within the tolerance
+
+    Args:
+        start1, end1, max1 (ndarray): The startM, endM and maxLocation of the first report.
+        start2, end2, max2 (ndarray): The startM, endM and maxLocation of the second report.
+        tolerance (float): The distance (m) the maxLocations may lie outside the overlapping part. Defaults to 0.
+
+    Returns:
+        first (ndarray): The row of each pair in the first report.
+        second (ndarray): The row of each pair in the second report.
+        case (ndarray): The case of each pair. The pairs are sorted by case, first and second.
+    """
+    order = np.argsort(max2, kind='stable')
+    lower = np.searchsorted(max2[order], start1 - tolerance, side='left')
+    upper = np.searchsorted(max2[order], end1 + tolerance, side='right')
+    first, position = expand_ranges(lower, upper)
+    second = order[position]
+
+    s1, e1, m1 = start1[first], end1[first], max1[first]
+    s2, e2, m2 = start2[second], end2[second], max2[second]
+    overlap_start = np.maximum(s1, s2) - tolerance
+    overlap_end = np.minimum(e1, e2) + tolerance
+    keep = (overlap_start <= m1) & (m1 <= overlap_end) & (overlap_start <= m2) & (m2 <= overlap_end)
+    first, second = first[keep], second[keep]
+    s1, e1, s2, e2 = s1[keep], e1[keep], s2[keep], e2[keep]
+
+    case = np.select([(s2 <= s1) & (s1 <= e2) & (e1 > e2),
+                      (s1 <= s2) & (s2 <= e1) & (e1 < e2),
+                      (s1 >= s2) & (e1 <= e2),
+                      (s1 <= s2) & (e1 >= e2)], [1, 2, 3, 4], default=5)
+    order = np.lexsort((second, first, case))
+    return first[order], second[order], case[order]
+
+
+def exception_profile(report, origin, bins):
+    """
+    Counts the exceptions of all types covering each bin of shift_resolution m along the chainage.
+
+    Args:
+        report (dict): The exception tables of the report keyed by their sheet name.
+        origin (float): The chainage (m) of the start of the first bin.
+        bins (int): The number of bins.
+
+    Returns:
+        (ndarray): The number of exceptions covering each bin.
+    """
+    starts = np.concatenate([report[sheet]['startM'].to_numpy(dtype=float) for sheet in report_sheets])
+    ends = np.concatenate([report[sheet]['endM'].to_numpy(dtype=float) for sheet in report_sheets])
+    changes = np.zeros(bins + 1)
+    np.add.at(changes, np.clip(((starts - origin) / shift_resolution).astype(int), 0, bins), 1)
+    np.add.at(changes, np.clip(((ends - origin) / shift_resolution).astype(int) + 1, 0, bins), -1)
+    return np.cumsum(changes)[:bins]
+
+
+def estimate_shift(reference, report):
+    """
+    Estimates the chainage shift between two runs from the exceptions they found.
+
+    The exception profiles of the two reports (see exception_profile) are cross-correlated with an FFT and
+    the shift with the highest correlation within max_shift is taken, the smallest one if there is a tie.
+
+    Args:
+        reference (dict): The exception tables of the reference report keyed by their sheet name.
+        report (dict): The exception tables of the report to align keyed by their sheet name.
+
+    Returns:
+        (float): The shift (m) to add to the locations of the report to align them with the reference.
+    """
+    locations = [table[column].to_numpy(dtype=float) for tables in [reference, report]
+                 for table in tables.values() for column in ['startM', 'endM']]
+    locations = np.concatenate(locations)
+    if len(locations) == 0:
+        return 0.0
+
+    origin = locations.min() - max_shift
+    bins = int(np.ceil((locations.max() + max_shift - origin) / shift_resolution)) + 1
+    size = 1 << int(2 * bins - 1).bit_length()
+    correlation = np.fft.irfft(np.fft.rfft(exception_profile(reference, origin, bins), size) *
+                               np.conj(np.fft.rfft(exception_profile(report, origin, bins), size)), size)
+
+    # correlation[lag] compares the report moved forward by lag bins with the reference
+    reach = int(max_shift / shift_resolution)
+    lags = np.arange(-reach, reach + 1)
+    correlation = np.round(correlation[lags], 6)
+    best = lags[correlation == correlation.max()]
+    return float(best[np.argmin(np.abs(best))] * shift_resolution)
+
+
+def estimate_shifts(reports):
+    """
+    Estimates the chainage shift of every report from the latest one, adding up the shifts between
+    consecutive reports since their runs are the closest.
+
+    Args:
+        reports (list[dict]): The exception tables of each report keyed by their sheet name,
+            from the earliest report to the latest.
+
+    Returns:
+        (list[float]): The shift (m) to add to the locations of each report to align them with the latest report.
+    """
+    shifts = [0.0]
+    for i in range(len(reports) - 2, -1, -1):
+        shifts.insert(0, shifts[0] + estimate_shift(reports[i + 1], reports[i]))
+    return shifts
+
+
+def chain_repeated(reports, shifts=None, tolerance=0):
+    """
+    Finds the exceptions repeated in all the reports in one pass.
+
+    Matches the exceptions of every two consecutive reports once (see match_overlaps), then follows each chain
+    of matched exceptions forward from the first report to the latest one. An exception can have more than
+    one chain if it matches more than one exception of the previous report.
+
+    Args:
+        reports (list[DataFrame]): The exception tables of one exception type, from the earliest report to the latest.
+        shifts (list[float]): The offset (m) added to the locations of each report. Defaults to None (no offset).
+        tolerance (float): The tolerance (m) of the matching, see match_overlaps. Defaults to 0.
+
+    Returns:
+        (DataFrame): The repeated exceptions of the latest report, with the ids of their chain in the earlier reports
+            in the columns Previous 1 (earliest report) to Previous N-1.
+    """
+    if shifts is None:
+        shifts = [0] * len(reports)
+    locations = [[report[column].to_numpy(dtype=float) + shift for column in ['startM', 'endM', 'maxLocation']]
+                 for report, shift in zip(reports, shifts)]
+
+    # each row holds the row of the chained exception in every report so far
+    chains = np.arange(len(reports[0]))[:, None]
+    for i in range(1, len(reports)):
+        first, second, case = match_overlaps(*locations[i - 1], *locations[i], tolerance)
+
+        # extends every chain ending at the first exception of each pair
+        order = np.argsort(chains[:, -1], kind='stable')
+        last = chains[order, -1]
+        pair, position = expand_ranges(np.searchsorted(last, first, side='left'),
+                                       np.searchsorted(last, first, side='right'))
+        chain = order[position]
+
+        # sorts the chains by case, previous chain and exception, as the pairwise search did
+        extended = np.lexsort((second[pair], chain, case[pair]))
+        chains = np.column_stack([chains[chain], second[pair]])[extended]
+
+    repeated = reports[-1][['id', 'exception type', 'level', 'startM', 'endM', 'length', 'maxValue', 'maxLocation',
+                            'track type', 'Overlap', 'Tension Length', 'Landmark']].iloc[chains[:, -1]].reset_index(drop=True)
+    for i in range(len(reports) - 1):
+        repeated['Previous ' + str(i + 1)] = reports[i]['id'].astype(str).to_numpy(dtype=object)[chains[:, i]]
+    return repeated
+
+
+def load_template():
+    """
+    Loads the Summary and Previous templates of the find repeated report.
+
+    The two template sheets are copied from the metadata into a small workbook in the cache folder the first
+    time, and again only when the metadata is changed, so the whole metadata is not parsed on every run.
+
+    Returns:
+        (Workbook): The workbook with the Summary and Previous sheets.
+    """
+    if not os.path.exists(template_path) or os.path.getmtime(template_path) < os.path.getmtime(template_source):
+        template = openpyxl.load_workbook(template_source)
+        for sheet in template.sheetnames:
+            if sheet not in ['template', 'Previous template']:
+                del template[sheet]
+        template['template'].title = 'Summary'
+        template['Previous template'].title = 'Previous'
+
+        # saves to a temporary file first, so another run never loads a half written template
+        os.makedirs(os.path.dirname(template_path), exist_ok=True)
+        temporary_path = template_path + '.' + str(os.getpid())
+        template.save(temporary_path)
+        os.replace(temporary_path, template_path)
+    return openpyxl.load_workbook(template_path)
+
+
+def write_rows(worksheet, table, start_row):
+    """
+    Writes the values of a table into a worksheet, keeping the formatting of the template.
+    Missing values are written as empty text, like DataFrame.to_excel does.
+
+    Args:
+        worksheet (Worksheet): The worksheet to write in.
+        table (DataFrame): The table to be written, without its header.
+        start_row (int): The row number of the first row of the table.
+    """
+    columns = [table[column].tolist() for column in table.columns]
+    for row_number, row in enumerate(zip(*columns), start=start_row):
+        for column_number, value in enumerate(row, start=1):
+            worksheet.cell(row=row_number, column=column_number, value='' if pd.isna(value) else value)
+
 
 def main():
+    # set the TOV640_PROFILE environment variable to 'stages' or 'cprofile' to profile the run, the exceptions
+    # are matched in worker processes, so the cProfile output only covers the main process
+    profile = start_profile(os.environ.get('TOV640_PROFILE') or None)
     print('================ Finding Repeated Exception Tool ================')
     print('This is a tool to find repeated exceptions of at most 12 consecutive TOV Exception Reports')
     check = input('Enter the number of TOV exception reports to be compared? (input 2-12): ')
@@ -113,6 +312,14 @@ def main():
     print('===========================================================')
     print('You are going to compare ' + check + ' TOV Exception Reports')
 
+    # the previous reports can be taken from the exception history instead of being selected one by one
+    use_history = False
+    if os.path.exists(exception_reports.history_path):
+        use_history = input('Take the previous reports from the exception history? (y/n): ') == 'y'
+
+    # odometer drift between the runs can shift the chainage of the same exception
+    align = input('Correct the chainage shift between the runs? (y/n): ') == 'y'
+
     # ---------- allow user to select Exception Report files -------
     root = tk.Tk()
     root.withdraw()
@@ -125,7 +332,9 @@ def main():
     df_SR = []
 
     for i in range(0, int(check)):
-        if i == 0:
+        if use_history:
+            print('Select the latest Exception Report after 3 seconds...')
+        elif i == 0:
             print('Select 1st Exception Report after 3 seconds...')
         elif i == 1:
             print('Select 2nd Exception Report after 3 seconds...')
@@ -140,36 +349,58 @@ def main():
         path = filedialog.askopenfilename()
         df_path.append(path)
         print('Selected: ' + os.path.basename(path) + '\n')
-        
-        wire_wear = pd.read_excel(path, sheet_name='wear exception')
+
+        if use_history:
+            previous_reports = exception_reports.find_history_reports(path, int(check))
+            if previous_reports is None:
+                print('ERROR: Fewer than ' + check + ' reports of ' + os.path.basename(path) + ' are in the exception history')
+                input('Press Enter to exit')
+                exit()
+            df_path = previous_reports[:-1] + [path]
+            for report in previous_reports[:-1]:
+                print('Found in the exception history: ' + report)
+            break
+
+    print('Reading the Exception Reports at', datetime.now())
+    try:
+        with stage(profile, 'read_exception_reports'):
+            reports = read_exception_reports(df_path)
+    except Exception as err:
+        print('ERROR: ' + str(err))
+        input('Press Enter to exit')
+        exit()
+    for report in reports:
+        wire_wear = report['wear exception']
         df_W.append(wire_wear)
 
-        low_height = pd.read_excel(path, sheet_name='low height exception')
+        low_height = report['low height exception']
         df_LH.append(low_height)
 
-        high_height = pd.read_excel(path, sheet_name='high height exception')
+        high_height = report['high height exception']
         df_HH.append(high_height)
 
-        stagger_left = pd.read_excel(path, sheet_name='stagger left exception')
+        stagger_left = report['stagger left exception']
         stagger_left = stagger_left.loc[stagger_left['Overlap'] != 'Y']
         df_SL.append(stagger_left)
 
-        stagger_right = pd.read_excel(path, sheet_name='stagger right exception')
+        stagger_right = report['stagger right exception']
         stagger_right = stagger_right.loc[stagger_right['Overlap'] != 'Y']
         df_SR.append(stagger_right)
 
-    repeated_W = df_W[0]
-    repeated_LH = df_LH[0]
-    repeated_HH = df_HH[0]
-    repeated_SL = df_SL[0]
-    repeated_SR = df_SR[0]
+    shifts = None
+    tolerance = 0
+    if align:
+        with stage(profile, 'estimate_shifts'):
+            shifts = estimate_shifts(reports)
+        tolerance = shift_tolerance
+        for path, shift in zip(df_path, shifts):
+            print('Chainage shift of ' + os.path.basename(path) + ': ' + str(shift) + ' m')
 
-    for i in range(1, len(df_path)):
-        repeated_W = find_repeated(repeated_W, df_W[i], 0, 0)
-        repeated_LH = find_repeated(repeated_LH, df_LH[i], 0, 0)
-        repeated_HH = find_repeated(repeated_HH, df_HH[i], 0, 0)
-        repeated_SL = find_repeated(repeated_SL, df_SL[i], 0, 0)
-        repeated_SR = find_repeated(repeated_SR, df_SR[i], 0, 0)
+    # each exception type takes a few milliseconds, less than starting worker processes would
+    print('Finding repeated exceptions at', datetime.now())
+    with stage(profile, 'chain_repeated'):
+        repeated_W, repeated_LH, repeated_HH, repeated_SL, repeated_SR = [
+            chain_repeated(exceptions, shifts, tolerance) for exceptions in [df_W, df_LH, df_HH, df_SL, df_SR]]
 
      # ---------- output results ----------
     print('Saving as Excel at', datetime.now())
@@ -178,17 +409,6 @@ def main():
     directory = filedialog.askdirectory()
     final_path = directory + '/' + os.path.basename(os.path.splitext(df_path[-1])[0]) + '_' + check + '_repeated.xlsx'
 
-    # Get report templates from metadata
-    temp = openpyxl.load_workbook('./metadata/EAL metadata.xlsx')
-    sheets = temp.sheetnames
-    for s in sheets:
-        if s not in ['template', 'Previous template']:
-            del temp[s]
-    summary = temp['template']
-    summary.title = 'Summary'
-    previous_id = temp['Previous template']
-    previous_id.title = 'Previous'
-    temp.save(final_path)
     update = pd.concat([repeated_SL, repeated_SR, repeated_W, repeated_HH, repeated_LH], ignore_index=True, sort=False)
 
     update['support'] = np.nan
@@ -201,12 +421,7 @@ def main():
     previous['ID'] = update['id']
     for i in range(int(check) - 1):
         temp = 'Previous ' + str(i + 1)
-        previous[temp] = ''
-    split_data = update['previous'].str.split(',', expand=True)
-    if (not split_data.empty):
-        split_data.columns = [f'Previous {i+1}' for i in range(int(check) - 1)]
-        for col in split_data.columns:
-            previous[col] = split_data[col]
+        previous[temp] = update[temp]
 
     update = update[['id', 'startM', 'endM', 'length', 'exception type', 'maxValue', 'maxLocation', 'support',
                     'Tension Length', 'track type', 'level', 'empty1', 'empty2', 'empty3', 'empty4']]
@@ -217,10 +432,16 @@ def main():
     update = pd.concat([update, lv3_SL, lv3_SR], ignore_index=True, sort=False)
     update = update.drop_duplicates(subset='id', keep='first')
 
-    with pd.ExcelWriter(final_path, mode='a', engine='openpyxl', if_sheet_exists='overlay') as writer:
-        update.to_excel(writer, sheet_name="Summary", startrow=2, header=None, index=False)
-        previous.to_excel(writer, sheet_name="Previous", startrow=1, header=None, index=False)
+    # fills the report templates and saves the report in one go
+    with stage(profile, 'write_report'):
+        workbook = load_template()
+        write_rows(workbook['Summary'], update, 3)
+        write_rows(workbook['Previous'], previous, 2)
+        workbook.save(final_path)
+    write_profile(profile, final_path, compared=df_path)
     # ----- save as -----
 
 if __name__ == "__main__":
+    # the Exception Reports are read in worker processes, which needs freeze_support in a frozen Windows executable
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,263 @@
+"""
+File: exception_reports.py
+Author: Lam Wai Taing, Timothy
+Date: 2026/10/17
+Description: The readers of the TOV640 Exception Reports and their exception history, appended by the exception
+generator and read by the find repeated and wire wear L2 trend tools.
+"""
+
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+# exception history, kept in the metadata folder next to this file so every tool finds it from any directory
+history_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata', 'exception history.sqlite')
+
+# columns of the exception tables read as text
+report_dtypes = {'id': str, 'exception type': str, 'level': str, 'track type': str}
+
+
+def combine_tables(tables):
+    """
+    Stacks the exception tables into one table, with the sheet name of each row in the sheet column.
+
+    Args:
+        tables (dict): The exception tables keyed by their sheet name.
+
+    Returns:
+        combined (DataFrame): The rows of all the exception tables.
+    """
+    combined = pd.concat([exception_table.assign(sheet=sheet_name) for sheet_name, exception_table in tables.items()],
+                         ignore_index=True)
+    return combined[['sheet'] + [column for column in combined.columns if column != 'sheet']]
+
+
+def history_key(path):
+    """
+    Returns the key of an Exception Report in the exception history, its normalized absolute path, so reports
+    of the same name saved in different folders are kept apart.
+
+    Args:
+        path (str): The path to the Exception Report, or its key in the exception history.
+
+    Returns:
+        (str): The key of the report.
+    """
+    return os.path.normcase(os.path.abspath(path))
+
+
+def append_history(tables, report_path, date, line, section, track, history=history_path):
+    """
+    Appends the exception tables of a saved Exception Report to the exception history.
+
+    The history is a SQLite database with a reports table (the line, section, track, date and modified time
+    of each report, keyed by history_key) and an exceptions table holding the rows of every report, indexed
+    by report, sheet and location. Saving a report again replaces its rows, the other reports are not touched.
+
+    Args:
+        tables (dict): The exception tables keyed by their sheet name.
+        report_path (str): The path to the saved Exception Report.
+        date (str): The date of the data collected.
+        line (str): The name of the line.
+        section (str): The section of the line.
+        track (str): The track of the line.
+        history (str): The path to the exception history. Defaults to history_path.
+    """
+    report = history_key(report_path)
+    combined = combine_tables(tables)
+    # columns are left untyped, so numbers and text in the same column are kept as they are
+    columns = ', '.join('"' + column + '"' for column in combined.columns)
+    values = [combined[column].tolist() for column in combined.columns]
+
+    connection = sqlite3.connect(history, timeout=60)
+    try:
+        with connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS reports (report PRIMARY KEY, line, section, track, date, modified)')
+            connection.execute('CREATE TABLE IF NOT EXISTS exceptions (report, ' + columns + ')')
+            connection.execute('CREATE INDEX IF NOT EXISTS reports_run ON reports (line, section, track, date)')
+            connection.execute('CREATE INDEX IF NOT EXISTS exceptions_location ON exceptions (report, sheet, startM, endM)')
+            connection.execute('CREATE INDEX IF NOT EXISTS exceptions_id ON exceptions (id)')
+
+            connection.execute('DELETE FROM exceptions WHERE report = ?', (report,))
+            connection.execute('INSERT OR REPLACE INTO reports VALUES (?, ?, ?, ?, ?, ?)',
+                               (report, line, section, track, date, os.path.getmtime(report_path)))
+            connection.executemany('INSERT INTO exceptions (report, ' + columns + ') VALUES (' +
+                                   ', '.join(['?'] * (len(combined.columns) + 1)) + ')',
+                                   ([report] + [None if pd.isna(value) else value for value in row] for row in zip(*values)))
+    finally:
+        connection.close()
+
+
+def history_report(connection, path):
+    """
+    Returns the key of an Exception Report in the exception history if its rows there are up to date.
+
+    Args:
+        connection (Connection): The connection to the exception history.
+        path (str): The path to the Exception Report, or its key in the exception history.
+
+    Returns:
+        (str): The key of the report, or None if the report is not in the history
+            or the .xlsx file was saved after it was added to the history.
+    """
+    report = history_key(path)
+    modified = connection.execute('SELECT modified FROM reports WHERE report = ?', (report,)).fetchone()
+    if modified is None or (os.path.exists(path) and modified[0] < os.path.getmtime(path)):
+        return None
+    return report
+
+
+def read_history(path, sheets, history=history_path):
+    """
+    Reads exception tables of an Exception Report from the exception history.
+
+    Args:
+        path (str): The path to the Exception Report, or its key in the exception history.
+        sheets (list[str]): The sheets to read.
+        history (str): The path to the exception history. Defaults to history_path.
+
+    Returns:
+        (dict): The exception tables keyed by their sheet name, or None if the report is not in the history
+            or the .xlsx file was saved after it was added to the history.
+    """
+    if not os.path.exists(history):
+        return None
+    connection = sqlite3.connect(history)
+    try:
+        report = history_report(connection, path)
+        if report is None:
+            return None
+        tables = pd.read_sql('SELECT * FROM exceptions WHERE report = ? AND sheet IN (' + ', '.join(['?'] * len(sheets)) +
+                             ') ORDER BY rowid', connection, params=[report] + list(sheets))
+    finally:
+        connection.close()
+    tables = tables.drop(columns='report').fillna(np.nan)
+    return {sheet: tables[tables['sheet'] == sheet].drop(columns='sheet').reset_index(drop=True) for sheet in sheets}
+
+
+def find_history_reports(path, count, history=history_path):
+    """
+    Lists the latest Exception Reports of the same line, section and track in the exception history,
+    up to the given report, one report per date.
+
+    If a recording was saved more than once, e.g. into another folder, the report of that date saved last is taken.
+
+    Args:
+        path (str): The path to the latest Exception Report, or its key in the exception history.
+        count (int): The number of reports to list, including the latest one.
+        history (str): The path to the exception history. Defaults to history_path.
+
+    Returns:
+        (list[str]): The keys of the reports from the earliest to the latest, or None if the history has
+            fewer than count reports.
+    """
+    if not os.path.exists(history):
+        return None
+    report = history_key(path)
+    connection = sqlite3.connect(history)
+    try:
+        if connection.execute('SELECT 1 FROM reports WHERE report = ?', (report,)).fetchone() is None:
+            return None
+        previous = connection.execute('SELECT previous.report, previous.date FROM reports latest JOIN reports previous '
+                                      'ON previous.line = latest.line AND previous.section = latest.section '
+                                      'AND previous.track = latest.track AND previous.date < latest.date '
+                                      'WHERE latest.report = ? ORDER BY previous.date DESC, previous.modified DESC',
+                                      (report,)).fetchall()
+    finally:
+        connection.close()
+    reports = [report]
+    dates = set()
+    for previous_report, date in previous:
+        if len(reports) == count:
+            break
+        if date not in dates:
+            dates.add(date)
+            reports.append(previous_report)
+    if len(reports) < count:
+        return None
+    return reports[::-1]
+
+
+def find_exception_report(exception_id, sheet, history=history_path):
+    """
+    Finds the Exception Report holding an exception in the exception history.
+
+    Args:
+        exception_id (str): The id of the exception.
+        sheet (str): The sheet of the exception.
+        history (str): The path to the exception history. Defaults to history_path.
+
+    Returns:
+        (str): The key of the report saved last holding the exception, or None if the exception is not in the history.
+    """
+    if not os.path.exists(history):
+        return None
+    connection = sqlite3.connect(history)
+    try:
+        report = connection.execute('SELECT exceptions.report FROM exceptions JOIN reports ON reports.report = exceptions.report '
+                                    'WHERE exceptions.id = ? AND exceptions.sheet = ? ORDER BY reports.modified DESC LIMIT 1',
+                                    (exception_id, sheet)).fetchone()
+    finally:
+        connection.close()
+    return None if report is None else report[0]
+
+
+def read_sidecar(path, sheets):
+    """
+    Reads exception tables of an Exception Report from the .parquet or .csv copy the generator saved next to it.
+
+    Args:
+        path (str): The path to the Exception Report.
+        sheets (list[str]): The sheets to read.
+
+    Returns:
+        (dict): The exception tables keyed by their sheet name, or None if there is no copy at least as new as
+            the report that can be read.
+    """
+    for extension in ['.parquet', '.csv']:
+        sidecar = os.path.splitext(path)[0] + extension
+        if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= os.path.getmtime(path):
+            try:
+                if extension == '.parquet':
+                    tables = pd.read_parquet(sidecar)
+                else:
+                    tables = pd.read_csv(sidecar, keep_default_na=False, na_values=[''])
+            except ImportError:
+                # no parquet engine installed
+                continue
+            # text columns may also hold numbers (e.g. Tension Length), reads them as numbers like read_excel does
+            for column in tables.columns.drop('sheet'):
+                if not pd.api.types.is_numeric_dtype(tables[column]):
+                    values = tables[column].astype(object).where(tables[column].notna(), np.nan)
+                    numbers = pd.to_numeric(values, errors='coerce')
+                    tables[column] = values.where(numbers.isna(), numbers)
+            return {sheet: tables[tables['sheet'] == sheet].drop(columns='sheet').reset_index(drop=True)
+                    for sheet in sheets}
+    return None
+
+
+def read_exception_report(path, sheets, columns=None):
+    """
+    Reads exception tables of an Exception Report, opening the workbook once.
+
+    Reads the report from the exception history if it is there (see read_history). Otherwise if the generator saved
+    a .parquet or .csv copy of the tables next to the report (see read_sidecar), reads the copy since it is much
+    faster than the .xlsx file.
+
+    Args:
+        path (str): The path to the Exception Report, or its key in the exception history.
+        sheets (list[str]): The sheets to read.
+        columns (list[str]): The columns to read. Defaults to None, reading all of them.
+
+    Returns:
+        (dict): The exception tables keyed by their sheet name.
+    """
+    tables = read_history(path, sheets)
+    if tables is None:
+        tables = read_sidecar(path, sheets)
+    if tables is None:
+        return pd.read_excel(path, sheet_name=sheets, usecols=columns, dtype=report_dtypes)
+    if columns is None:
+        return tables
+    return {sheet: exception_table[columns] for sheet, exception_table in tables.items()}
@@ -0,0 +1,116 @@
+"""
+File: run_profile.py
+Author: Lam Wai Taing, Timothy
+Date: 2026/10/17
+Description: The time and memory profile of a run, shared by the TOV640 exception generator and find repeated tool.
+"""
+
+import os
+import sys
+import json
+import time
+import cProfile
+import importlib.util
+from datetime import datetime
+from contextlib import contextmanager
+
+# profiling of a run: 'stages' saves the time of each stage and the peak memory of the process after it next to
+# the report as <report>_profile.json, 'cprofile' also saves the cProfile output as <report>.prof
+profiling_modes = ['stages', 'cprofile']
+
+
+def process_peak_memory():
+    """
+    Returns the peak resident memory of the process so far.
+
+    This is the high-water mark of the whole process so it never goes down: the peak after a stage can come from
+    any stage before it, and in a worker process reused for several runs, from an earlier run.
+
+    Returns:
+        (float): The peak memory in MB, or None if it cannot be read on this system.
+    """
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on macOS
+        return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+    except ImportError:
+        pass
+    if importlib.util.find_spec('psutil'):
+        import psutil
+        memory = psutil.Process().memory_info()
+        return round(getattr(memory, 'peak_wset', memory.rss) / (1024 * 1024), 1)
+    return None
+
+
+def start_profile(profiling, **details):
+    """
+    Starts the profile of a run.
+
+    Args:
+        profiling (str): One of profiling_modes, or None to not profile the run.
+        **details: The details of the run saved in the profile, e.g. datac (the path to the input .datac file).
+
+    Returns:
+        (dict): The run profile, or None if profiling is None.
+    """
+    if profiling is None:
+        return None
+    if profiling not in profiling_modes:
+        raise ValueError('Unknown profiling mode ' + str(profiling) + ', use one of ' + ', '.join(profiling_modes))
+    profile = {'details': details, 'started': datetime.now().isoformat(timespec='seconds'), 'mode': profiling,
+               'stages': [], 'start': time.perf_counter()}
+    if profiling == 'cprofile':
+        profile['profiler'] = cProfile.Profile()
+        profile['profiler'].enable()
+    return profile
+
+
+@contextmanager
+def stage(profile, name):
+    """
+    Times a stage of the run and records it with the peak memory of the process after it in the run profile,
+    see process_peak_memory. Does nothing if profile is None.
+
+    Args:
+        profile (dict): The run profile, as returned by start_profile.
+        name (str): The name of the stage.
+    """
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile['stages'].append({'stage': name, 'seconds': round(time.perf_counter() - start, 4),
+                                  'process_peak_memory_mb': process_peak_memory()})
+
+
+def write_profile(profile, report_path, **details):
+    """
+    Saves the run profile next to the report as <report>_profile.json,
+    and the cProfile output as <report>.prof if it was recorded.
+
+    Args:
+        profile (dict): The run profile, as returned by start_profile. Nothing is saved if it is None.
+        report_path (str): The path to the report.
+        **details: More details of the run saved in the profile, e.g. rows (the number of cleaned rows).
+
+    Returns:
+        (str): The path to the saved profile, or None.
+    """
+    if profile is None:
+        return None
+    base_path = os.path.splitext(report_path)[0]
+    if 'profiler' in profile:
+        profile['profiler'].disable()
+        profile['profiler'].dump_stats(base_path + '.prof')
+
+    summary = {'report': os.path.basename(report_path), **profile['details'], **details, 'started': profile['started'],
+               'mode': profile['mode'], 'total_seconds': round(time.perf_counter() - profile['start'], 4),
+               'process_peak_memory_mb': process_peak_memory(), 'stages': profile['stages']}
+    path = base_path + '_profile.json'
+    with open(path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    return path
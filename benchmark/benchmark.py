@@ -0,0 +1,439 @@
+"""
+File: benchmark.py
+Author: Lam Wai Taing, Timothy
+Date: 2026/10/17
+Description: A Python script to time the stages of the TOV640 exception generator, the find repeated tool
+and the wear average report on synthetic .datac recordings of different sizes, and save the results
+to a .json or .csv file to track the scaling across versions.
+"""
+
+import os
+import sys
+import re
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# folder of this script, the tools are loaded relative to it
+benchmark_directory = os.path.dirname(os.path.abspath(__file__))
+
+# scripts timed by the benchmark
+generator_path = os.path.join(benchmark_directory, '..', 'TOV640', 'TOV640 exception generator',
+                              'TOV640_exception_generator.py')
+find_repeated_path = os.path.join(benchmark_directory, '..', 'TOV640', 'TOV640 find repeated', 'TOV640_find_repeated.py')
+wear_average_path = os.path.join(benchmark_directory, '..', 'wear average', 'EAL', 'EAL.py')
+
+# metadata the threshold sheet is copied from, the rest of the synthetic metadata is generated
+threshold_source = os.path.join(benchmark_directory, '..', 'TOV640', 'metadata', 'EAL metadata.xlsx')
+
+# number of samples of the synthetic recordings
+default_sizes = ['10k', '100k', '1M', '10M']
+
+# run details of the synthetic recordings, a main line section of EAL starting with the SCL class
+line = 'EAL'
+section = 'UNI-TAP'
+track = 'UP'
+start_m = 95000
+scl_share = 0.15
+
+# distance (m) between two samples, the number of samples generated at a time,
+# and the number of rows between the header rows repeated in the .datac file
+sample_step = 0.25
+block_samples = 1000000
+header_every = 5000
+
+# synthetic defects pushing one of the four wires past its thresholds: the channel, the value added to it
+# (scaled by 0.7 to 1.3 so the defects fall in different levels) and the range (m) of the defect length
+defect_kinds = {'low height': ('WHGT', -700, (1, 15)),
+                'high height': ('WHGT', 1000, (1, 10)),
+                'wire wear': ('RWH', -2.5, (2, 40)),
+                'stagger left': ('STG', 300, (2, 20)),
+                'stagger right': ('STG', -300, (2, 20))}
+default_exceptions_per_km = 1
+
+# number of monthly reports chained by the find repeated stages, the earlier months are made from the latest
+# report with a chainage shift of up to month_shift m, a jitter of month_jitter m and month_dropped of the rows dropped
+default_months = 3
+month_shift = 3
+month_jitter = 0.3
+month_dropped = 0.15
+
+
+def load_script(name, path):
+    """
+    Loads a script of the repository as a module, since the folders of the scripts have spaces in their names.
+
+    Args:
+        name (str): The name to register the module under.
+        path (str): The path to the script.
+
+    Returns:
+        (module): The loaded module.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def parse_size(size):
+    """
+    Parses a number of samples written as 10000, 10k or 1M.
+
+    Args:
+        size (str): The number of samples.
+
+    Returns:
+        (int): The number of samples.
+    """
+    match = re.match(r'^(\d+(?:\.\d+)?)([kKmM]?)$', size.strip())
+    if match is None:
+        raise argparse.ArgumentTypeError('invalid size ' + size + ', use e.g. 10000, 10k or 1M')
+    return int(float(match.group(1)) * {'': 1, 'k': 10 ** 3, 'm': 10 ** 6}[match.group(2).lower()])
+
+
+def make_channels(position, exceptions_per_km, rng):
+    """
+    Generates the 12 channels of the .datac file at the given locations.
+
+    The heights, wire wear and stagger follow a smooth pattern along the line with noise on each wire,
+    the stagger zigzags between the supports. The defects of defect_kinds are then added on one wire each.
+
+    Args:
+        position (ndarray): The location (m) of every sample.
+        exceptions_per_km (float): The number of defects of each kind per km.
+        rng (Generator): The random generator.
+
+    Returns:
+        channels (dict): The values of each channel keyed by its .datac column.
+    """
+    height = -150 + 60 * np.sin(2 * np.pi * position / 180)
+    wear = 11.5 - 0.4 * np.sin(2 * np.pi * position / 900)
+    stagger = 200 * (2 * np.abs(2 * (position / 100 % 1) - 1) - 1)
+    channels = {}
+    for number in range(1, 5):
+        channels['WHGT' + str(number) + ' c'] = height + rng.normal(0, 5, len(position))
+    for number in range(1, 5):
+        channels['RWH' + str(number) + ' mm'] = wear + rng.normal(0, 0.05, len(position))
+    for number in range(1, 5):
+        channels['STG' + str(number) + ' c'] = stagger + rng.normal(0, 5, len(position))
+
+    length_m = position[-1] - position[0]
+    for prefix, offset, (shortest, longest) in defect_kinds.values():
+        count = rng.poisson(exceptions_per_km * length_m / 1000)
+        starts = rng.uniform(position[0], position[-1], count)
+        ends = starts + rng.uniform(shortest, longest, count)
+        sizes = offset * rng.uniform(0.7, 1.3, count)
+        wires = rng.integers(1, 5, count)
+        for number in range(1, 5):
+            # each defect steps the wire up by its size at its start and back down at its end
+            change = np.zeros(len(position) + 1)
+            np.add.at(change, np.searchsorted(position, starts[wires == number]), sizes[wires == number])
+            np.add.at(change, np.searchsorted(position, ends[wires == number]), -sizes[wires == number])
+            column = [column for column in channels if column.startswith(prefix + str(number))][0]
+            channels[column] += np.cumsum(change)[:-1]
+
+    for column in channels:
+        channels[column] = channels[column].round(2)
+    return channels
+
+
+def make_datac(path, samples, exceptions_per_km, rng):
+    """
+    Writes a synthetic .datac recording in the layout of the TOV640, the header row is repeated every header_every rows.
+
+    Args:
+        path (str): The path to the .datac file.
+        samples (int): The number of samples.
+        exceptions_per_km (float): The number of defects of each kind per km.
+        rng (Generator): The random generator.
+
+    Returns:
+        (float): The chainage (m) of the last sample.
+    """
+    with open(path, 'w', newline='') as f:
+        for block in range(0, samples, block_samples):
+            position = start_m + np.arange(block, min(block + block_samples, samples)) * sample_step
+            km = (position // 1000).astype(int)
+            data = pd.DataFrame({'Date': '13.06.2024', 'Time': '10:00:00', 'LINE': line, 'TRACK': track,
+                                 'KM': km, 'LOCATION': (position - km * 1000).round(2)})
+            data = pd.concat([data, pd.DataFrame(make_channels(position, exceptions_per_km, rng))], axis=1)
+            for row in range(0, len(data), header_every):
+                # the TOV640 pads every value with spaces, e.g. " 13.06.2024 ; 10:00:00 ; EAL "
+                text = data.iloc[row:row + header_every].to_csv(sep=';', index=False, lineterminator='\n')
+                f.write(''.join(' ' + values.replace(';', ' ; ') + ' \n' for values in text.splitlines()))
+    return start_m + (samples - 1) * sample_step
+
+
+def make_metadata(path, end_m, rng):
+    """
+    Writes a synthetic metadata workbook covering the chainage of the synthetic recording.
+
+    The workbook has the sheets read by the exception generator: the threshold sheet copied from
+    threshold_source, the exception boundaries (the first scl_share of the line is SCL, the rest EAL)
+    and the track type, overlap, tension length and landmark lookup table of the line and track.
+
+    Args:
+        path (str): The path to the metadata workbook.
+        end_m (float): The chainage (m) of the last sample.
+        rng (Generator): The random generator.
+
+    Returns:
+        tension_lengths (DataFrame): The Overlap FromM, Overlap ToM and Tension Length of each tension length,
+            the lookup table of the wear average report.
+    """
+    first, last = start_m - 10, np.ceil(end_m) + 10
+    middle = round(first + (last - first) * scl_share)
+    boundary = pd.DataFrame({'Line': line, 'Class': ['SCL', 'EAL'], 'C/R': ['ORCR', 'OCS'],
+                             'Up Track From': [first, middle + 1], 'Up Track To': [middle, last],
+                             'Down Track From': [middle, last], 'Down Track To': [first, middle + 1]})
+
+    # track types alternate between tangent and curve
+    edges = np.append(np.cumsum(np.append(first, rng.uniform(100, 600, int((last - first) / 100) + 1))), np.inf)
+    edges = edges[:np.argmax(edges >= last) + 1]
+    edges[-1] = last
+    track_type = pd.DataFrame({'track type': np.where(np.arange(len(edges) - 1) % 2 == 0, 'Tangent', 'Curve'),
+                               'Track Type startM': edges[:-1], 'Track Type endM': edges[1:] - 0.1})
+
+    # tension lengths of 1000 to 1400 m with an overlap of 6 m between two of them
+    edges = np.append(np.cumsum(np.append(first, rng.uniform(1000, 1400, int((last - first) / 1000) + 1))), np.inf)
+    edges = edges[:np.argmax(edges >= last) + 1]
+    edges[-1] = last
+    names = ['T' + str(number) for number in range(1, len(edges))]
+    tension_lengths = pd.DataFrame({'Overlap FromM': edges[:-1], 'Overlap ToM': edges[1:] - 6.1, 'Tension Length': names})
+    overlaps = pd.DataFrame({'Overlap FromM': edges[1:-1] - 6, 'Overlap ToM': edges[1:-1] - 0.1, 'Overlap': 'Y',
+                             'Tension Length': [names[i] + ', ' + names[i + 1] for i in range(len(names) - 1)]})
+    overlap = pd.concat([tension_lengths, overlaps], ignore_index=True).sort_values('Overlap FromM', ignore_index=True)
+    overlap = overlap[['Overlap FromM', 'Overlap ToM', 'Overlap', 'Tension Length']]
+
+    # a platform of 200 m every 1.5 to 3 km
+    starts = np.cumsum(rng.uniform(1500, 3000, int((last - first) / 1500) + 1)) + first
+    starts = starts[starts + 200 < last]
+    landmark = pd.DataFrame({'Landmark FromM': starts, 'Landmark ToM': starts + 199.9,
+                             'Landmark': ['Platform(S' + str(number) + ')' for number in range(1, len(starts) + 1)]})
+
+    lookup = pd.concat([landmark, overlap, track_type], axis=1)
+    threshold = pd.read_excel(threshold_source, sheet_name='threshold')
+    with pd.ExcelWriter(path) as writer:
+        threshold.to_excel(writer, sheet_name='threshold', index=False)
+        boundary.to_excel(writer, sheet_name='Exception Boundary', index=False)
+        lookup.to_excel(writer, sheet_name=line + ' ' + track, index=False)
+    return tension_lengths
+
+
+def make_months(tables, months, rng):
+    """
+    Makes the exception tables of the earlier monthly reports from the latest report, each with a chainage
+    shift, a jitter of the locations and some of the exceptions dropped.
+
+    Args:
+        tables (dict): The exception tables of the latest report keyed by their sheet name.
+        months (int): The number of monthly reports, including the latest.
+        rng (Generator): The random generator.
+
+    Returns:
+        (list[dict]): The exception tables of each report, from the earliest report to the latest.
+    """
+    reports = []
+    for month in range(months - 1, 0, -1):
+        shift = rng.uniform(-month_shift, month_shift)
+        report = {}
+        for sheet_name, exception_table in tables.items():
+            exception_table = exception_table[rng.random(len(exception_table)) >= month_dropped].reset_index(drop=True)
+            for column in ['startM', 'endM', 'maxLocation']:
+                exception_table[column] = (exception_table[column].astype(float) + shift +
+                                           rng.normal(0, month_jitter, len(exception_table)))
+            exception_table['id'] = exception_table['id'].str.replace('20240613', '2024' + str(6 - month).zfill(2) + '13')
+            report[sheet_name] = exception_table
+        reports.append(report)
+    return reports + [tables]
+
+
+def run_size(samples, months, exceptions_per_km, seed, workdir, keep):
+    """
+    Times every stage on a synthetic recording of the given number of samples.
+
+    Runs in its own process so the peak memory of each size is measured separately.
+
+    Args:
+        samples (int): The number of samples of the synthetic recording.
+        months (int): The number of monthly reports chained by the find repeated stages.
+        exceptions_per_km (float): The number of defects of each kind per km.
+        seed (int): The seed of the random generator.
+        workdir (str): The directory to create the synthetic files in, None for the system temporary directory.
+        keep (bool): Whether to keep the synthetic files.
+
+    Returns:
+        (dict): The samples, km, rows, .datac size, number of exceptions, and the seconds of each stage and the
+            peak memory of the process after it.
+    """
+    generator = load_script('TOV640_exception_generator', generator_path)
+    find_repeated = load_script('TOV640_find_repeated', find_repeated_path)
+    wear_average = load_script('EAL', wear_average_path)
+    rng = np.random.default_rng(seed)
+
+    directory = tempfile.mkdtemp(prefix='TOV640 benchmark ' + str(samples) + ' ', dir=workdir)
+    os.makedirs(os.path.join(directory, 'metadata'))
+    raw_data_path = os.path.join(directory, 'EAL_UP_UNI-TAP_' + str(samples) + '.datac')
+    end_m = make_datac(raw_data_path, samples, exceptions_per_km, rng)
+    tension_lengths = make_metadata(os.path.join(directory, 'metadata', line + ' metadata.xlsx'), end_m, rng)
+
+    # the tools read the metadata from ./metadata
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        profile = generator.start_profile('stages', datac=raw_data_path)
+        stage = generator.stage
+        with stage(profile, 'read_datac'):
+            raw = generator.read_datac(raw_data_path)
+            date = generator.output_date(raw)
+        with stage(profile, 'clean_raw'):
+            raw = generator.clean_raw(raw, line, track, section)
+        rows = len(raw)
+        with stage(profile, 'load_metadata'):
+            track_type, overlap, landmark, threshold = generator.load_metadata(line, section, track)
+
+        with stage(profile, 'data_process'):
+            raw, WH_cleaned_max, WH_cleaned_min, wear_min, stagger_left, stagger_right = \
+                generator.data_process(raw, track_type)
+        with stage(profile, 'find_low_height_exception'):
+            low_height_exception = generator.find_low_height_exception(WH_cleaned_min, threshold, date, line, section, track)
+        with stage(profile, 'find_high_height_exception'):
+            high_height_exception = generator.find_high_height_exception(WH_cleaned_max, threshold, date, line, section, track)
+        with stage(profile, 'find_wire_wear_exception'):
+            wear_exception = generator.find_wire_wear_exception(wear_min, threshold, date, line, section, track)
+        with stage(profile, 'find_stagger_exception'):
+            stagger_left_exception, stagger_right_exception = \
+                generator.find_stagger_exception(stagger_left, stagger_right, threshold, date, line, section, track)
+        tables = {'wear exception': wear_exception,
+                  'low height exception': low_height_exception,
+                  'high height exception': high_height_exception,
+                  'stagger left exception': stagger_left_exception,
+                  'stagger right exception': stagger_right_exception}
+        with stage(profile, 'indicate_overlap_landmark'):
+            overlap_landmark_index = generator.build_overlap_landmark_index(overlap, landmark)
+            for sheet_name, exception_table in tables.items():
+                exception_table = generator.indicate_overlap_landmark(overlap_landmark_index, exception_table)
+                tables[sheet_name] = generator.sort_table(generator.km_to_m(exception_table))
+
+        reports = make_months({sheet_name: exception_table[find_repeated.report_columns].reset_index(drop=True)
+                               for sheet_name, exception_table in tables.items()}, months, rng)
+        with stage(profile, 'estimate_shifts'):
+            shifts = find_repeated.estimate_shifts(reports)
+        with stage(profile, 'chain_repeated'):
+            repeated = {sheet_name: find_repeated.chain_repeated([report[sheet_name] for report in reports], shifts,
+                                                                 find_repeated.shift_tolerance)
+                        for sheet_name in find_repeated.report_sheets}
+
+        # the wear average report reads the chainage in m and the wire wear of the four wires
+        wear_data = pd.DataFrame({'TRACK': track, 'CHAINAGE': raw['Km'] * 1000,
+                                  'RWH1mm': raw['wear1'], 'RWH2mm': raw['wear2'],
+                                  'RWH3mm': raw['wear3'], 'RWH4mm': raw['wear4']})
+        with stage(profile, 'wear_average'):
+            wear_report = wear_average.get_individual_report(wear_data, tension_lengths)
+    finally:
+        os.chdir(cwd)
+        datac_mb = round(os.path.getsize(raw_data_path) / (1024 * 1024), 1)
+        if not keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    return {'samples': samples, 'km': round((end_m - start_m) / 1000, 3), 'rows': rows, 'datac_mb': datac_mb,
+            'exceptions': {sheet_name: len(exception_table) for sheet_name, exception_table in tables.items()},
+            'repeated': {sheet_name: len(table) for sheet_name, table in repeated.items()},
+            'tension_lengths': len(wear_report), 'stages': profile['stages']}
+
+
+def git_commit():
+    """
+    Returns the commit of the repository the benchmark is run on.
+
+    Returns:
+        (str): The commit hash, with -dirty appended if there are uncommitted changes, or None outside a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty', '--abbrev=12'], cwd=benchmark_directory,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(results, output_path):
+    """
+    Saves the benchmark results as .json, or as .csv with one row per size and stage.
+
+    Args:
+        results (dict): The benchmark results.
+        output_path (str): The path to the results file, its extension selects the format.
+    """
+    if os.path.splitext(output_path)[1].lower() == '.csv':
+        rows = []
+        for result in results['results']:
+            for item in result.get('stages', []):
+                rows.append({'commit': results['commit'], 'started': results['started'], 'samples': result['samples'],
+                             'rows': result.get('rows'), 'stage': item['stage'], 'seconds': item['seconds'],
+                             'process_peak_memory_mb': item['process_peak_memory_mb'], 'error': result.get('error')})
+            if 'error' in result:
+                rows.append({'commit': results['commit'], 'started': results['started'], 'samples': result['samples'],
+                             'error': result['error']})
+        pd.DataFrame(rows).to_csv(output_path, index=False)
+    else:
+        with open(output_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the stages of the TOV640 exception generator, the find repeated '
+                                                 'tool and the wear average report on synthetic .datac recordings.')
+    parser.add_argument('--sizes', nargs='+', type=parse_size, default=[parse_size(size) for size in default_sizes],
+                        help='numbers of samples of the synthetic recordings, e.g. 10k 1M (default: ' +
+                             ' '.join(default_sizes) + ')')
+    parser.add_argument('--output', default='benchmark_' + datetime.now().strftime('%Y%m%d_%H%M%S') + '.json',
+                        help='.json or .csv file to save the results in (default: %(default)s)')
+    parser.add_argument('--months', type=int, default=default_months,
+                        help='number of monthly reports chained by find repeated (default: %(default)s)')
+    parser.add_argument('--exceptions-per-km', type=float, default=default_exceptions_per_km,
+                        help='synthetic defects of each kind per km (default: %(default)s)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the synthetic data (default: %(default)s)')
+    parser.add_argument('--workdir', help='directory to create the synthetic files in (default: system temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the synthetic .datac and metadata files')
+    args = parser.parse_args()
+    if args.months < 2:
+        parser.error('--months must be at least 2')
+
+    results = {'started': datetime.now().isoformat(timespec='seconds'), 'commit': git_commit(),
+               'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+               'platform': platform.platform(), 'cpus': os.cpu_count(),
+               'settings': {'line': line, 'section': section, 'track': track, 'sample_step_m': sample_step,
+                            'months': args.months, 'exceptions_per_km': args.exceptions_per_km, 'seed': args.seed},
+               'results': []}
+    for samples in args.sizes:
+        print('Benchmarking ' + format(samples, ',') + ' samples...')
+        # a new process for every size, so the peak memory is not carried over from the larger sizes
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                result = executor.submit(run_size, samples, args.months, args.exceptions_per_km, args.seed,
+                                         args.workdir, args.keep).result()
+            except (Exception, SystemExit) as err:
+                result = {'samples': samples, 'error': repr(err)}
+                print('ERROR: ' + repr(err))
+        results['results'].append(result)
+        for item in result.get('stages', []):
+            print('    ' + item['stage'].ljust(28) + format(item['seconds'], '10.4f') + ' s' +
+                  ('' if item['process_peak_memory_mb'] is None else format(item['process_peak_memory_mb'], '10.1f') + ' MB'))
+        # saves after every size, so the results of the smaller sizes are kept if a larger one runs out of memory
+        write_results(results, args.output)
+
+    print('Saved: ' + os.path.abspath(args.output))
+
+
+if __name__ == "__main__":
+    main()
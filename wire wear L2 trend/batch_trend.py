@@ -0,0 +1,85 @@
+"""
+File: batch_trend.py
+Author: Lam Wai Taing, Timothy
+Date: 2026/10/17
+Description: A Python script to generate the wire wear L2 trend report without any prompt, taking the previous
+reports from a folder or a manifest and reading them in parallel.
+"""
+
+import os
+import glob
+import argparse
+import multiprocessing
+import trend
+
+
+def find_latest_find_repeated(directory):
+    """
+    Finds the latest Find Repeated Report in a folder.
+
+    Args:
+        directory (str): The folder holding the reports.
+
+    Returns:
+        (str): The path to the Find Repeated Report with the latest date in its file name, or None if there is none.
+    """
+    paths = [path for path in glob.glob(os.path.join(directory, '*_repeated.xlsx'))
+             if not os.path.basename(path).startswith('~$') and trend.report_date(path)]
+    return max(paths, key=trend.report_date) if paths else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generates the Wire Wear L2 Trend Report without any prompt. '
+                                                 'Run it in the wire wear L2 trend folder.')
+    parser.add_argument('find_repeated', nargs='?',
+                        help='Find Repeated Report of the current month (default: the latest one in --directory)')
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument('--directory', help='folder of the previous Exception Reports and Catenary Reports, '
+                                            'dated by the YYYYMMDD in their file names')
+    source.add_argument('--manifest', help='.csv file with the columns date, exception and catenary')
+    parser.add_argument('--months', type=int, default=trend.trend_months,
+                        help='number of months in the trend (default: %(default)s)')
+    parser.add_argument('--regression', choices=trend.regression_methods, default='least squares',
+                        help='regression of the trend (default: %(default)s)')
+    parser.add_argument('--output', help='directory to save the report in (default: next to the Find Repeated Report)')
+    parser.add_argument('--template', default=trend.template_path, help='template of the report (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of worker processes reading the reports (default: one per report, at most 8)')
+    parser.add_argument('--no-history', action='store_true',
+                        help='do not take the previous Exception Reports from the exception history')
+    args = parser.parse_args()
+
+    find_repeated = args.find_repeated
+    if find_repeated is None:
+        if args.directory is None:
+            parser.error('give the Find Repeated Report or a --directory holding it')
+        find_repeated = find_latest_find_repeated(args.directory)
+        if find_repeated is None:
+            parser.error('no Find Repeated Report (*_repeated.xlsx) found in ' + args.directory)
+    if args.months < 2:
+        parser.error('--months must be at least 2')
+
+    try:
+        if args.directory:
+            catalog = trend.find_month_reports(args.directory)
+        elif args.manifest:
+            catalog = trend.read_month_manifest(args.manifest)
+        else:
+            catalog = None
+
+        print('Generating the trend of ' + os.path.basename(find_repeated) + '...')
+        wire_L2, dates, database_df, catenary_df = trend.generate_trend(find_repeated, catalog, args.months,
+                                                                        args.regression, not args.no_history, args.workers)
+
+        directory = args.output if args.output else os.path.dirname(os.path.abspath(find_repeated))
+        os.makedirs(directory, exist_ok=True)
+        print('Saved: ' + trend.write_trend_report(wire_L2, dates, database_df, catenary_df, directory, args.template))
+    except Exception as err:
+        print('ERROR: ' + repr(err))
+        exit(1)
+
+
+if __name__ == "__main__":
+    # the reports are read in worker processes, which needs freeze_support in a frozen Windows executable
+    multiprocessing.freeze_support()
+    main()
@@ -2,273 +2,758 @@
 File: trend.py
 Author: Lam Wai Taing, Timothy
 Date: 2024/08/16
-Description: A Python script to generate the trend report of Previous 6 months.
+Description: A Python script to generate the trend report of the previous months (6 by default).
 """
 
 import os
 import re
+import sys
 import numpy as np
 import pandas as pd
 import openpyxl
 import time
-import tkinter as tk
+import copy
+import multiprocessing
 from datetime import datetime
-from tkinter import filedialog
-
-print('Before you start, please go through the following instructions.')
-print('1. Please prepare the Find Repeated Report of 3 Exception Reports.')
-print('2. Please prepare the 5 previous Exception Reports.')
-print('3. Please prepare the Catenary Report of previous 3, 4, and 5 months.\n')
-input('Press Enter to continue...')
-print()
-
-# inputs and reads find repeated report
-try:
-    print('Please select the Find Repeated Report after 1 second...')
+from concurrent.futures import ProcessPoolExecutor
+# the exception history appended by the TOV640 exception generator is read through the module in the TOV640 folder
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'TOV640'))
+import exception_reports
+
+# an exception needs an action if the first point of its trend is at or below trend_limit (mm),
+# it is a confirmed L2 if the trend is within trend_tolerance (mm) of the measured wear, or else it is verified on site
+trend_limit = 10.2
+trend_tolerance = 0.2
+
+# largest distance (m) from the MaxLocation of an exception to the nearest sample of a Catenary Report
+# for the sample to be taken when no exception of the previous report overlaps it
+catenary_tolerance = 0.5
+
+# wire wear columns of the Catenary Report
+wire_wear_columns = ['WireWear1', 'WireWear2', 'WireWear3', 'WireWear4']
+
+# number of months in the trend, including the current month
+trend_months = 6
+
+# regression of the trend: ordinary 'least squares', 'weighted' least squares where the weight of a month halves every
+# trend_half_life days before the current date, or 'theil-sen', the median of the slopes between every two months,
+# which is not pulled by a single wrong reading
+regression_methods = ['least squares', 'weighted', 'theil-sen']
+trend_half_life = 180
+
+# template of the report, relative to the wire wear L2 trend folder
+template_path = './Wire Wear L2 Trend Report Template.xlsx'
+
+# number of Previous IDs and months the template is laid out for
+template_previous = 2
+template_months = 6
+
+
+def find_history_reports(exception_id, count):
+    """
+    Lists the Exception Report holding the wear exception and the reports of the same line, section and track
+    before it in the exception history.
+
+    Args:
+        exception_id (str): The id of the wear exception.
+        count (int): The number of reports to list, including the one holding the exception.
+
+    Returns:
+        (list[str]): The keys of the reports from the latest to the earliest, or None if the history has
+            fewer than count reports.
+    """
+    report = exception_reports.find_exception_report(exception_id, 'wear exception')
+    if report is None:
+        return None
+    reports = exception_reports.find_history_reports(report, count)
+    return None if reports is None else reports[::-1]
+
+
+def report_date(path):
+    """
+    Returns the date (YYYYMMDD) in the file name of a report.
+
+    Args:
+        path (str): The path to the report.
+
+    Returns:
+        (str): The first 8 digits in the file name, or None if there are none.
+    """
+    date = re.search(r'(\d{8})', os.path.basename(path))
+    return date.group(1) if date else None
+
+
+def find_month_reports(directory):
+    """
+    Lists the Exception Report and Catenary Report of each month in a folder.
+
+    The date of a report is the first date (YYYYMMDD) in its file name. The .xlsx files with Exception Report
+    in their name are the Exception Reports, the other .xlsx files with a date are the Catenary Reports.
+    Find Repeated Reports (with repeated in their name) are skipped.
+
+    Args:
+        directory (str): The folder holding the reports.
+
+    Returns:
+        (DataFrame): The exception and catenary paths of each date, indexed by date from the latest to the earliest.
+    """
+    reports = {}
+    for name in os.listdir(directory):
+        date = report_date(name)
+        if not name.lower().endswith('.xlsx') or name.startswith('~$') or 'repeated' in name or date is None:
+            continue
+        kind = 'exception' if 'Exception Report' in name else 'catenary'
+        reports.setdefault(date, {})[kind] = os.path.join(directory, name)
+    return pd.DataFrame.from_dict(reports, orient='index', columns=['exception', 'catenary']).sort_index(ascending=False)
+
+
+def read_month_manifest(path):
+    """
+    Reads a manifest listing the Exception Report and Catenary Report of each month.
+
+    The manifest is a .csv file with the columns date (YYYYMMDD), exception and catenary, the catenary can be left empty
+    for the months of the Find Repeated Report. Relative paths are relative to the folder of the manifest.
+
+    Args:
+        path (str): The path to the manifest.
+
+    Returns:
+        (DataFrame): The exception and catenary paths of each date, indexed by date from the latest to the earliest.
+    """
+    manifest = pd.read_csv(path, dtype=str).apply(lambda x: x.str.strip())
+    missing = {'date', 'exception', 'catenary'} - set(manifest.columns)
+    if missing:
+        raise ValueError('Missing columns in ' + path + ': ' + ', '.join(sorted(missing)))
+    folder = os.path.dirname(os.path.abspath(path))
+    for column in ['exception', 'catenary']:
+        manifest[column] = manifest[column].map(lambda x: os.path.join(folder, x), na_action='ignore')
+    return manifest.set_index('date')[['exception', 'catenary']].sort_index(ascending=False)
+
+
+def select_exception_report(history_reports, catalog, index, date, before):
+    """
+    Selects a previous Exception Report, taking it from the exception history or the listed reports if given,
+    or else from a file dialog.
+
+    Args:
+        history_reports (list[str]): The previous reports found in the exception history, or None.
+        catalog (DataFrame): The reports of each date, as returned by find_month_reports or read_month_manifest, or None.
+        index (int): The index of the report in history_reports.
+        date (str): The date (YYYYMMDD) of the report to take from the catalog, or None to take the latest one before before.
+        before (str): The date (YYYYMMDD) of the month after the report.
+
+    Returns:
+        (str): The path to the selected report, or its key in the exception history.
+    """
+    if history_reports is not None:
+        print('Found in the exception history: ' + history_reports[index] + '\n')
+        return history_reports[index]
+    if catalog is not None:
+        reports = catalog['exception'].dropna()
+        reports = reports[reports.index == date] if date is not None else reports[reports.index < before]
+        if reports.empty:
+            raise ValueError('No Exception Report ' + ('of ' + date if date is not None else 'before ' + before) + ' is listed')
+        print('Found: ' + os.path.basename(reports.iloc[0]) + '\n')
+        return reports.iloc[0]
+    from tkinter import filedialog
     time.sleep(1)
-    root = tk.Tk()
-    root.withdraw()
     path = filedialog.askopenfilename()
     print('Selected: ' + os.path.basename(path) + '\n')
-
-    wire_L2 = pd.read_excel(path, sheet_name='Summary')
-    wire_L2.columns = wire_L2.iloc[0]
-    wire_L2 = wire_L2[1:]
-    wire_L2 = wire_L2[(wire_L2['Exception Type'] == 'Wire Wear') &
-                    (wire_L2['Level'] == 'L2') &
-                    ((wire_L2['ACTION'] == '') | (pd.isna(wire_L2['ACTION'])) | (wire_L2['ACTION'] == 'NaN'))]
-    wire_L2 = wire_L2[['ID', 'StartM', 'EndM', 'MaxValue', 'MaxLocation', 'Level']]
-
-    # reads previous 2 IDs
-    previous_2 = pd.read_excel(path, sheet_name='Previous')
-    previous_2 = previous_2[previous_2['ID'].astype(str).isin(wire_L2['ID'].astype(str))]
-    previous_2 = previous_2[['ID', 'Previous 1', 'Previous 2']]
-
-    wire_L2 = wire_L2.merge(right=previous_2, on='ID').reset_index(drop=True)
-except KeyError as err:
-    print('ERROR: Invalid or missing column names in ' + path)
-    input('Press Enter to exit')
-    exit()
-except Exception as err:
-    print('ERROR: ' + str(err) + ' in ' + path)
-    input('Press Enter to exit')
-    exit()
-
-# copies and pastes the maxValue of current date
-current_date = re.search(r'(\d{8})', path)
-if current_date:
-    current_date = current_date.group(1)
-    current_date = datetime.strptime(current_date, '%Y%m%d').strftime('%d-%m-%Y')
-else:
-    print('ERROR: No date or invalid date found in the file name ' + path)
-    print('Please make sure file name has valid date format of year-month-date, for example, 20240813')
-    input('Press Enter to exit')
-    exit()
-wire_L2[current_date] = wire_L2['MaxValue']
-
-dates = pd.DataFrame()
-dates['date'] = ''
-dates['days'] = ''
-dates.loc[0, 'date'] = current_date
-dates.loc[0, 'days'] = 0
-
-database_df = pd.DataFrame()
-catenary_df = pd.DataFrame()
-
-try:
-    # inputs and reads Previous 2 wire wear Exception Rerpots
-    print('Please select the Previous 2 Exception Reports')
-    print('Selecting first Previous Exception (' + re.search(r'(.*?_W)', wire_L2['Previous 2'].iloc[0]).group(1)[:-2] + '): ')
-    time.sleep(1)
-    previous_1_path = filedialog.askopenfilename()
-    print('Selected: ' + os.path.basename(previous_1_path) + '\n')
-    previous_1st_df = pd.read_excel(previous_1_path, sheet_name='wear exception')
-    date_1st_str = wire_L2['Previous 2'].iloc[0][:8]
-
-    # checks if date in file name matches with date in Previous 2 ID
-    if (os.path.basename(previous_1_path)[:8] != date_1st_str):
-        print("ERROR: date in file name " + os.path.basename(previous_1_path) + f" doesn't match with date in Previous 2 " + date_1st_str)
-        input('Press Enter to exit')
-        exit()
-
-    date_1st = datetime.strptime(date_1st_str, '%Y%m%d')
-    date_1st = date_1st.strftime('%d-%m-%Y')
-    dates.loc[1, 'date'] = date_1st
-
-    database_df = previous_1st_df
-except Exception as err:
-    print('ERROR: ' + str(err) + ' in ' + previous_1_path)
-    input('Press Enter to exit')
-    exit()
-
-try:
-    print('Selecting second Previous Exception (' + re.search(r'(.*?_W)', wire_L2['Previous 1'].iloc[0]).group(1)[:-2] + '): ')
+    return path
+
+
+def select_catenary_report(catalog, date):
+    """
+    Selects the Catenary Report of a month, taking it from the listed reports if given, or else from a file dialog.
+
+    Args:
+        catalog (DataFrame): The reports of each date, as returned by find_month_reports or read_month_manifest, or None.
+        date (str): The date (YYYYMMDD) of the month.
+
+    Returns:
+        (str): The path to the selected Catenary Report.
+    """
+    if catalog is not None:
+        if date not in catalog.index or pd.isna(catalog.loc[date, 'catenary']):
+            raise ValueError('No Catenary Report of ' + str(date) + ' is listed')
+        print('Found: ' + os.path.basename(catalog.loc[date, 'catenary']) + '\n')
+        return catalog.loc[date, 'catenary']
+    from tkinter import filedialog
     time.sleep(1)
-    previous_2_path = filedialog.askopenfilename()
-    print('Selected: ' + os.path.basename(previous_2_path) + '\n')
-    previous_2nd_df = pd.read_excel(previous_2_path, sheet_name='wear exception')
-    date_2nd_str = wire_L2['Previous 1'].iloc[0][:8]
-
-    # checks if date in file name matches with date in Previous 1 ID
-    if (os.path.basename(previous_2_path)[:8] != date_2nd_str):
-        print("ERROR: date in file name " + os.path.basename(previous_2_path) + f" doesn't match with date in Previous 1 " + date_2nd_str)
-        input('Press Enter to exit')
-        exit()
-
-    date_2nd = datetime.strptime(date_2nd_str, '%Y%m%d')
-    date_2nd = date_2nd.strftime('%d-%m-%Y')
-    dates.loc[2, 'date'] = date_2nd
-
-    database_df = pd.concat([database_df, previous_2nd_df])
-except Exception as err:
-    print('ERROR: ' + str(err) + ' in ' + previous_2_path)
-    input('Press Enter to exit')
-    exit()
-
-wire_L2[date_1st] = ''
-wire_L2[date_2nd] = ''
-
-# looks up 2 previous wear values from previous 2 Exception Reports
-for index, row in wire_L2.iterrows():
-    if previous_1st_df[previous_1st_df['id'] == row['Previous 2']]['maxValue'].empty:
-        print('ERROR: ID is not found in first previous Exception Report ' + previous_1_path)
-        input('Press Enter to exit')
-        exit()
-    elif previous_2nd_df[previous_2nd_df['id'] == row['Previous 1']]['maxValue'].empty:
-        print('ERROR: ID is not found in second previous Exception Report ' + previous_2_path)
-        input('Press Enter to exit')
-        exit()
-    previous_1st = previous_1st_df[previous_1st_df['id'] == row['Previous 2']]['maxValue'].values[0]
-    previous_2nd = previous_2nd_df[previous_2nd_df['id'] == row['Previous 1']]['maxValue'].values[0]
-    wire_L2.loc[index, date_1st] = previous_1st
-    wire_L2.loc[index, date_2nd] = previous_2nd
-
-    # inputs previous 3, 4, 5 Exception Reports
-    # if not exception values not found, looks up in Catenary Reports
-try:
-    for i in range(3, 6):
-        print('Selecting Previous ' + str(i) + ' Exception Report')
-        time.sleep(1)
-        temp_previous_exception_path = filedialog.askopenfilename()
-        current_path = temp_previous_exception_path     # for debugging
-        temp_previous_exception_df = pd.read_excel(temp_previous_exception_path, sheet_name='wear exception')
-        print('Selected: ' + os.path.basename(temp_previous_exception_path) + '\n')
-        temp_date_str = temp_previous_exception_df['id'].iloc[0][:8]
-        temp_date = datetime.strptime(temp_date_str, '%Y%m%d')
-        temp_date = temp_date.strftime('%d-%m-%Y')
-        dates.loc[i, 'date'] = temp_date
-
-        database_df = pd.concat([database_df, temp_previous_exception_df])
-
-        # inputs Catenary Report
-        print('Selecting Catenary Report of ' + os.path.basename(temp_previous_exception_path).split('_Exception Report')[0])
-        time.sleep(1)
-        temp_previous_catenary_path = filedialog.askopenfilename()
-        current_path = temp_previous_catenary_path      # for debugging
-        temp_previous_catenary_df = pd.read_excel(temp_previous_catenary_path, sheet_name='Sheet1')
-        print('Selected: ' + os.path.basename(temp_previous_catenary_path) + '\n')
-        temp_previous_catenary_df.columns = temp_previous_catenary_df.iloc[1]
-        temp_previous_catenary_df = temp_previous_catenary_df[2:].dropna(how='all')
-        temp_previous_catenary_df = temp_previous_catenary_df.drop(temp_previous_catenary_df[temp_previous_catenary_df['LINE'].isin(['Date', 'LINE'])].index).reset_index(drop=True)
-        
-        temp_previous_catenary_df = temp_previous_catenary_df.rename({'RWH1mm': 'WireWear1', 'RWH2mm': 'WireWear2', 'RWH3mm': 'WireWear3', 'RWH4mm': 'WireWear4'}, axis=1)
-        catenary_df = pd.concat([catenary_df, temp_previous_catenary_df[['LINE', 'TRACK', 'CHAINAGE', 'WireWear1', 'WireWear2', 'WireWear3', 'WireWear4']]], axis=1)
-        catenary_df.insert(catenary_df.shape[1], ' ', '', allow_duplicates=True)
-        wire_L2[temp_date] = ''
-        
-        for index, row in wire_L2.iterrows():
-            current_path = temp_previous_exception_path     # for degbugging
-            temp_maxLocation = row['MaxLocation']
-            
-            temp_found_maxLocation = temp_previous_exception_df[(temp_previous_exception_df['startM'].astype(int) <= row['EndM']) &
-                                                                (temp_previous_exception_df['endM'].astype(int) >= row['StartM'])]
-            
-            # temp_found_maxLocation = temp_previous_exception_df[(((temp_previous_exception_df['startM'].astype(int) - 0.5) <= temp_maxLocation) &
-            #                                                     ((temp_previous_exception_df['endM'].astype(int) + 0.49) >= temp_maxLocation))]
-
-            # if not found in Exception Report, looks up in Catenary Report
-            if (not temp_found_maxLocation.empty):
-                wire_L2.loc[index, temp_date] = np.max(temp_found_maxLocation['maxValue'].values)
-            else:
-                current_path = temp_previous_catenary_path  # for debugging
-                temp_found_maxLocation = temp_previous_catenary_df[temp_previous_catenary_df['CHAINAGE'].astype(float) == temp_maxLocation]
-                temp_maxValue = np.max(temp_found_maxLocation[['WireWear1', 'WireWear2', 'WireWear3', 'WireWear4']])
-                wire_L2.loc[index, temp_date] = temp_maxValue
-
+    path = filedialog.askopenfilename()
+    print('Selected: ' + os.path.basename(path) + '\n')
+    return path
+
+
+def read_wear_exception(path):
+    """
+    Reads the wear exception sheet of an Exception Report (see exception_reports.read_exception_report).
+
+    All the columns are read since the wear exceptions are saved in the Database sheet of the report.
+
+    Args:
+        path (str): The path to the Exception Report, or its key in the exception history.
+
+    Returns:
+        (DataFrame): The wear exception table.
+    """
+    return exception_reports.read_exception_report(path, ['wear exception'])['wear exception']
+
+
+def read_catenary_report(path):
+    """
+    Reads the wire wear of a Catenary Report.
+
+    Args:
+        path (str): The path to the Catenary Report.
+
+    Returns:
+        (DataFrame): The LINE, TRACK, CHAINAGE and the wire wear (WireWear1 to WireWear4) of the report.
+    """
+    catenary = pd.read_excel(path, sheet_name='Sheet1')
+    catenary.columns = catenary.iloc[1]
+    catenary = catenary[2:].dropna(how='all')
+    catenary = catenary.drop(catenary[catenary['LINE'].isin(['Date', 'LINE'])].index).reset_index(drop=True)
+
+    catenary = catenary.rename({'RWH1mm': 'WireWear1', 'RWH2mm': 'WireWear2', 'RWH3mm': 'WireWear3', 'RWH4mm': 'WireWear4'}, axis=1)
+    return catenary[['LINE', 'TRACK', 'CHAINAGE'] + wire_wear_columns]
+
+
+def lookup_wear(exceptions, ids):
+    """
+    Looks up the maxValue of the exceptions with the given ids through an index of the ids of the report.
+
+    Args:
+        exceptions (DataFrame): The wear exception table of an Exception Report.
+        ids (Series): The ids to look up.
+
+    Returns:
+        values (ndarray): The maxValue of each id, NaN if the id is not found.
+        missing (list[str]): The ids not found in the report.
+    """
+    # takes the first exception of an id, like the filter on the id did
+    max_values = exceptions.drop_duplicates(subset='id').set_index('id')['maxValue']
+    values = max_values.reindex(ids.to_numpy()).to_numpy()
+    missing = ids[~ids.isin(max_values.index)].astype(str).tolist()
+    return values, missing
+
+
+def max_overlapping_wear(exceptions, start, end):
+    """
+    Finds the largest maxValue of the exceptions of a report overlapping each range in one sorted sweep.
+
+    An exception overlaps a range if its startM, in whole meters, is at or before the end of the range and its endM,
+    in whole meters, is at or after the start of the range. The exceptions are sorted by startM once, then the exceptions
+    that can overlap each range are found with a binary search and only those are compared with the range.
+
+    Args:
+        exceptions (DataFrame): The wear exception table of an Exception Report.
+        start (ndarray): The start (m) of each range.
+        end (ndarray): The end (m) of each range.
+
+    Returns:
+        values (ndarray): The largest maxValue of the exceptions overlapping each range.
+        found (ndarray): Whether any exception overlaps each range, values is NaN where it is False.
+    """
+    exception_start = np.trunc(exceptions['startM'].to_numpy(dtype=float))
+    order = np.argsort(exception_start, kind='stable')
+    exception_start = exception_start[order]
+    exception_end = np.trunc(exceptions['endM'].to_numpy(dtype=float))[order]
+    max_values = exceptions['maxValue'].to_numpy(dtype=float)[order]
+
+    # the exceptions before first all end before the start of the range, the ones from last on start after its end
+    reach = np.fmax.accumulate(exception_end) if len(exception_end) else exception_end
+    first = np.searchsorted(reach, start, side='left')
+    last = np.searchsorted(exception_start, end, side='right')
+    counts = np.maximum(last - first, 0)
+    query = np.repeat(np.arange(len(start)), counts)
+    candidate = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts) + np.repeat(first, counts)
+    overlapping = exception_end[candidate] >= start[query]
+    query, candidate = query[overlapping], candidate[overlapping]
+
+    values = np.full(len(start), -np.inf)
+    np.maximum.at(values, query, max_values[candidate])
+    found = np.zeros(len(start), dtype=bool)
+    found[query] = True
+    values[~found] = np.nan
+    return values, found
+
+
+def nearest_catenary_wear(catenary, locations, tolerance=catenary_tolerance):
+    """
+    Looks up the largest wire wear of the four wires at the sample of a Catenary Report nearest to each location.
+
+    The samples are sorted by chainage once, the samples at the same chainage are merged keeping the largest wear,
+    then the nearest sample of each location is found with a binary search.
+
+    Args:
+        catenary (DataFrame): The Catenary Report, as returned by read_catenary_report.
+        locations (ndarray): The locations (m) to look up.
+        tolerance (float): The largest distance (m) to the nearest sample. Defaults to catenary_tolerance.
+
+    Returns:
+        (ndarray): The largest wire wear at each location, NaN if there is no sample within the tolerance.
+    """
+    chainage = catenary['CHAINAGE'].to_numpy(dtype=float)
+    wear = np.fmax.reduce(catenary[wire_wear_columns].to_numpy(dtype=float), axis=1)
+    order = np.argsort(chainage, kind='stable')
+    order = order[~np.isnan(chainage[order])]
+    if len(order) == 0:
+        return np.full(len(locations), np.nan)
+    sorted_chainage = chainage[order]
+    starts = np.flatnonzero(np.diff(sorted_chainage, prepend=np.nan) != 0)
+    sample_chainage = sorted_chainage[starts]
+    sample_wear = np.fmax.reduceat(wear[order], starts)
+
+    position = np.searchsorted(sample_chainage, locations)
+    before = np.clip(position - 1, 0, len(sample_chainage) - 1)
+    after = np.clip(position, 0, len(sample_chainage) - 1)
+    nearest = np.where(np.abs(sample_chainage[after] - locations) < np.abs(sample_chainage[before] - locations),
+                       after, before)
+    return np.where(np.abs(sample_chainage[nearest] - locations) <= tolerance, sample_wear[nearest], np.nan)
+
+
+def fittable_trends(days, values):
+    """
+    Checks whether the line of each exception can be fitted, which needs wear on at least 2 different days.
+
+    Args:
+        days (ndarray): The days between each month and the current date, shared by all the exceptions.
+        values (ndarray): The wear of each exception (row) in each month (column).
+
+    Returns:
+        (ndarray): Whether each exception has wear on at least 2 different days.
+    """
+    days = np.asarray(days, dtype=float)
+    has_value = ~np.isnan(np.asarray(values, dtype=float))
+    # the months on the same day are merged, so they count as one day
+    order = np.argsort(days, kind='stable')
+    starts = np.flatnonzero(np.diff(days[order], prepend=np.nan) != 0)
+    return np.count_nonzero(np.logical_or.reduceat(has_value[:, order], starts, axis=1), axis=1) >= 2
+
+
+def fit_trends(days, values, method='least squares'):
+    """
+    Fits the line of the wear against the days of every exception in one pass.
+
+    The slope and intercept of all the exceptions are solved at once from the (exceptions x months) matrix of wear.
+    Least squares gives the same line as np.polyfit of degree 1 on each exception. The months without a value
+    of an exception are left out of its line, and an exception without wear on 2 different days has no line
+    (see fittable_trends).
+
+    Args:
+        days (ndarray): The days between each month and the current date, shared by all the exceptions.
+        values (ndarray): The wear of each exception (row) in each month (column).
+        method (str): One of regression_methods. Defaults to 'least squares'.
+
+    Returns:
+        slope (ndarray): The slope of the line of each exception, NaN if it has no line.
+        intercept (ndarray): The intercept of the line of each exception, NaN if it has no line.
+    """
+    days = np.asarray(days, dtype=float)
+    values = np.asarray(values, dtype=float)
+    if method == 'least squares':
+        weights = np.ones(len(days))
+    elif method == 'weighted':
+        weights = 0.5 ** (days / trend_half_life)
+    elif method != 'theil-sen':
+        raise ValueError('Unknown regression ' + str(method) + ', use one of ' + ', '.join(regression_methods))
+
+    # a line through the values of a single day is 0 / 0, so those exceptions are not fitted
+    fitted = fittable_trends(days, values)
+    slope = np.full(len(values), np.nan)
+    intercept = np.full(len(values), np.nan)
+    values = values[fitted]
+    if not len(values):
+        return slope, intercept
+
+    if method == 'theil-sen':
+        first, second = np.triu_indices(len(days), k=1)
+        distinct = days[first] != days[second]
+        first, second = first[distinct], second[distinct]
+        slope[fitted] = np.nanmedian((values[:, second] - values[:, first]) / (days[second] - days[first]), axis=1)
+        intercept[fitted] = np.nanmedian(values - slope[fitted][:, None] * days, axis=1)
+        return slope, intercept
+
+    weights = np.where(np.isnan(values), 0, weights)
+    values = np.nan_to_num(values)
+    mean_days = weights @ days / weights.sum(axis=1)
+    mean_values = (weights * values).sum(axis=1) / weights.sum(axis=1)
+    centred_days = days - mean_days[:, None]
+    slope[fitted] = (weights * centred_days * (values - mean_values[:, None])).sum(axis=1) / (weights * centred_days ** 2).sum(axis=1)
+    intercept[fitted] = mean_values - slope[fitted] * mean_days
+    return slope, intercept
+
+
+def assess_trends(wire_L2, dates, method='least squares'):
+    """
+    Adds the trend points, the two logics and the result of every exception as whole columns.
+
+    An exception without wear on 2 different days has no trend, so it is printed and its result is verify on site.
+
+    Args:
+        wire_L2 (DataFrame): The L2 wire wear exceptions with the wear in each month in the column of its date.
+        dates (DataFrame): The date and days of each month, from the current month to the earliest.
+        method (str): The regression of the trend, one of regression_methods. Defaults to 'least squares'.
+
+    Returns:
+        wire_L2 (DataFrame): The exceptions with the trd pt, logic 1, logic 2 and Result columns.
+    """
+    days = dates['days'].to_numpy(dtype=int)
+    values = wire_L2[list(dates['date'])].to_numpy(dtype=float)
+    slope, intercept = fit_trends(days, values, method)
+    too_few = ~fittable_trends(days, values)
+    if too_few.any():
+        print('WARNING: ' + str(too_few.sum()) + ' IDs do not have wear on 2 different days to fit a trend and are '
+              'marked verify on site: ' + ', '.join(wire_L2.loc[too_few, 'ID'].astype(str)))
+    trend = slope[:, None] * days + intercept[:, None]
+    for i in range(trend.shape[1]):
+        wire_L2['trd pt ' + str(i + 1)] = trend[:, i]
+
+    wire_L2['logic 1'] = wire_L2['trd pt 1'] <= trend_limit
+    wire_L2['logic 2'] = (wire_L2['MaxValue'].astype(float) - wire_L2['trd pt 1']).abs() > trend_tolerance
+    wire_L2['Result'] = np.where(too_few, 'verify on site',
+                                 np.where(~wire_L2['logic 1'], 'no action required',
+                                          np.where(wire_L2['logic 2'], 'verify on site', 'confirmed valid L2')))
+    return wire_L2
+
+
+def build_trend(wire_L2, current_date, previous_months, method='least squares'):
+    """
+    Builds the wire wear trend of every L2 exception over the current month and the previous months.
+
+    The wear of a month is looked up by the ID of the exception in that month if the Find Repeated Report has it,
+    or else taken from the exceptions of the month overlapping the exception, or else from the Catenary Report
+    of the month at the MaxLocation of the exception. The IDs with none of them in a month are printed, and their
+    trend is fitted without that month.
+
+    Args:
+        wire_L2 (DataFrame): The L2 wire wear exceptions of the Find Repeated Report with their Previous columns.
+        current_date (str): The date of the current month, dd-mm-YYYY.
+        previous_months (list[dict]): The previous months from the latest to the earliest, each with:
+            exceptions (DataFrame): The wear exception table of the month.
+            id column (str): The Previous column with the IDs of the month, or None if the month is not in the
+                Find Repeated Report.
+            catenary (DataFrame): The Catenary Report of the month, needed if id column is None.
+            path (str): The path to the Exception Report of the month, shown in the errors.
+        method (str): The regression of the trend, one of regression_methods. Defaults to 'least squares'.
+
+    Returns:
+        wire_L2 (DataFrame): The exceptions with the wear in each month and their trend, sorted by ID.
+        dates (DataFrame): The date (dd-mm-YYYY) and days before the current date of each month.
+        database_df (DataFrame): The wear exceptions of all the previous months.
+        catenary_df (DataFrame): The Catenary Reports side by side.
+    """
+    wire_L2[current_date] = wire_L2['MaxValue']
+    dates = [current_date]
+    database_df = pd.DataFrame()
+    catenary_df = pd.DataFrame()
+    missing_ids = []
+    unmatched_ids = []
+    for month, previous in enumerate(previous_months, 1):
+        exceptions = previous['exceptions']
+        if previous['id column'] is not None:
+            date = wire_L2[previous['id column']].iloc[0][:8]
+            values, missing = lookup_wear(exceptions, wire_L2[previous['id column']])
+            if missing:
+                missing_ids.append(str(len(missing)) + ' IDs are not found in Previous ' + str(month) + ' Exception Report ' +
+                                   previous['path'] + ': ' + ', '.join(missing))
+        else:
+            # takes the largest wear of the exceptions overlapping each exception, in one sweep over the wear
+            # exceptions of the month already read (from the history if it is there), or else the wear of the
+            # Catenary Report at its MaxLocation
+            date = exceptions['id'].iloc[0][:8]
+            values, found = max_overlapping_wear(exceptions, wire_L2['StartM'].to_numpy(dtype=float),
+                                                 wire_L2['EndM'].to_numpy(dtype=float))
+            values = np.where(found, values,
+                              nearest_catenary_wear(previous['catenary'], wire_L2['MaxLocation'].to_numpy(dtype=float)))
+            unmatched = wire_L2.loc[np.isnan(values), 'ID'].astype(str).tolist()
+            if unmatched:
+                unmatched_ids.append(str(len(unmatched)) + ' IDs have no overlapping exception in Previous ' + str(month) +
+                                     ' Exception Report ' + previous['path'] + ' and no Catenary Report sample within ' +
+                                     str(catenary_tolerance) + ' m of their MaxLocation: ' + ', '.join(unmatched))
+            catenary_df = pd.concat([catenary_df, previous['catenary']], axis=1)
+            catenary_df.insert(catenary_df.shape[1], ' ', '', allow_duplicates=True)
+        date = datetime.strptime(date, '%Y%m%d').strftime('%d-%m-%Y')
+        wire_L2[date] = values
+        dates.append(date)
+        database_df = pd.concat([database_df, exceptions])
+    if missing_ids:
+        raise ValueError('\n'.join(missing_ids))
+    # the trend of these IDs is fitted without the months they have no wear in
+    for unmatched in unmatched_ids:
+        print('WARNING: ' + unmatched)
     database_df.insert(0, 'month', '')
-except Exception as err:
-    print('ERROR: ' + str(err) + ' in ' + current_path)
-    input('Press Enter to exit')
-    exit()
 
-try:
     # Calculates days
-    for index, row in dates.iterrows():
-        if index == 0:
-            continue
-        else:
-            dates.loc[index, 'days'] = (datetime.strptime(current_date, '%d-%m-%Y') - datetime.strptime(row['date'], '%d-%m-%Y')).days
+    current = datetime.strptime(current_date, '%d-%m-%Y')
+    dates = pd.DataFrame({'date': dates, 'days': [(current - datetime.strptime(date, '%d-%m-%Y')).days for date in dates]})
 
-    dates = dates.transpose().reset_index(drop=True)
-
-    wire_L2[['trd pt 1', 'trd pt 2', 'trd pt 3', 'trd pt 4', 'trd pt 5', 'trd pt 6', 'logic 1', 'logic 2', 'Result']] = ''
+    wire_L2 = assess_trends(wire_L2, dates, method)
+    wire_L2['ID_num'] = wire_L2['ID'].str.extract(r'_W(\d+)').astype(int)
+    wire_L2 = wire_L2.sort_values(by='ID_num').drop(columns='ID_num')
+    return wire_L2, dates, database_df, catenary_df
 
-    for index, row in wire_L2.iterrows():
-        row = row.to_frame().transpose()
 
-        trend_df = dates.reset_index(drop=True)
-        trend_df.columns = trend_df.iloc[0].values
-        trend_df = trend_df.reset_index(drop=True)
-        trend_df = trend_df.iloc[1:].reset_index(drop=True)
+def read_find_repeated(path, months=trend_months):
+    """
+    Reads the L2 wire wear exceptions of a Find Repeated Report with their Previous IDs.
 
-        date_columns = [col for col in row.columns if col in trend_df.columns]
+    Only the filled Previous columns within the trend are kept, Previous 1 being the earliest.
+    Raises a ValueError if the report has no L2 wire wear exception without an ACTION.
 
-        trend_df = pd.concat([trend_df, row[date_columns]]).reset_index(drop=True)
+    Args:
+        path (str): The path to the Find Repeated Report, with the date (YYYYMMDD) of the current month in its file name.
+        months (int): The number of months in the trend. Defaults to trend_months.
 
-        # calculates coefficient
-        z = np.polyfit(trend_df.iloc[0].astype(int) ,trend_df.iloc[1].astype(float), 1)
+    Returns:
+        wire_L2 (DataFrame): The L2 wire wear exceptions without an ACTION, with their Previous columns.
+        previous_columns (list[str]): The Previous columns kept, from the earliest to the latest.
+        current_date (str): The date of the current month, dd-mm-YYYY.
+    """
+    current_date = report_date(path)
+    if current_date is None:
+        raise ValueError('No date or invalid date found in the file name ' + path)
+    current_date = datetime.strptime(current_date, '%Y%m%d').strftime('%d-%m-%Y')
 
-        # calculates trend points
-        for i in range(0, 6):
-            column_name = 'trd pt ' + str(i + 1)
-            wire_L2.loc[index, column_name] = z[0] * trend_df.iloc[0, i] + z[1]
+    # reads both sheets in one go, so the workbook is opened once
+    find_repeated = pd.read_excel(path, sheet_name=['Summary', 'Previous'])
+    wire_L2 = find_repeated['Summary']
+    wire_L2.columns = wire_L2.iloc[0]
+    wire_L2 = wire_L2[1:]
+    wire_L2 = wire_L2[(wire_L2['Exception Type'] == 'Wire Wear') &
+                    (wire_L2['Level'] == 'L2') &
+                    ((wire_L2['ACTION'] == '') | (pd.isna(wire_L2['ACTION'])) | (wire_L2['ACTION'] == 'NaN'))]
+    wire_L2 = wire_L2[['ID', 'StartM', 'EndM', 'MaxValue', 'MaxLocation', 'Level']]
+    if wire_L2.empty:
+        raise ValueError('No L2 wire wear exception without an ACTION')
 
-        # assigns logics
-        wire_L2.loc[index, 'logic 1'] = (wire_L2.loc[index, 'trd pt 1'] <= 10.2)
-        wire_L2.loc[index, 'logic 2'] = (abs(wire_L2.loc[index, 'MaxValue'] - wire_L2.loc[index, 'trd pt 1']) > 0.2)
-        if (~wire_L2.loc[index, 'logic 1']):
-            wire_L2.loc[index, 'Result'] = 'no action required'
-        elif (wire_L2.loc[index, 'logic 1']) & (wire_L2.loc[index, 'logic 2']):
-            wire_L2.loc[index, 'Result'] = 'verify on site'
-        elif ((wire_L2.loc[index, 'logic 1']) & (~wire_L2.loc[index, 'logic 2'])):
-            wire_L2.loc[index, 'Result'] = 'confirmed valid L2'
+    previous_2 = find_repeated['Previous']
+    previous_2 = previous_2[previous_2['ID'].astype(str).isin(wire_L2['ID'].astype(str))].dropna(axis=1, how='all')
+    previous_columns = sorted([column for column in previous_2.columns if re.match(r'^Previous \d+$', str(column))],
+                              key=lambda column: int(column.split()[1]))[-(months - 1):]
+    previous_2 = previous_2[['ID'] + previous_columns]
 
-    wire_L2['ID_num'] = wire_L2['ID'].str.extract(r'_W(\d+)').astype(int)
-    wire_L2 = wire_L2.sort_values(by='ID_num').drop(columns='ID_num')
-except Exception as err:
-    print('ERROR: ' + str(err))
-    input('Press Enter to exit')
-    exit()
-
-# ---------- Saves report at chosen directory ----------
-try:    
-    print('Saving as Excel at', datetime.now())
-    print('Done!')
-    input('Press Enter to select save location')
-    directory = filedialog.askdirectory()
-    final_path = directory + '/' + current_date + ' Wire Wear L2 Trend Report.xlsx'
-    print('Saving at ' + directory)
+    wire_L2 = wire_L2.merge(right=previous_2, on='ID').reset_index(drop=True)
+    return wire_L2, previous_columns, current_date
+
+
+def select_previous_reports(wire_L2, previous_columns, current_date, months, history_reports, catalog, executor):
+    """
+    Selects the previous Exception Reports, and the Catenary Reports of the months not in the Find Repeated Report,
+    and starts reading each of them in the executor as soon as it is selected.
+
+    Args:
+        wire_L2 (DataFrame): The L2 wire wear exceptions with their Previous columns.
+        previous_columns (list[str]): The Previous columns, from the earliest to the latest.
+        current_date (str): The date of the current month, dd-mm-YYYY.
+        months (int): The number of months in the trend.
+        history_reports (list[str]): The previous reports found in the exception history, or None.
+        catalog (DataFrame): The reports of each date, as returned by find_month_reports or read_month_manifest, or None.
+        executor (Executor): The executor reading the reports.
+
+    Returns:
+        (list[tuple]): The Previous column (or None), Exception Report path, its future, Catenary Report path (or None)
+            and its future (or None) of each previous month, from the latest to the earliest.
+    """
+    previous_reports = []
+    before = datetime.strptime(current_date, '%d-%m-%Y').strftime('%Y%m%d')
+    for month in range(1, months):
+        id_column = previous_columns[-month] if month <= len(previous_columns) else None
+        if id_column is not None:
+            date_str = wire_L2[id_column].iloc[0][:8]
+            print('Selecting Previous ' + str(month) + ' Exception Report (' +
+                  re.search(r'(.*?_W)', wire_L2[id_column].iloc[0]).group(1)[:-2] + '): ')
+        else:
+            date_str = None
+            print('Selecting Previous ' + str(month) + ' Exception Report')
+        exception_path = select_exception_report(history_reports, catalog, month - 1, date_str, before)
+
+        # checks if date in file name matches with date in the Previous ID
+        if id_column is not None and report_date(exception_path) != date_str:
+            raise ValueError("date in file name " + os.path.basename(exception_path) +
+                             " doesn't match with date in " + id_column + ' ' + date_str)
+        before = report_date(exception_path) or before
+
+        catenary_path = None
+        if id_column is None:
+            print('Selecting Catenary Report of ' + os.path.basename(exception_path).split('_Exception Report')[0])
+            catenary_path = select_catenary_report(catalog, report_date(exception_path))
+
+        previous_reports.append((id_column, exception_path, executor.submit(read_wear_exception, exception_path),
+                                 catenary_path, None if catenary_path is None else executor.submit(read_catenary_report, catenary_path)))
+    return previous_reports
+
+
+def load_previous_months(previous_reports):
+    """
+    Waits for the previous reports to be read.
+
+    Args:
+        previous_reports (list[tuple]): The previous reports as returned by select_previous_reports.
+
+    Returns:
+        (list[dict]): The previous months as taken by build_trend, from the latest to the earliest.
+    """
+    previous_months = []
+    for id_column, exception_path, exception_future, catenary_path, catenary_future in previous_reports:
+        for path, future in [(exception_path, exception_future), (catenary_path, catenary_future)]:
+            if future is not None and future.exception() is not None:
+                raise ValueError(str(future.exception()) + ' in ' + path) from future.exception()
+        previous_months.append({'exceptions': exception_future.result(), 'id column': id_column,
+                                'catenary': None if catenary_future is None else catenary_future.result(),
+                                'path': exception_path})
+    return previous_months
+
+
+def read_previous_months(wire_L2, previous_columns, current_date, months, history_reports, catalog, workers=None):
+    """
+    Selects the previous reports and reads them in worker processes, each one as soon as it is selected.
+
+    The workers are shut down when the reports are read or a selection or a read fails.
+
+    Args:
+        wire_L2 (DataFrame): The L2 wire wear exceptions of the Find Repeated Report with their Previous columns.
+        previous_columns (list[str]): The Previous columns of the Find Repeated Report, from the earliest to the latest.
+        current_date (str): The date of the current month, dd-mm-YYYY.
+        months (int): The number of months in the trend.
+        history_reports (list[str]): The previous reports found in the exception history, or None.
+        catalog (DataFrame): The reports of each date, or None to select them in a dialog.
+        workers (int): The number of worker processes reading the reports. Defaults to one per report, at most 8.
+
+    Returns:
+        (list[dict]): The previous months as taken by build_trend, from the latest to the earliest.
+    """
+    with ProcessPoolExecutor(max_workers=workers or min(8, 2 * (months - 1))) as executor:
+        previous_reports = select_previous_reports(wire_L2, previous_columns, current_date, months, history_reports,
+                                                   catalog, executor)
+        return load_previous_months(previous_reports)
+
+
+def generate_trend(find_repeated_path, catalog=None, months=trend_months, method='least squares', use_history=True,
+                   workers=None):
+    """
+    Generates the wire wear L2 trend without any prompt.
+
+    The previous Exception Reports are taken from the exception history if they are all there, or else from the
+    catalog, and the Catenary Reports from the catalog. All the reports are read at the same time in worker processes.
+
+    Args:
+        find_repeated_path (str): The path to the Find Repeated Report of the current month.
+        catalog (DataFrame): The reports of each date, as returned by find_month_reports or read_month_manifest.
+            Defaults to None, only allowed if all the reports are in the exception history and no Catenary Report
+            is needed.
+        months (int): The number of months in the trend. Defaults to trend_months.
+        method (str): The regression of the trend, one of regression_methods. Defaults to 'least squares'.
+        use_history (bool): Whether to take the previous Exception Reports from the exception history. Defaults to True.
+        workers (int): The number of worker processes reading the reports. Defaults to one per report, at most 8.
+
+    Returns:
+        wire_L2 (DataFrame): The exceptions with the wear in each month and their trend, sorted by ID.
+        dates (DataFrame): The date (dd-mm-YYYY) and days before the current date of each month.
+        database_df (DataFrame): The wear exceptions of all the previous months.
+        catenary_df (DataFrame): The Catenary Reports side by side.
+    """
+    if months < 2:
+        raise ValueError('The trend needs at least 2 months, not ' + str(months))
+    wire_L2, previous_columns, current_date = read_find_repeated(find_repeated_path, months)
+
+    history_reports = find_history_reports(wire_L2[previous_columns[-1]].iloc[0], months - 1) \
+        if use_history and previous_columns else None
+    if catalog is None and (history_reports is None or months - 1 > len(previous_columns)):
+        raise ValueError('A folder or manifest of the previous reports is needed for ' + str(months) + ' months')
+
+    previous_months = read_previous_months(wire_L2, previous_columns, current_date, months, history_reports, catalog,
+                                           workers)
+    return build_trend(wire_L2, current_date, previous_months, method)
+
+
+def layout_template(ws, previous_count, months):
+    """
+    Lays out the header of the template for the number of Previous IDs and months of the report.
+
+    The template is laid out for template_previous Previous IDs and template_months months and is left as it is
+    for them. Otherwise the header from the Previous column on is written again with the styles of the template.
+
+    Args:
+        ws (Worksheet): The template sheet.
+        previous_count (int): The number of Previous IDs of each exception.
+        months (int): The number of months in the trend.
+    """
+    if (previous_count, months) == (template_previous, template_months):
+        return
+    header_style = copy.copy(ws['A1']._style)
+    wrap_style = copy.copy(ws['U1']._style)
+    date_style = copy.copy(ws['I2']._style)
+    days_style = copy.copy(ws['I3']._style)
+    titles = [ws['U1'].value, ws['V1'].value, ws['W1'].value]
+    widths = {'Previous': ws.column_dimensions['G'].width, 'date': ws.column_dimensions['I'].width,
+              'Result': ws.column_dimensions['W'].width}
+
+    for merged in list(ws.merged_cells.ranges):
+        if merged.min_col >= 7:
+            ws.unmerge_cells(str(merged))
+    for row in ws.iter_rows(min_row=1, max_row=3, min_col=7, max_col=ws.max_column):
+        for cell in row:
+            cell.value = None
+            cell._style = copy.copy(ws['X1']._style)
+    for letter in list(ws.column_dimensions):
+        if openpyxl.utils.column_index_from_string(letter) >= 7:
+            del ws.column_dimensions[letter]
+
+    def write_header(column, title, style, span=1):
+        ws.cell(row=1, column=column, value=title)._style = copy.copy(style)
+        ws.merge_cells(start_row=1, start_column=column, end_row=3, end_column=column + span - 1)
+
+    column = 7
+    if previous_count:
+        write_header(column, 'Previous', header_style, previous_count)
+        ws.column_dimensions[openpyxl.utils.get_column_letter(column)].width = widths['Previous']
+        column += previous_count
+    for i in range(months):
+        ws.cell(row=1, column=column + i)._style = copy.copy(header_style)
+        ws.cell(row=2, column=column + i)._style = copy.copy(date_style)
+        ws.cell(row=3, column=column + i)._style = copy.copy(days_style)
+        ws.column_dimensions[openpyxl.utils.get_column_letter(column + i)].width = widths['date']
+    column += months
+    for i in range(months):
+        write_header(column + i, 'trd pt' + str(i + 1), header_style)
+    column += months
+    write_header(column, titles[0], wrap_style)
+    write_header(column + 1, titles[1], wrap_style)
+    write_header(column + 2, titles[2], header_style)
+    ws.column_dimensions[openpyxl.utils.get_column_letter(column + 2)].width = widths['Result']
+
+
+def write_trend_report(wire_L2, dates, database_df, catenary_df, directory, template=template_path):
+    """
+    Saves the trend report from the template.
+
+    Args:
+        wire_L2 (DataFrame): The exceptions with their trend, as returned by build_trend.
+        dates (DataFrame): The date and days of each month, as returned by build_trend.
+        database_df (DataFrame): The wear exceptions of all the previous months.
+        catenary_df (DataFrame): The Catenary Reports side by side.
+        directory (str): The directory to save the report in.
+        template (str): The path to the template. Defaults to template_path.
+
+    Returns:
+        (str): The path to the saved report.
+    """
+    final_path = directory + '/' + dates['date'].iloc[0] + ' Wire Wear L2 Trend Report.xlsx'
+    previous_count = len([column for column in wire_L2.columns if re.match(r'^Previous \d+$', str(column))])
 
     # copies and writes the template before writing the report
     # writes the months, date and days
-    wb = openpyxl.load_workbook('./Wire Wear L2 Trend Report Template.xlsx')
+    wb = openpyxl.load_workbook(template)
     ws = wb['template']
     ws.title = 'Summary'
+    layout_template(ws, previous_count, len(dates))
 
+    dates = dates.transpose().reset_index(drop=True)
     for row_index, row in dates.iterrows():
         for col_index, value in enumerate(row):
-            # print(value)
-            ws.cell(row=row_index + 2, column=9 + col_index, value=value)
+            ws.cell(row=row_index + 2, column=7 + previous_count + col_index, value=value)
 
     wb.save(final_path)
 
@@ -276,16 +761,120 @@ try:
         wire_L2.to_excel(writer, sheet_name='Summary', startrow=3, header=None, index=False)
         database_df.to_excel(writer, sheet_name='Database', index=False)
         catenary_df.to_excel(writer, sheet_name='Catenary', startrow=1, index=False)
-except FileNotFoundError:
-    print(f"ERROR: file 'Wire Wear L2 Trend Report Template.xlsx' is not found in the current directory")
-    input('Press Enter to exit')
-    exit()
-except KeyError:
-    print(f"ERROR: worksheet 'template' is not found in 'Wire Wear L2 Trend Report Template.xlsx'")
-    input('Press Enter to exit')
-    exit()
-except Exception as err:
-    print(err)
-    input('Press Enter to exit')
-    exit()
-# ---------- Saves report at chosen directory ----------
+    return final_path
+
+
+def main():
+    import tkinter as tk
+    from tkinter import filedialog
+
+    print('Before you start, please go through the following instructions.')
+    print('1. Please prepare the Find Repeated Report of 3 Exception Reports.')
+    print('2. Please prepare the previous Exception Reports of the months in the trend, e.g. 5 for a 6 month trend.')
+    print('3. Please prepare the Catenary Reports of the months not in the Find Repeated Report, '
+          'e.g. previous 3, 4, and 5 months for a 6 month trend.')
+    print('4. The previous reports can also be put in one folder or listed in a manifest .csv '
+          'with the columns date, exception and catenary.')
+    print('5. To run without any prompt, e.g. as a scheduled job, use batch_trend.py.\n')
+    input('Press Enter to continue...')
+    print()
+
+    months = input('Number of months in the trend (press Enter for ' + str(trend_months) + '): ').strip()
+    while not (months == '' or (months.isdigit() and int(months) >= 2)):
+        months = input('Please input a number of at least 2: ').strip()
+    months = int(months) if months else trend_months
+    method = input('Regression, ' + ' / '.join(regression_methods) + ' (press Enter for least squares): ').strip()
+    while method not in regression_methods + ['']:
+        method = input('Please input one of ' + ' / '.join(regression_methods) + ': ').strip()
+    method = method or 'least squares'
+
+    # inputs and reads find repeated report
+    try:
+        print('Please select the Find Repeated Report after 1 second...')
+        time.sleep(1)
+        root = tk.Tk()
+        root.withdraw()
+        path = filedialog.askopenfilename()
+        print('Selected: ' + os.path.basename(path) + '\n')
+
+        # checks the date of the current month in the file name
+        if report_date(path) is None:
+            print('ERROR: No date or invalid date found in the file name ' + path)
+            print('Please make sure file name has valid date format of year-month-date, for example, 20240813')
+            input('Press Enter to exit')
+            exit()
+        wire_L2, previous_columns, current_date = read_find_repeated(path, months)
+    except KeyError as err:
+        print('ERROR: Invalid or missing column names in ' + path)
+        input('Press Enter to exit')
+        exit()
+    except Exception as err:
+        print('ERROR: ' + str(err) + ' in ' + path)
+        input('Press Enter to exit')
+        exit()
+
+    # takes the previous Exception Reports from the exception history if they are all there
+    history_reports = find_history_reports(wire_L2[previous_columns[-1]].iloc[0], months - 1) \
+        if previous_columns else None
+
+    # or else from a folder or a manifest of the previous reports
+    catalog = None
+    if history_reports is None:
+        source = input('Select the previous reports from a folder or a manifest? [folder/manifest/n]: ').strip()
+        while source not in ['folder', 'manifest', 'n', '']:
+            source = input('Please input folder, manifest or n: ').strip()
+        try:
+            if source == 'folder':
+                catalog = find_month_reports(filedialog.askdirectory())
+            elif source == 'manifest':
+                catalog = read_month_manifest(filedialog.askopenfilename())
+        except Exception as err:
+            print('ERROR: ' + str(err))
+            input('Press Enter to exit')
+            exit()
+
+    # inputs the previous Exception Reports, and the Catenary Reports of the months not in the Find Repeated Report,
+    # the selected reports are read in worker processes while the next ones are being selected
+    try:
+        previous_months = read_previous_months(wire_L2, previous_columns, current_date, months, history_reports,
+                                               catalog)
+    except Exception as err:
+        print('ERROR: ' + str(err))
+        input('Press Enter to exit')
+        exit()
+
+    # looks up the wear of each previous month and fits the trend
+    try:
+        wire_L2, dates, database_df, catenary_df = build_trend(wire_L2, current_date, previous_months, method)
+    except Exception as err:
+        print('ERROR: ' + str(err))
+        input('Press Enter to exit')
+        exit()
+
+    # ---------- Saves report at chosen directory ----------
+    try:    
+        print('Saving as Excel at', datetime.now())
+        print('Done!')
+        input('Press Enter to select save location')
+        directory = filedialog.askdirectory()
+        print('Saving at ' + directory)
+        write_trend_report(wire_L2, dates, database_df, catenary_df, directory)
+    except FileNotFoundError:
+        print(f"ERROR: file 'Wire Wear L2 Trend Report Template.xlsx' is not found in the current directory")
+        input('Press Enter to exit')
+        exit()
+    except KeyError:
+        print(f"ERROR: worksheet 'template' is not found in 'Wire Wear L2 Trend Report Template.xlsx'")
+        input('Press Enter to exit')
+        exit()
+    except Exception as err:
+        print(err)
+        input('Press Enter to exit')
+        exit()
+    # ---------- Saves report at chosen directory ----------
+
+
+if __name__ == "__main__":
+    # the reports are read in worker processes, which needs freeze_support in a frozen Windows executable
+    multiprocessing.freeze_support()
+    main()